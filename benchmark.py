@@ -0,0 +1,284 @@
+"""
+Microbenchmarks for the voting hot paths of the simulation.
+
+Each benchmark runs on a seeded synthetic population (1k to 1M users by
+default) with an ELO spread like a grown simulation: a block of users who
+never moved off the starting 800, and a spread correlated with goodness for
+everyone else. Timings are reported per post and per voter, appended to a
+JSON history, and can be compared against an earlier entry to flag
+regressions.
+
+Example:
+    python benchmark.py --sizes 1000 100000 --compare
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from simulation import (
+    DEFAULT_CONFIG,
+    Post,
+    calculate_sample_size,
+    elo_update_team,
+    multi_stage_voting,
+    population_sample_voting,
+    SimulationRNG,
+    stage_voting,
+    UserPopulation,
+)
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DEFAULT_HISTORY = "bench_history.json"
+
+
+def synthetic_population(size, seed=0, untouched_share=0.3):
+    """
+    Build a population whose ELO spread resembles a grown simulation.
+
+    Args:
+        size: Number of users
+        seed: Seed for both the users and their ratings
+        untouched_share: Share of users left at the starting ELO of 800
+
+    Returns:
+        UserPopulation: Population with a rebuilt rank index
+    """
+    population = UserPopulation(capacity=size)
+    population.spawn(size, rng=SimulationRNG(seed))
+    rng = np.random.default_rng(seed)
+    goodness = population.goodness
+    skill = (goodness - goodness.mean()) / goodness.std()
+    elo = 800 + 45 * skill + rng.normal(0, 30, size)
+    elo[rng.random(size) < untouched_share] = 800
+    population.elo[:] = elo
+    population.reindex()
+    return population
+
+
+def _time(run, posts, repeats, setup=None):
+    """
+    Best and median seconds per call of `run` over `posts` calls.
+
+    `setup`, if given, is called untimed before every repeat.
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for i in range(posts):
+            run(i)
+        timings.append((time.perf_counter() - start) / posts)
+    return min(timings), statistics.median(timings)
+
+
+def bench_population(population, posts, repeats, seed=0):
+    """
+    Time every hot path on one population.
+
+    Returns:
+        dict: Benchmark name -> timing entry with seconds per post and, where
+        the function evaluates voters, seconds per voter
+    """
+    rng = SimulationRNG(seed)
+    size = len(population)
+    post_list = [Post(i, rng) for i in range(posts)]
+    stage_users = [population[i] for i in range(min(size, 10))]
+    voters = {}
+    columns = {name: getattr(population, name).copy() for name in population.COLUMNS}
+
+    def restore_population():
+        # Voting moves ratings, so every repeat starts from the synthetic state
+        for name, values in columns.items():
+            getattr(population, name)[:] = values
+        population.reindex()
+
+    def run_stage_voting(i):
+        votes, _ = stage_voting(stage_users, post_list[i], rng=rng)
+        voters["stage_voting"] = voters.get("stage_voting", 0) + len(votes)
+
+    def run_multi_stage_voting(i):
+        result = multi_stage_voting(post_list[i], population, DEFAULT_CONFIG, rng=rng)
+        voters["multi_stage_voting"] = (
+            voters.get("multi_stage_voting", 0) + result[2] + len(result[5])
+        )
+
+    def run_population_sample_voting(i):
+        _, _, sample_size = population_sample_voting(post_list[i], population, rng=rng)
+        voters["population_sample_voting"] = (
+            voters.get("population_sample_voting", 0) + sample_size
+        )
+
+    def run_population_sample_voting_sequential(i):
+        _, _, sample_size = population_sample_voting(
+            post_list[i], population, rng=rng, batch_size=25
+        )
+        voters["population_sample_voting_sequential"] = (
+            voters.get("population_sample_voting_sequential", 0) + sample_size
+        )
+
+    def run_elo_update_team(i):
+        elo_update_team(800 + i, 810, k=32, winner_size=3, loser_size=2)
+
+    def run_calculate_sample_size(i):
+        calculate_sample_size.__wrapped__(0.95, 0.05, size - i)
+
+    def run_calculate_sample_size_cached(i):
+        calculate_sample_size(0.95, 0.05, size)
+
+    benchmarks = {
+        "stage_voting": run_stage_voting,
+        "multi_stage_voting": run_multi_stage_voting,
+        "population_sample_voting": run_population_sample_voting,
+        "population_sample_voting_sequential": run_population_sample_voting_sequential,
+        "elo_update_team": run_elo_update_team,
+        "calculate_sample_size": run_calculate_sample_size,
+        "calculate_sample_size_cached": run_calculate_sample_size_cached,
+    }
+    # Benchmarks that write ELO changes into the population
+    stateful = {"stage_voting", "multi_stage_voting"}
+    results = {}
+    for name, run in benchmarks.items():
+        setup = restore_population if name in stateful else None
+        best, median = _time(run, posts, repeats, setup)
+        entry = {"per_post_s": best, "per_post_median_s": median}
+        if name in voters:
+            voters_per_post = voters[name] / (posts * repeats)
+            entry["voters_per_post"] = voters_per_post
+            entry["per_voter_s"] = best / voters_per_post if voters_per_post else None
+        results[f"{name}[N={size}]"] = entry
+        if setup is not None:
+            restore_population()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(previous, current, threshold):
+    """
+    Compare per-post timings of two history entries.
+
+    Returns:
+        list: (name, previous seconds, current seconds, relative change) for
+        every benchmark that got slower by more than `threshold`
+    """
+    regressions = []
+    for name, entry in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        change = entry["per_post_s"] / before["per_post_s"] - 1
+        if change > threshold:
+            regressions.append((name, before["per_post_s"], entry["per_post_s"], change))
+    return regressions
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1e6:10.2f} us"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--posts", type=int, default=200, help="Posts per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=DEFAULT_HISTORY)
+    parser.add_argument(
+        "--no-record", action="store_true", help="Do not append to the history"
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Compare against an earlier history entry and exit 1 on regressions",
+    )
+    parser.add_argument(
+        "--against",
+        type=int,
+        default=-1,
+        help="History index to compare against (default: the latest entry)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown flagged as a regression (default: 0.10)",
+    )
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    results = {}
+    for size in args.sizes:
+        population = synthetic_population(size, seed=args.seed)
+        results.update(bench_population(population, args.posts, args.repeats, args.seed))
+
+    print(f"{'benchmark':45} {'per post':>13} {'per voter':>13}")
+    for name, entry in results.items():
+        print(
+            f"{name:45} {_format_seconds(entry['per_post_s'])} "
+            f"{_format_seconds(entry.get('per_voter_s'))}"
+        )
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "posts": args.posts,
+        "repeats": args.repeats,
+        "seed": args.seed,
+        "results": results,
+    }
+
+    status = 0
+    if args.compare and history:
+        previous = history[args.against]
+        regressions = compare(previous, run, args.threshold)
+        print(
+            f"\nCompared with {previous['timestamp']} ({previous.get('commit')}): "
+            f"{len(regressions)} regression(s) above {args.threshold:.0%}"
+        )
+        for name, before, after, change in regressions:
+            print(
+                f"  {name}: {_format_seconds(before)} -> {_format_seconds(after)} "
+                f"(+{change:.0%})"
+            )
+        status = 1 if regressions else 0
+
+    if not args.no_record:
+        history.append(run)
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
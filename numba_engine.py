@@ -0,0 +1,698 @@
+"""
+Numba backend for the staged voting of `simulation.simulate`.
+
+The whole per-post pipeline of `multi_stage_voting` (tier lookup, sampling,
+voting, team ELO updates and the special low-ELO stage) is compiled into one
+kernel that runs a chunk of posts over the population's column arrays. It
+consumes each post's uniforms in the layout described on `Engine`, so for the
+same seed it makes exactly the decisions of the reference Python backend;
+`get_engine("check")` runs both and asserts that they agree.
+
+Tiers are looked up in an array version of `EloRankIndex`: fixed-capacity
+buckets of (elo, id) keys in ascending order, separator keys per bucket and a
+Fenwick tree over the bucket lengths. It is rebuilt from the elo column at the
+start of every growth tick and re-laid out whenever a bucket overflows.
+
+numba is optional; importing this module without it raises ImportError.
+"""
+
+import numpy as np
+from numba import njit
+
+from simulation import (
+    DECISION_CODES,
+    ENGINE_COLUMNS,
+    Engine,
+    NULL_TRACE,
+    TRACE_DTYPE,
+    TRACE_STAGE_CODES,
+)
+
+LOAD = 512
+BUCKET_CAPACITY = 2 * LOAD
+
+UPVOTE = DECISION_CODES["upvote"]
+DOWNVOTE = DECISION_CODES["downvote"]
+DRAW = DECISION_CODES["draw"]
+
+STAGE1 = TRACE_STAGE_CODES["stage1"]
+STAGE2 = TRACE_STAGE_CODES["stage2"]
+SPECIAL = TRACE_STAGE_CODES["special"]
+
+
+@njit(cache=True)
+def _less(elo_a, id_a, elo_b, id_b):
+    return elo_a < elo_b or (elo_a == elo_b and id_a < id_b)
+
+
+@njit(cache=True)
+def _build_tree(bucket_len, tree, bucket_count):
+    tree[:] = 0
+    for i in range(bucket_count):
+        tree[i + 1] = bucket_len[i]
+    for i in range(1, bucket_count + 1):
+        parent = i + (i & -i)
+        if parent <= bucket_count:
+            tree[parent] += tree[i]
+
+
+@njit(cache=True)
+def _layout(keys_elo, keys_id, n, index):
+    """Spread `n` sorted keys over the buckets, LOAD per bucket."""
+    bucket_elo, bucket_id, bucket_len, max_elo, max_id, tree, meta = index
+    bucket_count = max(1, (n + LOAD - 1) // LOAD)
+    bucket_len[:] = 0
+    for i in range(n):
+        bucket, offset = divmod(i, LOAD)
+        bucket_elo[bucket, offset] = keys_elo[i]
+        bucket_id[bucket, offset] = keys_id[i]
+        bucket_len[bucket] = offset + 1
+    for bucket in range(bucket_count):
+        if bucket_len[bucket]:
+            max_elo[bucket] = bucket_elo[bucket, bucket_len[bucket] - 1]
+            max_id[bucket] = bucket_id[bucket, bucket_len[bucket] - 1]
+        else:
+            max_elo[bucket] = -np.inf
+            max_id[bucket] = -1
+    meta[0] = bucket_count
+    meta[1] = n
+    _build_tree(bucket_len, tree, bucket_count)
+
+
+@njit(cache=True)
+def _relayout(index):
+    bucket_elo, bucket_id, bucket_len, max_elo, max_id, tree, meta = index
+    n = meta[1]
+    keys_elo = np.empty(n, dtype=np.float64)
+    keys_id = np.empty(n, dtype=np.int64)
+    i = 0
+    for bucket in range(meta[0]):
+        for offset in range(bucket_len[bucket]):
+            keys_elo[i] = bucket_elo[bucket, offset]
+            keys_id[i] = bucket_id[bucket, offset]
+            i += 1
+    _layout(keys_elo, keys_id, n, index)
+
+
+@njit(cache=True)
+def _prefix(tree, position):
+    total = 0
+    i = position
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+
+@njit(cache=True)
+def _tree_add(tree, bucket_count, position, delta):
+    i = position + 1
+    while i <= bucket_count:
+        tree[i] += delta
+        i += i & -i
+
+
+@njit(cache=True)
+def _find_bucket(index, elo, user_id):
+    """First bucket whose separator key is >= (elo, user_id), else the last one."""
+    max_elo, max_id, meta = index[3], index[4], index[6]
+    lo = 0
+    hi = meta[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _less(max_elo[mid], max_id[mid], elo, user_id):
+            lo = mid + 1
+        else:
+            hi = mid
+    return min(lo, meta[0] - 1)
+
+
+@njit(cache=True)
+def _find_offset(index, bucket, elo, user_id):
+    bucket_elo, bucket_id, bucket_len = index[0], index[1], index[2]
+    lo = 0
+    hi = bucket_len[bucket]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _less(bucket_elo[bucket, mid], bucket_id[bucket, mid], elo, user_id):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True)
+def _remove(index, elo, user_id):
+    bucket_elo, bucket_id, bucket_len, max_elo, max_id, tree, meta = index
+    bucket = _find_bucket(index, elo, user_id)
+    offset = _find_offset(index, bucket, elo, user_id)
+    length = bucket_len[bucket]
+    for i in range(offset, length - 1):
+        bucket_elo[bucket, i] = bucket_elo[bucket, i + 1]
+        bucket_id[bucket, i] = bucket_id[bucket, i + 1]
+    # The separator key stays, so it still divides the neighbouring buckets
+    bucket_len[bucket] = length - 1
+    meta[1] -= 1
+    _tree_add(tree, meta[0], bucket, -1)
+
+
+@njit(cache=True)
+def _insert(index, elo, user_id):
+    bucket_elo, bucket_id, bucket_len, max_elo, max_id, tree, meta = index
+    bucket = _find_bucket(index, elo, user_id)
+    if bucket_len[bucket] == BUCKET_CAPACITY:
+        _relayout(index)
+        bucket = _find_bucket(index, elo, user_id)
+    offset = _find_offset(index, bucket, elo, user_id)
+    for i in range(bucket_len[bucket], offset, -1):
+        bucket_elo[bucket, i] = bucket_elo[bucket, i - 1]
+        bucket_id[bucket, i] = bucket_id[bucket, i - 1]
+    bucket_elo[bucket, offset] = elo
+    bucket_id[bucket, offset] = user_id
+    bucket_len[bucket] += 1
+    if _less(max_elo[bucket], max_id[bucket], elo, user_id):
+        max_elo[bucket] = elo
+        max_id[bucket] = user_id
+    meta[1] += 1
+    _tree_add(tree, meta[0], bucket, 1)
+
+
+@njit(cache=True)
+def _count_at_most(index, threshold):
+    """Number of users with a rating <= threshold."""
+    bucket_elo, bucket_len, max_elo, tree, meta = (
+        index[0],
+        index[2],
+        index[3],
+        index[5],
+        index[6],
+    )
+    lo = 0
+    hi = meta[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if max_elo[mid] <= threshold:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo == meta[0]:
+        return meta[1]
+    low = 0
+    high = bucket_len[lo]
+    while low < high:
+        mid = (low + high) // 2
+        if bucket_elo[lo, mid] <= threshold:
+            low = mid + 1
+        else:
+            high = mid
+    return _prefix(tree, lo) + low
+
+
+@njit(cache=True)
+def _id_at(index, rank):
+    """Id of the user at `rank` in ascending (elo, id) order."""
+    bucket_id, tree, meta = index[1], index[5], index[6]
+    position = 0
+    remaining = rank
+    step = 1
+    while step * 2 <= meta[0]:
+        step *= 2
+    while step:
+        nxt = position + step
+        if nxt <= meta[0] and tree[nxt] <= remaining:
+            position = nxt
+            remaining -= tree[nxt]
+        step //= 2
+    return bucket_id[position, remaining]
+
+
+@njit(cache=True)
+def _select(index, start, stop, count, uniforms, cursor, out):
+    """
+    Ranks [start, stop) in order if they number at most `count`, otherwise a
+    Floyd sample of `count` of them. Returns (selected, new cursor).
+    """
+    if stop - start <= count:
+        for i in range(stop - start):
+            out[i] = _id_at(index, start + i)
+        return stop - start, cursor
+    population_size = stop - start
+    chosen = np.empty(count, dtype=np.int64)
+    for j in range(count):
+        upper = population_size - count + j
+        value = int(uniforms[cursor] * (upper + 1))
+        cursor += 1
+        for i in range(j):
+            if chosen[i] == value:
+                value = upper
+                break
+        chosen[j] = value
+        out[j] = _id_at(index, start + value)
+    return count, cursor
+
+
+@njit(cache=True)
+def _cast_votes(ids, m, quality, u, cursor, columns, up):
+    """`_cast_vote_array` for `m` voters; returns the new cursor."""
+    _, goodness, mood_factor, adjusted_goodness, vote_count = columns
+    upvote_is_correct = quality >= 0.5
+    for i in range(m):
+        user_id = ids[i]
+        g = goodness[user_id]
+        # Mood swing: with probability mood_factor, scale goodness by up to 25%
+        adjustment = 0.25 * u[cursor + m + i]
+        if u[cursor + 2 * m + i] < 0.5:
+            swung = min(1.0, g * (1 + adjustment))
+        else:
+            swung = max(0.0, g * (1 - adjustment))
+        adjusted = swung if u[cursor + i] < mood_factor[user_id] else g
+        # Vote correctly with probability adjusted_goodness, otherwise flip a coin
+        if u[cursor + 3 * m + i] < adjusted:
+            up[i] = upvote_is_correct
+        else:
+            up[i] = u[cursor + 4 * m + i] < 0.5
+        adjusted_goodness[user_id] = adjusted
+        vote_count[user_id] += 1
+    return cursor + 5 * m
+
+
+@njit(cache=True)
+def _add_elo(ids, n, delta, elo, index, pending):
+    """`UserPopulation.add_elo` of one delta, held back while pending[2][0] >= 0."""
+    pending_ids, pending_deltas, pending_count = pending
+    if pending_count[0] >= 0:
+        for i in range(n):
+            pending_ids[pending_count[0]] = ids[i]
+            pending_deltas[pending_count[0]] = delta
+            pending_count[0] += 1
+        return
+    for i in range(n):
+        user_id = ids[i]
+        old = elo[user_id]
+        new = old + delta
+        elo[user_id] = new
+        if new != old:
+            _remove(index, old, user_id)
+            _insert(index, new, user_id)
+
+
+@njit(cache=True)
+def _team_elo(winners, n_winners, losers, n_losers, k, elo, index, pending):
+    """`apply_team_elo`, with the same left-to-right team sums."""
+    winner_sum = 0.0
+    for i in range(n_winners):
+        winner_sum += elo[winners[i]]
+    loser_sum = 0.0
+    for i in range(n_losers):
+        loser_sum += elo[losers[i]]
+    winner_avg_elo = winner_sum / n_winners
+    loser_avg_elo = loser_sum / n_losers
+    # elo_update_team
+    expected_score_winner = 1 / (1 + 10.0 ** ((loser_avg_elo - winner_avg_elo) / 400))
+    expected_score_loser = 1 - expected_score_winner
+    change_per_winner = k * (1 - expected_score_winner) / n_winners
+    change_per_loser = k * (0 - expected_score_loser) / n_losers
+    _add_elo(winners, n_winners, change_per_winner, elo, index, pending)
+    _add_elo(losers, n_losers, change_per_loser, elo, index, pending)
+    return change_per_winner, change_per_loser
+
+
+@njit(cache=True)
+def _trace_votes(trace, post, stage, ids, m, up, elo):
+    """
+    Record `m` votes with unchanged ratings; returns their first row, or -1
+    when the trace is off (a count of -1).
+    """
+    posts, users, elo_before, elo_after, stages, votes, count = trace
+    start = count[0]
+    if start < 0:
+        return -1
+    for i in range(m):
+        row = start + i
+        posts[row] = post
+        users[row] = ids[i]
+        elo_before[row] = elo[ids[i]]
+        elo_after[row] = elo[ids[i]]
+        stages[row] = stage
+        votes[row] = up[i]
+    count[0] = start + m
+    return start
+
+
+@njit(cache=True)
+def _trace_changes(trace, start, m, up, upvote_wins, winner_change, loser_change):
+    """Add each voter's ELO change to the rows written by `_trace_votes`."""
+    if start < 0:
+        return
+    elo_before = trace[2]
+    elo_after = trace[3]
+    for i in range(m):
+        change = winner_change if up[i] == upvote_wins else loser_change
+        elo_after[start + i] = elo_before[start + i] + change
+
+
+@njit(cache=True)
+def _split_teams(ids, m, up, upvote_wins, scratch):
+    """Voters on the winning and the losing side, in voting order."""
+    _, winners, losers = scratch
+    n_winners = 0
+    n_losers = 0
+    for i in range(m):
+        if up[i] == upvote_wins:
+            winners[n_winners] = ids[i]
+            n_winners += 1
+        else:
+            losers[n_losers] = ids[i]
+            n_losers += 1
+    return n_winners, n_losers
+
+
+@njit(cache=True)
+def _stage(
+    ids,
+    m,
+    quality,
+    u,
+    cursor,
+    params,
+    columns,
+    index,
+    pending,
+    scratch,
+    trace,
+    post,
+    stage,
+):
+    """`stage_voting_kernel`; returns (decision, new cursor)."""
+    up, winners, losers = scratch
+    forfeit_bonus = params[7]
+    k = params[8]
+    cursor = _cast_votes(ids, m, quality, u, cursor, columns, up)
+    traced = _trace_votes(trace, post, stage, ids, m, up, columns[0])
+    upvote_count = 0
+    for i in range(m):
+        upvote_count += up[i]
+    downvote_count = m - upvote_count
+    if upvote_count > downvote_count:
+        decision = UPVOTE
+    elif downvote_count > upvote_count:
+        decision = DOWNVOTE
+    else:
+        return DRAW, cursor
+    n_winners, n_losers = _split_teams(ids, m, up, decision == UPVOTE, scratch)
+    elo = columns[0]
+    if not n_losers:
+        if m > 1 and forfeit_bonus:
+            # Forfeit case: Winning team gets a small fixed number of points
+            _add_elo(winners, n_winners, forfeit_bonus, elo, index, pending)
+            _trace_changes(
+                trace, traced, m, up, decision == UPVOTE, forfeit_bonus, 0.0
+            )
+    else:
+        change_per_winner, change_per_loser = _team_elo(
+            winners, n_winners, losers, n_losers, k, elo, index, pending
+        )
+        _trace_changes(
+            trace,
+            traced,
+            m,
+            up,
+            decision == UPVOTE,
+            change_per_winner,
+            change_per_loser,
+        )
+    return decision, cursor
+
+
+@njit(cache=True)
+def vote_posts_kernel(
+    qualities, uniforms, columns, index, params, out, pending, post_ids, trace
+):
+    """
+    `multi_stage_voting` for every post of a chunk.
+
+    Args:
+        qualities: Post qualities
+        uniforms: (posts x post_block_size) uniforms
+        columns: (elo, goodness, mood_factor, adjusted_goodness, vote_count)
+        index: Bucketed rank index over the elo column
+        params: elo_threshold, tier_split, consensus_threshold,
+            single_stage_threshold, stage 1 voter count, stage2_size,
+            special_stage_size, forfeit_bonus and k_factor as floats
+        out: (len(ENGINE_COLUMNS) x posts) array
+        pending: (ids, deltas, count) buffers for deferred ELO changes; a
+            count of -1 applies them right away
+        post_ids: Post ids, for the trace
+        trace: (post, user, elo_before, elo_after, stage, vote, count)
+            buffers for every vote; a count of -1 turns tracing off
+    """
+    total_users = index[6][1]
+    elo_threshold = params[0]
+    tier_split = params[1]
+    consensus_threshold = params[2]
+    single_stage_threshold = int(params[3])
+    stage1_count = int(params[4])
+    stage2_size = int(params[5])
+    special_size = int(params[6])
+
+    capacity = stage1_count + stage2_size + special_size
+    stage1 = np.empty(capacity, dtype=np.int64)
+    stage2 = np.empty(capacity, dtype=np.int64)
+    special = np.empty(capacity, dtype=np.int64)
+    scratch = (
+        np.empty(capacity, dtype=np.bool_),
+        np.empty(capacity, dtype=np.int64),
+        np.empty(capacity, dtype=np.int64),
+    )
+    up, winners, losers = scratch
+
+    for p in range(len(qualities)):
+        quality = qualities[p]
+        u = uniforms[p]
+        post = post_ids[p]
+        cursor = 0
+
+        # Group populations at this point
+        low_elo_count = _count_at_most(index, elo_threshold)
+        filtered_count = total_users - low_elo_count
+        if not filtered_count:
+            out[5, p] = 0
+            out[6, p] = 0
+            out[7, p] = total_users
+        else:
+            out[5, p] = int(tier_split * filtered_count)
+            out[6, p] = filtered_count - out[5, p]
+            out[7, p] = total_users - filtered_count
+
+        lo = low_elo_count if low_elo_count < total_users else 0
+        n_filtered = total_users - lo
+        n1 = 0
+        n2 = 0
+        if n_filtered < single_stage_threshold:
+            n1, cursor = _select(
+                index, lo, total_users, stage1_count, u, cursor, stage1
+            )
+            decision, cursor = _stage(
+                stage1,
+                n1,
+                quality,
+                u,
+                cursor,
+                params,
+                columns,
+                index,
+                pending,
+                scratch,
+                trace,
+                post,
+                STAGE1,
+            )
+        else:
+            split = lo + int(tier_split * n_filtered)
+            candidates, cursor = _select(
+                index, split, total_users, stage2_size, u, cursor, stage2
+            )
+            n1, cursor = _select(index, lo, split, stage1_count, u, cursor, stage1)
+            decision, cursor = _stage(
+                stage1,
+                n1,
+                quality,
+                u,
+                cursor,
+                params,
+                columns,
+                index,
+                pending,
+                scratch,
+                trace,
+                post,
+                STAGE1,
+            )
+            if n1 > 0:
+                upvote_count = 0
+                for i in range(n1):
+                    upvote_count += up[i]
+                upvote_ratio = upvote_count / n1
+                downvote_ratio = (n1 - upvote_count) / n1
+                if upvote_ratio >= consensus_threshold:
+                    decision = UPVOTE
+                elif downvote_ratio >= consensus_threshold:
+                    decision = DOWNVOTE
+                else:
+                    n2 = candidates
+                    decision, cursor = _stage(
+                        stage2,
+                        n2,
+                        quality,
+                        u,
+                        cursor,
+                        params,
+                        columns,
+                        index,
+                        pending,
+                        scratch,
+                        trace,
+                        post,
+                        STAGE2,
+                    )
+
+        # Special stage for users with elo <= 800
+        n_special = 0
+        if decision != DRAW:
+            low_elo_count = _count_at_most(index, elo_threshold)
+            if low_elo_count:
+                n_special, cursor = _select(
+                    index, 0, low_elo_count, special_size, u, cursor, special
+                )
+                cursor = _cast_votes(
+                    special, n_special, quality, u, cursor, columns, up
+                )
+                traced = _trace_votes(
+                    trace, post, SPECIAL, special, n_special, up, columns[0]
+                )
+                n_winners, n_losers = _split_teams(
+                    special, n_special, up, decision == UPVOTE, scratch
+                )
+                if n_winners and n_losers:
+                    change_per_winner, change_per_loser = _team_elo(
+                        winners,
+                        n_winners,
+                        losers,
+                        n_losers,
+                        params[8],
+                        columns[0],
+                        index,
+                        pending,
+                    )
+                    _trace_changes(
+                        trace,
+                        traced,
+                        n_special,
+                        up,
+                        decision == UPVOTE,
+                        change_per_winner,
+                        change_per_loser,
+                    )
+
+        out[0, p] = decision
+        out[1, p] = n1 + n2
+        out[2, p] = n1
+        out[3, p] = n2
+        out[4, p] = n_special
+
+
+class NumbaEngine(Engine):
+    """Compiled backend: the whole per-post pipeline in one Numba kernel."""
+
+    name = "numba"
+
+    def begin_tick(self, users):
+        n = len(users)
+        order = np.lexsort((np.arange(n), users.elo))
+        bucket_count = n // LOAD + 2
+        self._index = (
+            np.empty((bucket_count, BUCKET_CAPACITY), dtype=np.float64),
+            np.empty((bucket_count, BUCKET_CAPACITY), dtype=np.int64),
+            np.zeros(bucket_count, dtype=np.int64),
+            np.empty(bucket_count, dtype=np.float64),  # Separator elo
+            np.empty(bucket_count, dtype=np.int64),  # Separator id
+            np.zeros(bucket_count + 1, dtype=np.int64),  # Fenwick tree
+            np.zeros(2, dtype=np.int64),  # Bucket count, number of keys
+        )
+        _layout(users.elo[order], order.astype(np.int64), n, self._index)
+
+    def vote_posts(
+        self, users, posts, qualities, uniforms, config, out, profiler, trace=NULL_TRACE
+    ):
+        stage1_count = config.stage1_user_count(len(users))
+        params = np.array(
+            [
+                config.elo_threshold,
+                config.tier_split,
+                config.consensus_threshold,
+                config.single_stage_threshold,
+                stage1_count,
+                config.stage2_size,
+                config.special_stage_size,
+                config.forfeit_bonus,
+                config.k_factor,
+            ],
+            dtype=np.float64,
+        )
+        deferred = users._pending_elo is not None
+        # Every voter of every stage may vote, and change, once per post
+        max_votes = len(posts) * (
+            stage1_count + config.stage2_size + config.special_stage_size
+        )
+        max_changes = deferred * max_votes
+        pending = (
+            np.empty(max_changes, dtype=np.int64),
+            np.empty(max_changes, dtype=np.float64),
+            np.array([0 if deferred else -1], dtype=np.int64),
+        )
+        max_records = trace.active * max_votes
+        trace_buffers = (
+            np.empty(max_records, dtype=np.int64),
+            np.empty(max_records, dtype=np.int64),
+            np.empty(max_records, dtype=np.float64),
+            np.empty(max_records, dtype=np.float64),
+            np.empty(max_records, dtype=np.uint8),
+            np.empty(max_records, dtype=np.uint8),
+            np.array([0 if trace.active else -1], dtype=np.int64),
+        )
+        post_ids = np.array([post.id for post in posts], dtype=np.int64)
+        columns = (
+            users._elo,
+            users._goodness,
+            users._mood_factor,
+            users._adjusted_goodness,
+            users._vote_count,
+        )
+        results = np.empty((len(ENGINE_COLUMNS), len(posts)), dtype=np.int64)
+        with profiler.phase("compiled_voting"):
+            vote_posts_kernel(
+                qualities,
+                uniforms,
+                columns,
+                self._index,
+                params,
+                results,
+                pending,
+                post_ids,
+                trace_buffers,
+            )
+        for row, name in zip(results, ENGINE_COLUMNS):
+            out[name][:] = row
+        if trace.active:
+            count = trace_buffers[-1][0]
+            records = np.empty(count, dtype=TRACE_DTYPE)
+            for field, values in zip(TRACE_DTYPE.names, trace_buffers):
+                records[field] = values[:count]
+            trace.extend(records)
+        if deferred:
+            pending_ids, pending_deltas, pending_count = pending
+            count = pending_count[0]
+            users.add_elo(pending_ids[:count], pending_deltas[:count])
+        else:
+            # Ratings were written behind the Python rank index's back
+            users.invalidate_index()
@@ -0,0 +1,345 @@
+"""
+Counterfactual ELO replays over a recorded vote trace.
+
+A run started with `--trace` records who voted on which post, in which stage
+and how (see `VoteTrace`; `--trace-stages stage1 stage2 special` keeps the log
+compact). Holding those voters and their votes fixed, a replay re-applies the
+team ELO rule (`elo_update_team`, the forfeit bonus and the special stage
+rule) with other parameters, without re-simulating any voter behaviour. Every
+setting replays exactly the same votes, so the differences between them are
+paired and due to the rating rule alone. Replaying the run's own parameters
+reproduces its final ratings bit for bit.
+
+Only the rating rule can be replayed: tier parameters such as the ELO
+threshold, the tier split or the stage sizes change who gets to vote, which
+takes a new simulation. Runs with a steady-state phase cannot be replayed
+either: their churn hands the slots of departed users to new ones, so a
+user id in the trace does not stand for one user.
+
+Example:
+    python simulation.py --seed 1 --no-plot --metrics-dir run/ \\
+        --trace votes.bin --trace-stages stage1 stage2 special
+    python replay.py votes.bin --metrics-dir run/ --k-factor 16 32 64 \\
+        --forfeit-bonus 0 5
+"""
+
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+
+from simulation import (
+    DRIFT_QUANTILES,
+    MetricsReader,
+    TRACE_RETIRE,
+    TRACE_STAGE_CODES,
+    USERS_FILE,
+    UserPopulation,
+    _ks_statistic,
+    elo_update_team,
+    read_trace,
+)
+
+# What a vote group does to the ratings of its voters
+NO_CHANGE, TEAM, FORFEIT = range(3)
+
+
+class VoteLog:
+    """
+    The staged and special-stage votes of a trace, grouped for replay.
+
+    Traces with TRACE_RETIRE records are refused (see the module docstring).
+    A group is one stage of one post. Staged groups are won by the majority
+    (a draw changes nothing, a unanimous vote earns the forfeit bonus); a
+    special group is won by the voters who agreed with the post's decision,
+    which is read from the group before it, so the trace must hold all of
+    stage1, stage2 and special.
+
+    Attributes:
+        users: Voter ids in voting order
+        won: True where the voter is on the winning side of their group
+        starts: Offset of every group's first vote, plus the total
+        kinds: NO_CHANGE, TEAM or FORFEIT per group
+        posts: Post id per group
+        population_size: Users the trace covers (highest voter id + 1)
+    """
+
+    def __init__(self, trace):
+        if np.any(trace["stage"] == TRACE_STAGE_CODES[TRACE_RETIRE]):
+            raise ValueError(
+                "the trace comes from a run with steady-state churn, which "
+                "reuses the ids of departed users; it cannot be replayed"
+            )
+        trace = trace[trace["stage"] != TRACE_STAGE_CODES["population_sample"]]
+        posts = np.asarray(trace["post"])
+        stages = np.asarray(trace["stage"])
+        votes = np.asarray(trace["vote"], dtype=bool)
+        self.users = np.asarray(trace["user"], dtype=np.int64)
+        self.population_size = int(self.users.max()) + 1 if len(self.users) else 0
+
+        new_group = np.ones(len(posts), dtype=bool)
+        new_group[1:] = (posts[1:] != posts[:-1]) | (stages[1:] != stages[:-1])
+        firsts = np.flatnonzero(new_group)
+        self.starts = np.append(firsts, len(posts))
+        sizes = np.diff(self.starts)
+        self.posts = posts[firsts]
+        group_stages = stages[firsts]
+        group_of = np.cumsum(new_group) - 1
+
+        upvotes = (
+            np.add.reduceat(votes.astype(np.int64), firsts) if len(firsts) else sizes
+        )
+        downvotes = sizes - upvotes
+        special = group_stages == TRACE_STAGE_CODES["special"]
+        # Staged groups go to the majority. A special stage only follows a
+        # decided post; a tied stage 1 can only be decided by the consensus
+        # check, which looks at upvotes first.
+        previous_up = np.roll(upvotes, 1)
+        previous_down = np.roll(downvotes, 1)
+        upvote_wins = np.where(
+            special, previous_up >= previous_down, upvotes > downvotes
+        )
+        self.won = votes == upvote_wins[group_of]
+
+        winners = np.where(upvote_wins, upvotes, downvotes)
+        losers = sizes - winners
+        self.kinds = np.full(len(firsts), NO_CHANGE, dtype=np.int8)
+        decided = special | (upvotes != downvotes)
+        self.kinds[decided & (winners > 0) & (losers > 0)] = TEAM
+        self.kinds[~special & decided & (losers == 0) & (sizes > 1)] = FORFEIT
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(read_trace(path))
+
+    def __len__(self):
+        return len(self.kinds)
+
+
+def tick_first_posts(population_sizes, total_posts):
+    """
+    Id of the first post of every growth tick, from a run's metrics.
+
+    Every new user writes the same number of posts, so the posts before a
+    tick are proportional to the population before it.
+    """
+    population_sizes = np.asarray(population_sizes, dtype=np.int64)
+    posts_per_user = total_posts // population_sizes[-1]
+    return posts_per_user * np.concatenate(([0], population_sizes[:-1]))
+
+
+def replay(
+    log,
+    k=32,
+    forfeit_bonus=0,
+    initial_elo=800.0,
+    population_size=None,
+    tick_starts=None,
+):
+    """
+    Re-apply the ELO rule to every vote group of `log`, in order.
+
+    Args:
+        log: `VoteLog` of a traced run
+        k: K-factor of `elo_update_team`
+        forfeit_bonus: Points for each voter of a unanimous stage
+        initial_elo: Starting rating of every user
+        population_size: Users to rate (default: those in the log)
+        tick_starts: First post id of every growth tick, for a run made with
+            epoch_elo: groups then see the ratings from the start of their
+            tick (see `tick_first_posts`)
+
+    Returns:
+        np.ndarray: Final ELO per user
+    """
+    elo = [float(initial_elo)] * (population_size or log.population_size)
+    users = log.users.tolist()
+    won = log.won.tolist()
+    starts = log.starts.tolist()
+    posts = log.posts.tolist()
+    ticks = iter(() if tick_starts is None else np.asarray(tick_starts).tolist())
+    next_tick = next(ticks, None)
+    frozen = elo
+    for group, kind in enumerate(log.kinds.tolist()):
+        if next_tick is not None and posts[group] >= next_tick:
+            frozen = list(elo)
+            while next_tick is not None and posts[group] >= next_tick:
+                next_tick = next(ticks, None)
+        if kind == NO_CHANGE:
+            continue
+        start, stop = starts[group], starts[group + 1]
+        if kind == FORFEIT:
+            if forfeit_bonus:
+                for i in range(start, stop):
+                    elo[users[i]] += forfeit_bonus
+            continue
+        # Team sums left to right, as `apply_team_elo` takes them
+        winner_sum = loser_sum = 0.0
+        winner_count = loser_count = 0
+        for i in range(start, stop):
+            if won[i]:
+                winner_sum += frozen[users[i]]
+                winner_count += 1
+            else:
+                loser_sum += frozen[users[i]]
+                loser_count += 1
+        change_per_winner, change_per_loser = elo_update_team(
+            winner_sum / winner_count,
+            loser_sum / loser_count,
+            k=k,
+            winner_size=winner_count,
+            loser_size=loser_count,
+        )
+        for i in range(start, stop):
+            elo[users[i]] += change_per_winner if won[i] else change_per_loser
+    return np.array(elo)
+
+
+def _rank_correlation(a, b):
+    """Spearman correlation (Pearson correlation of the ranks, ties broken)."""
+    ranks_a = np.argsort(np.argsort(a))
+    ranks_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def compare_settings(
+    log,
+    settings,
+    users=None,
+    tick_starts=None,
+    initial_elo=800.0,
+    elo_threshold=800,
+):
+    """
+    Replay `log` under every setting and compare the final ratings, paired
+    user by user against the first setting.
+
+    Args:
+        log: `VoteLog` of a traced run
+        settings: List of `replay` keyword dicts (k, forfeit_bonus)
+        users: The run's final `UserPopulation`, to correlate the ratings
+            with goodness and compare them with the recorded ones
+        tick_starts: See `replay`
+        initial_elo: See `replay`
+        elo_threshold: Ratings above it count as high ELO
+
+    Returns:
+        list: One row per setting with the rating distribution, the share of
+        high-ELO users, paired differences from the first setting and, with
+        `users`, the rank correlation with goodness and the largest
+        difference from the recorded ratings
+    """
+    population_size = len(users) if users is not None else log.population_size
+    rows = []
+    reference = None
+    for setting in settings:
+        elo = replay(
+            log,
+            initial_elo=initial_elo,
+            population_size=population_size,
+            tick_starts=tick_starts,
+            **setting,
+        )
+        if reference is None:
+            reference = elo
+        row = {
+            **setting,
+            "mean": float(elo.mean()),
+            "std": float(elo.std()),
+            "quantiles": dict(
+                zip(
+                    map(str, DRIFT_QUANTILES),
+                    np.quantile(elo, DRIFT_QUANTILES).tolist(),
+                )
+            ),
+            "high_elo_share": float(np.mean(elo > elo_threshold)),
+            "paired": {
+                "mean_abs_difference": float(np.mean(np.abs(elo - reference))),
+                "ks_statistic": _ks_statistic(elo, reference),
+                "rank_correlation": _rank_correlation(elo, reference),
+            },
+        }
+        if users is not None:
+            row["goodness_rank_correlation"] = _rank_correlation(elo, users.goodness)
+            row["max_abs_difference_from_run"] = float(np.max(np.abs(elo - users.elo)))
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="Vote trace written with --trace")
+    parser.add_argument(
+        "--metrics-dir",
+        help="--metrics-dir of the traced run, for goodness, the recorded "
+        "ratings and (with --epoch-elo) the growth ticks",
+    )
+    parser.add_argument(
+        "--k-factor", type=float, nargs="+", default=[32], metavar="K"
+    )
+    parser.add_argument(
+        "--forfeit-bonus", type=float, nargs="+", default=[0], metavar="POINTS"
+    )
+    parser.add_argument(
+        "--epoch-elo",
+        action="store_true",
+        help="The run was made with --epoch-elo (needs --metrics-dir)",
+    )
+    parser.add_argument("--initial-elo", type=float, default=800.0)
+    parser.add_argument("--elo-threshold", type=float, default=800.0)
+    parser.add_argument("--output", help="Write the comparison as JSON here")
+    args = parser.parse_args(argv)
+    if args.epoch_elo and not args.metrics_dir:
+        parser.error("--epoch-elo needs --metrics-dir")
+
+    try:
+        log = VoteLog.from_file(args.trace)
+    except ValueError as error:
+        parser.error(f"{args.trace}: {error}")
+    users = tick_starts = None
+    if args.metrics_dir:
+        users = UserPopulation.load(os.path.join(args.metrics_dir, USERS_FILE))
+        if args.epoch_elo:
+            metrics = MetricsReader(args.metrics_dir)
+            tick_starts = tick_first_posts(
+                metrics["population_sizes"], len(metrics["post_ids"])
+            )
+    settings = [
+        {"k": k, "forfeit_bonus": forfeit_bonus}
+        for k, forfeit_bonus in itertools.product(args.k_factor, args.forfeit_bonus)
+    ]
+    rows = compare_settings(
+        log,
+        settings,
+        users=users,
+        tick_starts=tick_starts,
+        initial_elo=args.initial_elo,
+        elo_threshold=args.elo_threshold,
+    )
+
+    print(
+        f"{len(log)} vote groups of {log.population_size} users; paired against "
+        f"k={settings[0]['k']:g}, forfeit_bonus={settings[0]['forfeit_bonus']:g}"
+    )
+    print(
+        f"{'k':>6} {'bonus':>6} {'mean':>8} {'std':>7} {'high':>6} "
+        f"{'|diff|':>8} {'KS':>6} {'goodness rho':>13}"
+    )
+    for row in rows:
+        print(
+            f"{row['k']:6g} {row['forfeit_bonus']:6g} {row['mean']:8.1f} "
+            f"{row['std']:7.2f} {row['high_elo_share']:6.1%} "
+            f"{row['paired']['mean_abs_difference']:8.2f} "
+            f"{row['paired']['ks_statistic']:6.3f} "
+            f"{row.get('goodness_rank_correlation', float('nan')):13.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -1,515 +1,3860 @@
-import random
 import numpy as np
-import matplotlib.pyplot as plt
-from termcolor import colored
 from tqdm import tqdm
+import argparse
+import json
 import math
-import scipy.stats as st
+import os
+import functools
+import itertools
+import time
+from collections import defaultdict, deque
+from contextlib import nullcontext
+import shutil
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from dataclasses import asdict, dataclass, fields
+from bisect import bisect_left, bisect_right, insort
+from statistics import NormalDist
+
+# matplotlib, scipy.stats and termcolor are imported where they are used, so
+# importing this module (e.g. in worker processes) stays cheap and headless.
+
+
+class SimulationRNG:
+    """
+    Per-simulation random stream on top of a `np.random.Generator`.
+
+    Scalar draws (`random`, `uniform`, `choice`, `exponential`, `sample`) are
+    served from large pre-drawn blocks that are refilled in bulk, so each call
+    costs a list lookup instead of a trip through the generator. Array draws
+    go straight to `generator`.
+
+    Args:
+        seed: An int, a `np.random.SeedSequence`, or None for fresh entropy
+        block_size: Values drawn per block refill (default: 65536)
+    """
+
+    # Samples up to this size use Floyd's algorithm on the uniform block
+    SMALL_SAMPLE = 32
+
+    def __init__(self, seed=None, block_size=65536):
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        # Generator state before each block was drawn, so that `getstate`
+        # does not need to store the blocks themselves
+        self._uniform_start = self._exponential_start = None
+        self._uniforms = self._exponentials = None
+        self._uniform_pos = self._exponential_pos = block_size
+
+    def _refill_uniforms(self):
+        self._uniform_start = self.generator.bit_generator.state
+        self._uniforms = self.generator.random(self.block_size).tolist()
+        self._uniform_pos = 0
+
+    def _refill_exponentials(self):
+        self._exponential_start = self.generator.bit_generator.state
+        self._exponentials = self.generator.standard_exponential(
+            self.block_size
+        ).tolist()
+        self._exponential_pos = 0
+
+    def random(self):
+        """Uniform float in [0, 1)."""
+        if self._uniform_pos == self.block_size:
+            self._refill_uniforms()
+        value = self._uniforms[self._uniform_pos]
+        self._uniform_pos += 1
+        return value
+
+    def uniform(self, low=0.0, high=1.0):
+        return low + (high - low) * self.random()
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def exponential(self, scale=1.0):
+        if self._exponential_pos == self.block_size:
+            self._refill_exponentials()
+        value = self._exponentials[self._exponential_pos]
+        self._exponential_pos += 1
+        return scale * value
+
+    def random_array(self, shape):
+        """Array of uniform floats in [0, 1)."""
+        return self.generator.random(shape)
+
+    def integers(self, low, high, size):
+        return self.generator.integers(low, high, size=size)
+
+    def sample(self, population_size, k):
+        """`k` distinct integers drawn uniformly from range(population_size)."""
+        if k > self.SMALL_SAMPLE:
+            return self.generator.choice(population_size, k, replace=False).tolist()
+        return _floyd_sample(self.random, population_size, k)
+
+    def getstate(self):
+        """JSON-serializable state, restored exactly by `setstate`."""
+        return {
+            "block_size": self.block_size,
+            "generator": self.generator.bit_generator.state,
+            "uniforms": [self._uniform_start, self._uniform_pos],
+            "exponentials": [self._exponential_start, self._exponential_pos],
+        }
+
+    def setstate(self, state):
+        self.block_size = state["block_size"]
+        uniform_start, uniform_pos = state["uniforms"]
+        if uniform_start is not None:
+            # Redraw the block that was being consumed
+            self.generator.bit_generator.state = uniform_start
+            self._refill_uniforms()
+        self._uniform_pos = uniform_pos
+        exponential_start, exponential_pos = state["exponentials"]
+        if exponential_start is not None:
+            self.generator.bit_generator.state = exponential_start
+            self._refill_exponentials()
+        self._exponential_pos = exponential_pos
+        self.generator.bit_generator.state = state["generator"]
+
+
+def _floyd_sample(random, population_size, k):
+    """Floyd's algorithm: `k` distinct integers below population_size, one draw each."""
+    chosen = set()
+    result = []
+    for upper in range(population_size - k, population_size):
+        value = int(random() * (upper + 1))
+        if value in chosen:
+            value = upper
+        chosen.add(value)
+        result.append(value)
+    return result
+
+
+class _UniformBlock:
+    """
+    `SimulationRNG` stand-in that serves one post's pre-drawn uniforms in order.
+
+    Samples always use Floyd's algorithm and `random_array` takes the next
+    values in row-major order, which is the layout `Engine` backends follow.
+    """
+
+    __slots__ = ("values", "position")
+
+    def __init__(self, values):
+        self.values = values
+        self.position = 0
+
+    def random(self):
+        value = self.values[self.position]
+        self.position += 1
+        return value
+
+    def sample(self, population_size, k):
+        return _floyd_sample(self.random, population_size, k)
+
+    def random_array(self, shape):
+        size = math.prod(shape)
+        start = self.position
+        self.position += size
+        return self.values[start : start + size].reshape(shape)
+
+
+# Stream used when no simulation RNG is passed in
+DEFAULT_RNG = SimulationRNG()
+
+
+def _exponential_goodness(rng, count, scale):
+    if scale <= 0:
+        raise ValueError(f"exponential goodness needs goodness_scale > 0, got {scale}")
+    goodness = scale * rng.generator.standard_exponential(count)
+    # Values above 1 are redrawn uniformly
+    too_good = goodness > 1
+    goodness[too_good] = rng.random_array(int(np.count_nonzero(too_good)))
+    return goodness
+
+
+def _uniform_goodness(rng, count, scale):
+    return rng.random_array(count)
+
+
+def _beta_goodness(rng, count, scale):
+    # Beta(1, b) with mean `scale`: falls off towards 1 like the exponential,
+    # without a tail to clip
+    if not 0 < scale < 1:
+        raise ValueError(f"beta goodness needs 0 < goodness_scale < 1, got {scale}")
+    return rng.generator.beta(1.0, (1 - scale) / scale, count)
+
+
+# Goodness distributions of new users by name, each drawing an array of
+# `count` values in [0, 1] from (rng, count, goodness_scale)
+GOODNESS_DISTRIBUTIONS = {
+    "exponential": _exponential_goodness,
+    "uniform": _uniform_goodness,
+    "beta": _beta_goodness,
+}
+
+
+class EloRankIndex:
+    """
+    Order-statistic index over user ELO ratings.
+
+    Users are kept sorted by (elo, id) in a list of bounded-size buckets, with a
+    Fenwick tree over the bucket lengths. Threshold counts, rank lookups and
+    single-user updates cost O(log N) plus a bounded in-bucket shift, so only
+    the users whose ELO actually changed need to be touched per post.
+    """
+
+    LOAD = 512
+
+    def __init__(self, ids=(), elos=()):
+        self._rebuild(sorted(zip(map(float, elos), map(int, ids))))
+
+    def __len__(self):
+        return self._len
+
+    # Estimated bytes per stored (elo, id) key: the tuple, its float and its
+    # int, and the bucket's pointer to it
+    KEY_BYTES = (
+        sys.getsizeof((0.0, 1 << 20))
+        + sys.getsizeof(0.0)
+        + sys.getsizeof(1 << 20)
+        + 8
+    )
+
+    @property
+    def nbytes(self):
+        """Estimated bytes held by the index."""
+        lists = [self._maxes, self._tree, self._buckets, *self._buckets]
+        return self._len * self.KEY_BYTES + sum(map(sys.getsizeof, lists))
+
+    def _rebuild(self, keys):
+        self._buckets = [
+            keys[i : i + self.LOAD] for i in range(0, len(keys), self.LOAD)
+        ]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._build_tree()
+
+    def _build_tree(self):
+        tree = [0] + [len(bucket) for bucket in self._buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, position, delta):
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, position):
+        """Number of keys stored in buckets before `position`."""
+        total = 0
+        i = position
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, rank):
+        """Return (bucket position, offset inside bucket) for a rank."""
+        position = 0
+        remaining = rank
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                position = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return position, remaining
+
+    def add(self, user_id, elo):
+        key = (float(elo), int(user_id))
+        if not self._buckets:
+            self._rebuild([key])
+            return
+        position = bisect_left(self._maxes, key)
+        if position == len(self._maxes):
+            position -= 1
+            self._buckets[position].append(key)
+            self._maxes[position] = key
+        else:
+            insort(self._buckets[position], key)
+        self._len += 1
+        bucket = self._buckets[position]
+        if len(bucket) > 2 * self.LOAD:
+            # Split oversized buckets to keep the in-bucket shift bounded
+            self._buckets[position : position + 1] = [
+                bucket[: self.LOAD],
+                bucket[self.LOAD :],
+            ]
+            self._maxes[position : position + 1] = [
+                bucket[self.LOAD - 1],
+                bucket[-1],
+            ]
+            self._build_tree()
+        else:
+            self._tree_add(position, 1)
+
+    def discard(self, user_id, elo):
+        key = (float(elo), int(user_id))
+        position = bisect_left(self._maxes, key)
+        if position == len(self._maxes):
+            raise KeyError(key)
+        bucket = self._buckets[position]
+        offset = bisect_left(bucket, key)
+        if offset == len(bucket) or bucket[offset] != key:
+            raise KeyError(key)
+        del bucket[offset]
+        self._len -= 1
+        if bucket:
+            self._maxes[position] = bucket[-1]
+            self._tree_add(position, -1)
+        else:
+            del self._buckets[position]
+            del self._maxes[position]
+            self._build_tree()
+
+    def update(self, user_id, old_elo, new_elo):
+        self.discard(user_id, old_elo)
+        self.add(user_id, new_elo)
+
+    def count_at_most(self, elo):
+        """Number of users with a rating <= `elo`."""
+        key = (float(elo), math.inf)
+        position = bisect_right(self._maxes, key)
+        if position == len(self._maxes):
+            return self._len
+        return self._prefix(position) + bisect_right(self._buckets[position], key)
+
+    def __getitem__(self, rank):
+        """Id of the user at `rank` in ascending (elo, id) order."""
+        if not 0 <= rank < self._len:
+            raise IndexError(f"rank {rank} out of range")
+        position, offset = self._locate(rank)
+        return self._buckets[position][offset][1]
+
+    def ids(self, start, stop):
+        """Ids of the users ranked in [start, stop), in ascending order."""
+        result = []
+        if start >= stop:
+            return result
+        position, offset = self._locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._buckets[position][offset : offset + remaining]
+            result.extend(user_id for _, user_id in chunk)
+            remaining -= len(chunk)
+            position += 1
+            offset = 0
+        return result
+
+    def sample(self, start, stop, k, rng=DEFAULT_RNG):
+        """Ids of `k` users drawn uniformly without replacement from a rank range."""
+        return [self[start + offset] for offset in rng.sample(stop - start, k)]
+
+
+class UserPopulation:
+    """
+    Struct-of-arrays store for all users in the simulation.
+
+    Every user attribute lives in its own NumPy column indexed by user id, so
+    scans over the population are vectorized instead of walking a list of
+    objects. Columns grow in amortized chunks as users are spawned.
+
+    ELO changes must go through `set_elo` (or the `User.elo` setter) so that
+    the `rank_index` used for tier selection stays in sync. Code that writes
+    the elo column directly calls `invalidate_index`, and the index is rebuilt
+    the next time it is needed.
+    """
+
+    COLUMNS = {
+        "elo": np.float64,
+        "goodness": np.float64,
+        "mood_factor": np.float64,
+        "adjusted_goodness": np.float64,
+        "vote_count": np.int64,
+    }
+    GROWTH_FACTOR = 1.5
+    MIN_CAPACITY = 1024
+
+    def __init__(self, capacity=0):
+        self._size = 0
+        self._capacity = max(capacity, self.MIN_CAPACITY)
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, "_" + name, np.zeros(self._capacity, dtype=dtype))
+        self._rank_index = EloRankIndex()
+        # Number of full index rebuilds, for profiling
+        self.reindex_count = 0
+        # (ids, deltas) batches held back by `defer_elo`, None when live
+        self._pending_elo = None
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, user_id):
+        if not 0 <= user_id < self._size:
+            raise IndexError(f"user id {user_id} out of range")
+        return User(self, user_id)
+
+    def __iter__(self):
+        for user_id in range(self._size):
+            yield User(self, user_id)
+
+    @property
+    def elo(self):
+        return self._elo[: self._size]
+
+    @property
+    def goodness(self):
+        return self._goodness[: self._size]
+
+    @property
+    def mood_factor(self):
+        return self._mood_factor[: self._size]
+
+    @property
+    def adjusted_goodness(self):
+        return self._adjusted_goodness[: self._size]
+
+    @property
+    def vote_count(self):
+        return self._vote_count[: self._size]
+
+    def save(self, path):
+        """Write every column (trimmed to the current size) to an `.npz` file."""
+        np.savez(path, **{name: getattr(self, name) for name in self.COLUMNS})
+
+    @classmethod
+    def load(cls, path):
+        """Rebuild a population, including its rank index, from `save` output."""
+        with np.load(path) as data:
+            return cls.from_columns(data)
+
+    @classmethod
+    def from_columns(cls, columns, capacity=0):
+        """
+        Rebuild a population from a mapping of column name to array.
+
+        Args:
+            columns: Mapping with one equally long array per name in COLUMNS
+            capacity: Minimum capacity to reserve for further spawning
+        """
+        size = len(columns["elo"])
+        population = cls(capacity=max(size, capacity))
+        for name in cls.COLUMNS:
+            getattr(population, "_" + name)[:size] = columns[name]
+        population._size = size
+        population.invalidate_index()
+        return population
+
+    @classmethod
+    def view(cls, columns):
+        """
+        Population backed by the given column arrays, without copying them.
+
+        Worker processes use this over shared memory. The view owns no spare
+        capacity, so spawning into it moves the columns to private memory.
+        """
+        population = cls()
+        for name in cls.COLUMNS:
+            setattr(population, "_" + name, columns[name])
+        population._size = population._capacity = len(columns["elo"])
+        population.invalidate_index()
+        return population
+
+    def copy(self):
+        """Independent copy of every column, including any deferred ELO deltas."""
+        clone = self.from_columns(
+            {name: getattr(self, name) for name in self.COLUMNS},
+            capacity=self._capacity,
+        )
+        if self._pending_elo is not None:
+            clone._pending_elo = list(self._pending_elo)
+        return clone
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns (at full capacity) and the rank index."""
+        columns = sum(getattr(self, "_" + name).nbytes for name in self.COLUMNS)
+        index = self._rank_index.nbytes if self._rank_index is not None else 0
+        return columns + index
+
+    @property
+    def rank_index(self):
+        if self._rank_index is None:
+            self.reindex()
+        return self._rank_index
+
+    def invalidate_index(self):
+        """Mark the rank index stale after the elo column was written directly."""
+        self._rank_index = None
+
+    def reindex(self):
+        """Rebuild the rank index from the elo column right away."""
+        self._rank_index = EloRankIndex(range(self._size), self.elo)
+        self.reindex_count += 1
+
+    def reserve(self, capacity):
+        """Grow every column so that at least `capacity` users fit."""
+        if capacity <= self._capacity:
+            return
+        new_capacity = max(capacity, int(self._capacity * self.GROWTH_FACTOR))
+        for name in self.COLUMNS:
+            old = getattr(self, "_" + name)
+            column = np.zeros(new_capacity, dtype=old.dtype)
+            column[: self._size] = old[: self._size]
+            setattr(self, "_" + name, column)
+        self._capacity = new_capacity
+
+    def spawn(self, count, elo=None, rng=DEFAULT_RNG, config=None):
+        """
+        Add `count` new users and return their ids.
+
+        Every column of the new users is filled with one array operation.
+
+        Args:
+            count: Number of users to add
+            elo: Starting ELO for the new users (default: config.initial_elo)
+            rng: `SimulationRNG` for the users' goodness and mood
+            config: `SimulationConfig` with the goodness and mood factor
+                distributions (default: DEFAULT_CONFIG)
+
+        Returns:
+            np.ndarray: Ids of the new users
+        """
+        config = config or DEFAULT_CONFIG
+        if elo is None:
+            elo = config.initial_elo
+        if config.goodness_distribution not in GOODNESS_DISTRIBUTIONS:
+            raise ValueError(
+                f"unknown goodness distribution: {config.goodness_distribution}"
+            )
+        start = self._size
+        stop = start + count
+        self.reserve(stop)
+        goodness = GOODNESS_DISTRIBUTIONS[config.goodness_distribution](
+            rng, count, config.goodness_scale
+        )
+        self._elo[start:stop] = elo
+        self._goodness[start:stop] = goodness
+        self._mood_factor[start:stop] = config.mood_factor_max * rng.random_array(
+            count
+        )
+        self._adjusted_goodness[start:stop] = goodness
+        self._vote_count[start:stop] = 0
+        self._size = stop
+        if self._rank_index is None or count > len(self._rank_index):
+            # Cheaper to re-sort everything than to insert one by one
+            self.invalidate_index()
+        else:
+            for user_id in range(start, stop):
+                self._rank_index.add(user_id, elo)
+        return np.arange(start, stop)
+
+    def retire(self, user_ids):
+        """
+        Remove `user_ids` from the population, keeping ids dense.
+
+        The last users move into the freed slots and take their ids, so the
+        columns and the rank index never leave holes, and the next `spawn`
+        reuses the capacity at the end instead of growing. Cannot be called
+        while ELO changes are deferred.
+
+        Args:
+            user_ids: Distinct ids of the users leaving
+        """
+        if self._pending_elo is not None:
+            raise RuntimeError("cannot retire users while ELO changes are deferred")
+        removed = np.unique(np.asarray(user_ids, dtype=np.intp))
+        if not len(removed):
+            return
+        stop = self._size - len(removed)
+        holes = removed[removed < stop]
+        movers = np.setdiff1d(
+            np.arange(stop, self._size), removed, assume_unique=True
+        )
+        index = self._rank_index
+        if index is not None and (len(removed) + len(movers)) * 8 > self._size:
+            # Cheaper to re-sort everything than to re-key user by user
+            self.invalidate_index()
+            index = None
+        if index is not None:
+            for user_id, elo in zip(removed.tolist(), self._elo[removed].tolist()):
+                index.discard(user_id, elo)
+            for old_id, new_id, elo in zip(
+                movers.tolist(), holes.tolist(), self._elo[movers].tolist()
+            ):
+                index.discard(old_id, elo)
+                index.add(new_id, elo)
+        for name in self.COLUMNS:
+            column = getattr(self, "_" + name)
+            column[holes] = column[movers]
+        self._size = stop
+
+    def add_elo(self, user_ids, deltas):
+        """Scatter-add ELO `deltas` onto `user_ids`, keeping the rank index in sync."""
+        user_ids = np.asarray(user_ids, dtype=np.intp)
+        if not len(user_ids):
+            return
+        if self._pending_elo is not None:
+            deltas = np.broadcast_to(np.asarray(deltas, np.float64), user_ids.shape)
+            self._pending_elo.append((user_ids, deltas))
+            return
+        if self._rank_index is None:
+            # Stale index: it is rebuilt from the new ratings anyway
+            np.add.at(self._elo, user_ids, deltas)
+            return
+        touched = np.unique(user_ids)
+        old_elos = self._elo[touched].tolist()
+        np.add.at(self._elo, user_ids, deltas)
+        new_elos = self._elo[touched].tolist()
+        for user_id, old_elo, new_elo in zip(touched.tolist(), old_elos, new_elos):
+            if new_elo != old_elo:
+                self._rank_index.update(user_id, old_elo, new_elo)
+
+    def defer_elo(self):
+        """
+        Freeze ELO: hold back every `add_elo` until `commit_elo`.
+
+        Ratings and the rank index keep their current values in the meantime,
+        so everything voted in between sees the same snapshot.
+        """
+        if self._pending_elo is None:
+            self._pending_elo = []
+
+    def pending_elo(self):
+        """(2 x n) array of the user ids and deltas held back so far, in order."""
+        pending = self._pending_elo or []
+        return np.array(
+            [
+                np.concatenate([user_ids for user_ids, _ in pending] or [[]]),
+                np.concatenate([deltas for _, deltas in pending] or [[]]),
+            ]
+        )
+
+    def commit_elo(self):
+        """Apply the deltas held back since `defer_elo` in one pass and unfreeze."""
+        pending, self._pending_elo = self._pending_elo, None
+        if not pending:
+            return
+        user_ids = np.concatenate([user_ids for user_ids, _ in pending])
+        deltas = np.concatenate([deltas for _, deltas in pending])
+        if len(user_ids) * 8 > self._size:
+            # Cheaper to re-sort everything than to re-key user by user
+            np.add.at(self._elo, user_ids, deltas)
+            self.invalidate_index()
+        else:
+            self.add_elo(user_ids, deltas)
+
+    def set_elo(self, user_id, elo):
+        old_elo = self._elo[user_id].item()
+        if elo != old_elo and self._rank_index is not None:
+            self._rank_index.update(user_id, old_elo, elo)
+        self._elo[user_id] = elo
+
+
+def _user_column(name):
+    attribute = "_" + name
+
+    def getter(user):
+        return getattr(user.population, attribute)[user.id].item()
+
+    def setter(user, value):
+        if name == "elo":
+            user.population.set_elo(user.id, value)
+        else:
+            getattr(user.population, attribute)[user.id] = value
+
+    return property(getter, setter)
 
 
 class User:
-    def __init__(self, id, elo=800):
+    """Thin view of a single user stored in a `UserPopulation`."""
+
+    __slots__ = ("population", "id")
+
+    def __init__(self, population, id):
+        self.population = population
         self.id = id
-        self.elo = elo
-        self.goodness = self.generate_goodness()
-        self.mood_factor = random.uniform(0, 0.1)  # Random value from 0 to 0.1
-        self.adjusted_goodness = self.goodness
-        self.vote_count = 0
-
-    def generate_goodness(self):
-        goodness = np.random.exponential(scale=0.3)  # Adjusted scale to 0.3
-        if goodness > 1:
-            goodness = np.random.uniform()
-        return goodness
-
-    def apply_mood(self):
-        self.adjusted_goodness = self.goodness
-        if random.random() < self.mood_factor:
-            adjustment = random.uniform(0, 0.25)
-            if random.choice([True, False]):
-                self.adjusted_goodness = min(1, self.goodness * (1 + adjustment))
+
+    elo = _user_column("elo")
+    goodness = _user_column("goodness")
+    mood_factor = _user_column("mood_factor")
+    adjusted_goodness = _user_column("adjusted_goodness")
+    vote_count = _user_column("vote_count")
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, User)
+            and self.population is other.population
+            and self.id == other.id
+        )
+
+    def __hash__(self):
+        return hash((id(self.population), self.id))
+
+    def apply_mood(self, rng=DEFAULT_RNG):
+        goodness = self.goodness
+        self.adjusted_goodness = goodness
+        if rng.random() < self.mood_factor:
+            adjustment = rng.uniform(0, 0.25)
+            if rng.choice([True, False]):
+                self.adjusted_goodness = min(1, goodness * (1 + adjustment))
             else:
-                self.adjusted_goodness = max(0, self.goodness * (1 - adjustment))
+                self.adjusted_goodness = max(0, goodness * (1 - adjustment))
 
 
 class Post:
-    def __init__(self, id):
+    __slots__ = ("id", "quality")
+
+    def __init__(self, id, rng=DEFAULT_RNG):
         self.id = id
-        self.quality = random.uniform(0, 1)
+        self.quality = rng.uniform(0, 1)
 
 
-def elo_update(winner_elo, loser_elo, k=32):
-    expected_score = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
-    new_winner_elo = winner_elo + k * (1 - expected_score)
-    new_loser_elo = loser_elo - k * (1 - expected_score)
-    return new_winner_elo, new_loser_elo
+def post_stream(rng=DEFAULT_RNG, first_id=0):
+    """
+    Endless stream of new posts with consecutive ids.
 
+    Each post's quality is drawn when the post is taken, so the stream uses
+    the RNG exactly like creating the posts one by one. Nothing is kept once
+    a post has been consumed.
+    """
+    for post_id in itertools.count(first_id):
+        yield Post(post_id, rng)
 
-def vote(user, post):
-    user.apply_mood()  # Update adjusted goodness before voting
-    if post.quality >= 0.5:
-        vote_decision = (
-            "upvote"
-            if random.uniform(0, 1) < user.adjusted_goodness
-            else random.choice(["downvote", "upvote"])
-        )
-    else:
-        vote_decision = (
-            "downvote"
-            if random.uniform(0, 1) < user.adjusted_goodness
-            else random.choice(["downvote", "upvote"])
-        )
-    user.vote_count += 1
-    return vote_decision
-
-
-def stage_voting(stage_users, post, forfeit_bonus=0):
-    votes = []
-    stage_decision = "draw"
-    for user in stage_users:
-        vote_decision = vote(user, post)
-        votes.append((user, vote_decision))
-    upvotes = [user for user, vote in votes if vote == "upvote"]
-    downvotes = [user for user, vote in votes if vote == "downvote"]
-    if not upvotes and downvotes:
-        winning_team = downvotes
-        losing_team = upvotes
-        stage_decision = "downvote"
-    elif not downvotes and upvotes:
-        winning_team = upvotes
-        losing_team = downvotes
-        stage_decision = "upvote"
-    elif len(upvotes) > len(downvotes):
-        winning_team = upvotes
-        losing_team = downvotes
-        stage_decision = "upvote"
-    elif len(downvotes) > len(upvotes):
-        winning_team = downvotes
-        losing_team = upvotes
-        stage_decision = "downvote"
-    else:
-        return votes, stage_decision
-    if not losing_team:
-        if len(votes) > 1:
-            # Forfeit case: Winning team gets a small fixed number of points
-            for user in winning_team:
-                user.elo += forfeit_bonus
-    else:
-        average_winner_elo = sum(user.elo for user in winning_team) / len(winning_team)
-        average_loser_elo = sum(user.elo for user in losing_team) / len(losing_team)
-        change_per_winner, change_per_loser = elo_update_team(
-            average_winner_elo,
-            average_loser_elo,
-            k=32,
-            winner_size=len(winning_team),
-            loser_size=len(losing_team),
-        )
-        for user in winning_team:
-            user.elo += change_per_winner
-        for user in losing_team:
-            user.elo += change_per_loser  # (it's negative, so they lose Elo)
-    return votes, stage_decision
 
+class _PhaseTimer:
+    __slots__ = ("profiler", "name", "start")
 
-def elo_update_team(winner_avg_elo, loser_avg_elo, k=32, winner_size=1, loser_size=1):
-    expected_score_winner = 1 / (1 + 10 ** ((loser_avg_elo - winner_avg_elo) / 400))
-    expected_score_loser = 1 - expected_score_winner
-    total_winner_delta = k * (1 - expected_score_winner)
-    total_loser_delta = k * (0 - expected_score_loser)
-    change_per_winner = total_winner_delta / winner_size
-    change_per_loser = total_loser_delta / loser_size
-    return change_per_winner, change_per_loser
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
 
+    def __enter__(self):
+        self.start = time.perf_counter()
 
-def calculate_sample_size(confidence, margin_of_error, population_size):
+    def __exit__(self, *exc_info):
+        profiler = self.profiler
+        profiler._seconds[self.name] += time.perf_counter() - self.start
+        profiler._calls[self.name] += 1
+
+
+class Profiler:
     """
-    Calculate sample size needed for given confidence level and margin of error.
+    Named phase timers and counters for `simulate` and `multi_stage_voting`.
+
+    Wrap a phase in `with profiler.phase(name):` and bump counters with
+    `profiler.count(name, n)`. `end_tick` closes a growth tick, and `report`
+    returns the per-tick and total figures as a JSON-ready dict.
+    Instrumented code defaults to NULL_PROFILER, whose hooks do nothing.
 
     Args:
-        confidence: Confidence level (e.g., 0.95 for 95%)
-        margin_of_error: Margin of error (e.g., 0.05 for 5%)
-        population_size: Size of the population to sample from
+        show_postfix: Show the largest phases in the `simulate` progress bar
+    """
 
-    Returns:
-        Required sample size
+    def __init__(self, show_postfix=False):
+        self.show_postfix = show_postfix
+        self._seconds = defaultdict(float)
+        self._calls = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._timers = {}
+        self._ticks = []
+        self._tick_start = self._started = time.perf_counter()
+        self._tick_mark = ({}, {})
+
+    def phase(self, name):
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _PhaseTimer(self, name)
+        return timer
+
+    def count(self, name, n=1):
+        self._counters[name] += n
+
+    def observe(self, users, metrics):
+        """Look at the run's state before `end_tick`; subclasses measure it."""
+
+    def end_tick(self, **info):
+        """Record what happened since the previous tick, tagged with `info`."""
+        now = time.perf_counter()
+        seconds, counters = self._tick_mark
+        self._ticks.append(
+            {
+                "tick": len(self._ticks),
+                **info,
+                "wall_seconds": now - self._tick_start,
+                "phases": {
+                    name: total - seconds.get(name, 0.0)
+                    for name, total in self._seconds.items()
+                },
+                "counters": {
+                    name: total - counters.get(name, 0)
+                    for name, total in self._counters.items()
+                },
+            }
+        )
+        self._tick_mark = (dict(self._seconds), dict(self._counters))
+        self._tick_start = now
+
+    def postfix(self, top=3):
+        """Largest phases as shares of the time so far, for a tqdm postfix."""
+        total = sum(self._seconds.values()) or 1.0
+        largest = sorted(self._seconds.items(), key=lambda item: -item[1])[:top]
+        return {name: f"{seconds / total:.0%}" for name, seconds in largest}
+
+    def report(self):
+        wall_seconds = time.perf_counter() - self._started
+        return {
+            "total": {
+                "wall_seconds": wall_seconds,
+                "phases": {
+                    name: {
+                        "seconds": seconds,
+                        "calls": self._calls[name],
+                        "share": seconds / wall_seconds if wall_seconds else 0.0,
+                    }
+                    for name, seconds in self._seconds.items()
+                },
+                "counters": dict(self._counters),
+            },
+            "ticks": self._ticks,
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_bytes():
+    """Peak resident set size of the process, or None without `resource`."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryProfiler(Profiler):
     """
-    # Z score for given confidence level
-    z = st.norm.ppf(1 - (1 - confidence) / 2)
+    `Profiler` that also records memory use at the end of every growth tick.
 
-    # Use 0.5 for p (worst case scenario for sample size)
-    p = 0.5
+    Each tick's report gets a "memory" entry with the current and peak RSS,
+    the bytes traced by `tracemalloc` now and at their peak during the tick
+    (transient copies included). It also holds the bytes held by the user
+    columns and rank index (`UserPopulation.nbytes`) and by the metric
+    columns kept in memory (`MetricsSink.nbytes`), per user and per post.
+    The total adds the overall peaks and the RSS growth per user fitted over
+    the second half of the run, for extrapolating to larger populations.
 
-    # Sample size calculation
-    numerator = (z**2 * p * (1 - p)) / (margin_of_error**2)
-    denominator = 1 + (z**2 * p * (1 - p)) / (margin_of_error**2 * population_size)
+    The `top` allocation sites come from tracemalloc snapshots, which take
+    time in proportion to the number of live allocations. They are taken at
+    the first tick, whenever the population has grown `snapshot_growth`
+    times since the previous one, and once more by `close`. tracemalloc also
+    slows allocation-heavy code down, and only sees the main process.
 
-    sample_size = numerator / denominator
-    return math.ceil(sample_size)
+    Args:
+        show_postfix: See `Profiler`
+        top: Allocation sites (file and line) per snapshot; 0 takes none
+        frames: Stack frames tracemalloc keeps per allocation
+        snapshot_growth: Population growth factor between snapshots
+    """
 
+    def __init__(self, show_postfix=False, top=10, frames=1, snapshot_growth=2.0):
+        super().__init__(show_postfix)
+        self.top = top
+        self.snapshot_growth = snapshot_growth
+        self._next_snapshot = 0
+        self._final_allocations = None
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(frames)
+        self._sizes = {}
 
-def population_sample_voting(
-    post, current_population, confidence=0.95, margin_of_error=0.05
-):
+    def _top_allocations(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        return [
+            {
+                "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "bytes": stat.size,
+                "blocks": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[: self.top]
+        ]
+
+    def observe(self, users, metrics):
+        posts = metrics.column_length("post_ids")
+        self._sizes = {
+            "population_bytes": users.nbytes,
+            "metrics_bytes": metrics.nbytes,
+            "bytes_per_user": users.nbytes / len(users) if len(users) else 0.0,
+            "bytes_per_post": metrics.nbytes / posts if posts else 0.0,
+        }
+
+    def end_tick(self, **info):
+        with self.phase("memory_profile"):
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            memory = {
+                "rss_bytes": _rss_bytes(),
+                "peak_rss_bytes": _peak_rss_bytes(),
+                "traced_bytes": traced,
+                "traced_peak_bytes": traced_peak,
+                **self._sizes,
+            }
+            population = info.get("population", 0)
+            if self.top and population >= self._next_snapshot:
+                memory["top_allocations"] = self._top_allocations()
+                self._next_snapshot = max(population * self.snapshot_growth, 1)
+        super().end_tick(**info, memory=memory)
+
+    def report(self):
+        report = super().report()
+        memories = [tick["memory"] for tick in self._ticks]
+        summary = {
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "traced_peak_bytes": max(
+                (memory["traced_peak_bytes"] for memory in memories), default=0
+            ),
+        }
+        # RSS growth per user over the second half of the ticks, which are
+        # past the interpreter's start-up allocations
+        fitted = [
+            (tick["population"], tick["memory"]["rss_bytes"])
+            for tick in self._ticks[len(self._ticks) // 2 :]
+            if tick.get("population") is not None
+            and tick["memory"]["rss_bytes"] is not None
+        ]
+        if len({population for population, _ in fitted}) > 1:
+            populations, rss = np.array(fitted, dtype=np.float64).T
+            summary["rss_bytes_per_user"] = float(np.polyfit(populations, rss, 1)[0])
+        if self._final_allocations is not None:
+            summary["top_allocations"] = self._final_allocations
+        report["total"]["memory"] = summary
+        return report
+
+    def close(self):
+        """Take the final allocation snapshot and stop tracemalloc if this
+        profiler started it."""
+        if self.top and tracemalloc.is_tracing():
+            self._final_allocations = self._top_allocations()
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started_tracing = False
+
+
+class _NullProfiler:
+    """Profiler stand-in whose hooks cost a method call and nothing more."""
+
+    show_postfix = False
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def observe(self, users, metrics):
+        pass
+
+    def end_tick(self, **info):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+class AccuracyStream:
     """
-    Voting stage where a statistically significant sample of the current population votes,
-    using a sample size calculated to achieve the desired confidence level and error margin.
+    Online statistics of one mechanism's per-post outcomes (1 when correct),
+    updated in O(1) per post.
 
-    This voting does not influence Elo adjustments.
+    Tracks the running accuracy with its Welford variance, an exponentially
+    weighted accuracy, the accuracy over the last `window` posts and the
+    least-squares trend of the outcomes over the post index. `extend` merges
+    a batch in one vectorized step with the same result as updating post by
+    post, up to rounding.
 
     Args:
-        post: The post to vote on
-        current_population: Current population of users
-        confidence: Confidence level (default: 0.95)
-        margin_of_error: Margin of error (default: 0.05)
+        window: Posts in the windowed accuracy (default: 1000)
+        alpha: Weight of the newest post in the EWMA (default: 0.001)
+    """
 
-    Returns:
-        tuple: (votes, decision, sample_size)
+    def __init__(self, window=1000, alpha=0.001):
+        self.window = window
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0  # Running accuracy
+        self.ewma = None
+        self._m2 = 0.0  # Sum of squared deviations of the outcomes
+        self._index_mean = 0.0
+        self._index_m2 = 0.0  # Sum of squared deviations of the post index
+        self._comoment = 0.0  # Of the post index and the outcomes
+        self._ring = np.zeros(window, dtype=np.float64)
+        self._window_sum = 0.0
+
+    def update(self, value):
+        """Add the outcome of the next post."""
+        value = float(value)
+        index = self.count
+        self.count += 1
+        index_delta = index - self._index_mean
+        delta = value - self.mean
+        self._index_mean += index_delta / self.count
+        self.mean += delta / self.count
+        self._index_m2 += index_delta * (index - self._index_mean)
+        self._m2 += delta * (value - self.mean)
+        self._comoment += index_delta * (value - self.mean)
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+        slot = index % self.window
+        self._window_sum += value - self._ring[slot]
+        self._ring[slot] = value
+
+    def extend(self, values):
+        """Add the outcomes of the next `len(values)` posts."""
+        values = np.asarray(values, dtype=np.float64)
+        m = len(values)
+        if not m:
+            return
+        indices = np.arange(self.count, self.count + m, dtype=np.float64)
+        index_mean = indices.mean()
+        mean = values.mean()
+        index_deviations = indices - index_mean
+        deviations = values - mean
+
+        # Chan et al.'s pairwise merge of the means and (co-)moments
+        n = self.count + m
+        index_delta = index_mean - self._index_mean
+        delta = mean - self.mean
+        weight = self.count * m / n
+        self._index_m2 += index_deviations @ index_deviations + index_delta**2 * weight
+        self._m2 += deviations @ deviations + delta**2 * weight
+        self._comoment += (
+            index_deviations @ deviations + index_delta * delta * weight
+        )
+        self._index_mean += index_delta * m / n
+        self.mean += delta * m / n
+
+        smoothed = values
+        if self.ewma is None:
+            self.ewma, smoothed = values[0], values[1:]
+        # Each post's weight decays by (1 - alpha) per newer post
+        decay = (1 - self.alpha) ** np.arange(len(smoothed) - 1, -1, -1)
+        self.ewma = (1 - self.alpha) ** len(smoothed) * self.ewma + self.alpha * (
+            decay @ smoothed
+        )
+
+        tail = values[-self.window :]
+        self._ring[np.arange(n - len(tail), n) % self.window] = tail
+        self._window_sum = float(self._ring.sum())
+        self.count = n
+
+    @property
+    def windowed(self):
+        """Accuracy over the last `window` posts."""
+        return self._window_sum / min(self.count, self.window) if self.count else None
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def standard_error(self):
+        """Standard error of the running accuracy."""
+        variance = self.variance
+        return math.sqrt(variance / self.count) if variance is not None else None
+
+    @property
+    def trend(self):
+        """Least-squares slope of the outcomes per post."""
+        return self._comoment / self._index_m2 if self._index_m2 else None
+
+    def summary(self):
+        return {
+            "posts": self.count,
+            "accuracy": self.mean if self.count else None,
+            "standard_error": self.standard_error,
+            "ewma": self.ewma,
+            "windowed": self.windowed,
+            "trend_per_1k_posts": None if self.trend is None else self.trend * 1000,
+        }
+
+
+class OnlineStats:
+    """
+    Live accuracy of both mechanisms: one `AccuracyStream` per name in
+    STREAMS, fed with every post by `simulate`.
     """
-    if not current_population:
-        return [], "downvote", 0
 
-    # Calculate required sample size
-    population_size = len(current_population)
-    required_sample_size = calculate_sample_size(
-        confidence, margin_of_error, population_size
-    )
+    STREAMS = ("staged", "pop_sample")
 
-    # Ensure we don't try to sample more users than available
-    sample_size = min(required_sample_size, population_size)
+    def __init__(self, window=1000, alpha=0.001):
+        self.streams = {name: AccuracyStream(window, alpha) for name in self.STREAMS}
 
-    # Select random users from all users
-    sample_users = (
-        current_population
-        if sample_size >= population_size
-        else random.sample(current_population, sample_size)
-    )
+    def extend(self, name, values):
+        self.streams[name].extend(values)
 
-    # Get votes without affecting Elo
-    votes = []
-    for user in sample_users:
-        vote_decision = vote(user, post)
-        votes.append((user, vote_decision))
+    def postfix(self):
+        """Running and windowed accuracy of every mechanism, for a tqdm postfix."""
+        return {
+            name: f"{stream.mean:.1%}/{stream.windowed:.1%}"
+            for name, stream in self.streams.items()
+            if stream.count
+        }
 
-    # Determine decision
-    upvotes = [user for user, vote in votes if vote == "upvote"]
-    downvotes = [user for user, vote in votes if vote == "downvote"]
+    def log_line(self):
+        parts = []
+        for name, stream in self.streams.items():
+            if not stream.count:
+                continue
+            trend = stream.trend or 0.0
+            parts.append(
+                f"{name} {stream.mean:.2%} +/- {stream.standard_error or 0.0:.2%} "
+                f"(ewma {stream.ewma:.2%}, last {min(stream.count, stream.window)} "
+                f"{stream.windowed:.2%}, trend {trend * 1000:+.3%}/1k posts)"
+            )
+        return "; ".join(parts)
 
-    if not upvotes and downvotes:
-        decision = "downvote"
-    elif not downvotes and upvotes:
-        decision = "upvote"
-    elif len(upvotes) > len(downvotes):
-        decision = "upvote"
-    elif len(downvotes) > len(upvotes):
-        decision = "downvote"
-    else:
-        decision = "draw"
+    def summary(self):
+        return {name: stream.summary() for name, stream in self.streams.items()}
+
+
+# Stages recorded in a vote trace; the single-stage path counts as stage 1
+TRACE_STAGES = ("stage1", "stage2", "special", "population_sample")
+# Not a vote: a user leaving in the steady state, whose slot is reused by
+# later users. Always recorded, so that replays can refuse such traces
+TRACE_RETIRE = "retire"
+TRACE_STAGE_CODES = {
+    stage: code for code, stage in enumerate((*TRACE_STAGES, TRACE_RETIRE))
+}
+
+# One fixed-width (34 byte) record per vote, packed and little-endian
+TRACE_DTYPE = np.dtype(
+    [
+        ("post", "<i8"),
+        ("user", "<i8"),
+        ("elo_before", "<f8"),
+        ("elo_after", "<f8"),
+        ("stage", "u1"),
+        ("vote", "u1"),  # 1 for an upvote
+    ]
+)
+
+
+class VoteTrace:
+    """
+    Audit trail of every vote: post, voter, stage, vote and the voter's ELO
+    before and after the change that vote caused.
+
+    `record` only queues references to the voting arrays; they are packed
+    into TRACE_DTYPE records and appended to `path` in bulk once
+    `buffer_records` votes are queued. Without a path the packed records are
+    kept in memory until `take`. `read_trace` maps a trace file back without
+    copying. In epoch mode `elo_after` is the rating this vote alone would
+    give, and the change is applied at the end of the growth tick.
+
+    Args:
+        path: File to append the records to, or None to keep them in memory
+        buffer_records: Votes queued between writes
+        records: Keep the first `records` records of an existing file (for
+            resuming a checkpointed run) instead of starting it over
+        stages: Record only the votes of these TRACE_STAGES, e.g. leave out
+            the population sample baseline for a compact replay log;
+            TRACE_RETIRE records are always kept
+    """
+
+    active = True
+
+    def __init__(
+        self, path=None, buffer_records=1 << 16, records=0, stages=TRACE_STAGES
+    ):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.stages = frozenset(stages) | {TRACE_RETIRE}
+        self._queue = []
+        self._queued = 0
+        self._written = records
+        self._chunks = []
+        self._file = None
+        if path is not None:
+            self._file = open(path, "r+b" if records else "wb")
+            self._file.truncate(records * TRACE_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+
+    def __len__(self):
+        return self._written + self._queued
+
+    def traces(self, stage):
+        """Whether votes of `stage` are recorded, to skip gathering them."""
+        return stage in self.stages
+
+    def record(self, post_ids, user_ids, stage, upvotes, elo_before, elo_after=None):
+        """
+        Add one record per voter.
+
+        Args:
+            post_ids: Post id of the votes, or an array with one per vote
+            user_ids: Voter ids
+            stage: Name in TRACE_STAGES
+            upvotes: Vote mask
+            elo_before: The voters' ratings before this vote
+            elo_after: Their ratings after it (default: unchanged)
+        """
+        if stage not in self.stages:
+            return
+        if elo_after is None:
+            elo_after = elo_before
+        # Same field order as TRACE_DTYPE
+        entry = (
+            post_ids,
+            user_ids,
+            elo_before,
+            elo_after,
+            TRACE_STAGE_CODES[stage],
+            upvotes,
+        )
+        if np.ndim(post_ids):
+            # Votes on many posts at once, already large enough to write
+            records = np.empty(np.size(user_ids), dtype=TRACE_DTYPE)
+            for field, values in zip(TRACE_DTYPE.names, entry):
+                records[field] = np.ravel(values)
+            self.extend(records)
+            return
+        self._queue.append(entry)
+        self._queued += len(user_ids)
+        if self._queued >= self.buffer_records:
+            self.flush()
+
+    def extend(self, records):
+        """Append a TRACE_DTYPE array of ready-made records."""
+        records = np.asarray(records, dtype=TRACE_DTYPE)
+        if len(self.stages) < len(TRACE_STAGE_CODES):
+            codes = [TRACE_STAGE_CODES[stage] for stage in self.stages]
+            records = records[np.isin(records["stage"], codes)]
+        self.flush()
+        self._write(records)
+
+    def _write(self, records):
+        if self._file is None:
+            self._chunks.append(records.copy())
+        else:
+            records.tofile(self._file)
+        self._written += len(records)
+
+    def flush(self):
+        """Pack and write out the queued votes."""
+        if self._queue:
+            queue, self._queue = self._queue, []
+            lengths = [len(entry[1]) for entry in queue]
+            records = np.empty(self._queued, dtype=TRACE_DTYPE)
+            for field, values in zip(TRACE_DTYPE.names, zip(*queue)):
+                if field in ("post", "stage"):
+                    records[field] = np.repeat(values, lengths)
+                else:
+                    records[field] = np.concatenate(values)
+            self._queued = 0
+            self._write(records)
+        if self._file is not None:
+            self._file.flush()
+
+    def take(self):
+        """Every record of an in-memory trace since the last `take`."""
+        self.flush()
+        chunks, self._chunks = self._chunks, []
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=TRACE_DTYPE)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _NullTrace:
+    """VoteTrace stand-in for untraced runs; check `traces` before gathering."""
+
+    active = False
+
+    def traces(self, stage):
+        return False
+
+    def record(self, *args, **kwargs):
+        pass
+
+    def extend(self, records):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def read_trace(path):
+    """
+    Zero-copy, read-only view of a `VoteTrace` file.
+
+    Returns:
+        np.memmap: TRACE_DTYPE records, e.g. `trace[trace["post"] == 7]`
+    """
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.memmap(path, dtype=TRACE_DTYPE, mode="r")
+
+
+@dataclass(frozen=True)
+class SimulationConfig:
+    """Parameters of a single simulation run."""
+
+    # Population growth
+    max_population: int = 5000
+    posts_per_user: int = 2  # Approximate a more realistic tweet-like frequency
+    growth_rate: float = 0.10
+
+    # New users
+    initial_elo: float = 800
+    goodness_distribution: str = "exponential"  # See GOODNESS_DISTRIBUTIONS
+    goodness_scale: float = 0.3  # Exponential scale, or the beta mean
+    mood_factor_max: float = 0.1  # Mood factors are uniform below this
+
+    # Staged voting
+    k_factor: float = 32
+    elo_threshold: float = 800  # Users at or below vote in the special stage
+    tier_split: float = 0.7  # Share of high-ELO users in the stage 1 tier
+    consensus_threshold: float = 0.7  # Stage 1 agreement that skips stage 2
+    single_stage_threshold: int = 20  # Fewer high-ELO users: one stage only
+    stage1_base_size: int = 5
+    stage1_users_per_extra_voter: int = 1000
+    stage1_max_extra_voters: int = 5
+    stage2_size: int = 5
+    special_stage_size: int = 5
+    forfeit_bonus: float = 0
+
+    # Population sample baseline
+    confidence: float = 0.95
+    margin_of_error: float = 0.05
+    sequential_batch_size: int = 0  # Voters per look; 0 polls the full sample
+
+    # Steady state once max_population is reached
+    steady_rounds: int = 0  # Rounds of churn; 0 stops after growth
+    steady_posts_per_round: int = 1000
+    leave_rate: float = 0.01  # Share of users leaving per round
+    join_rate: float = 0.01  # Share joining per round, up to max_population
+
+    def stage1_user_count(self, population_size):
+        """Number of stage 1 voters for a given total population size."""
+        step = self.stage1_users_per_extra_voter
+        if population_size < step:
+            return self.stage1_base_size  # Default for small populations
+        # For every `step` users, add 1 to the count, up to the maximum
+        additional_users = min(
+            (population_size - step) // step, self.stage1_max_extra_voters
+        )
+        return self.stage1_base_size + additional_users
+
+
+DEFAULT_CONFIG = SimulationConfig()
+
+
+def elo_update(winner_elo, loser_elo, k=32):
+    expected_score = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+    new_winner_elo = winner_elo + k * (1 - expected_score)
+    new_loser_elo = loser_elo - k * (1 - expected_score)
+    return new_winner_elo, new_loser_elo
+
+
+def cast_votes(population, voter_ids, post, rng=DEFAULT_RNG):
+    """
+    Vectorized `vote` for a batch of voters on one post.
+
+    Mood adjustments and vote outcomes for all voters are drawn in a single
+    NumPy call. Each voter's adjusted goodness is stored and their vote count
+    bumped, exactly as `vote` does for a single user.
+
+    Args:
+        population: The `UserPopulation` the voters belong to
+        voter_ids: Index array of the voting users
+        post: The post being voted on
+        rng: `SimulationRNG` for the mood swings and votes
+
+    Returns:
+        np.ndarray: Boolean mask, True where the voter upvoted
+    """
+    voter_ids = np.asarray(voter_ids, dtype=np.intp)
+    return _cast_vote_array(population, voter_ids, post.quality >= 0.5, rng)
+
+
+def _cast_vote_array(population, voter_ids, upvote_is_correct, rng):
+    """
+    Shared body of `cast_votes` for an index array of any shape.
+
+    `upvote_is_correct` must broadcast against `voter_ids`, which lets the
+    batched baseline vote a (posts x sample) matrix in one go.
+    """
+    draws = rng.random_array((5,) + voter_ids.shape)
+    goodness = population._goodness[voter_ids]
+
+    # Mood swing: with probability mood_factor, scale goodness up or down by up to 25%
+    adjustment = 0.25 * draws[1]
+    adjusted = np.where(
+        draws[2] < 0.5,
+        np.minimum(1, goodness * (1 + adjustment)),
+        np.maximum(0, goodness * (1 - adjustment)),
+    )
+    adjusted = np.where(draws[0] < population._mood_factor[voter_ids], adjusted, goodness)
+
+    # Vote correctly with probability adjusted_goodness, otherwise flip a coin
+    upvotes = np.where(draws[3] < adjusted, upvote_is_correct, draws[4] < 0.5)
+
+    population._adjusted_goodness[voter_ids] = adjusted
+    np.add.at(population._vote_count, voter_ids, 1)
+    return upvotes
+
+
+def vote(user, post, rng=DEFAULT_RNG):
+    upvoted = cast_votes(user.population, [user.id], post, rng)[0]
+    return "upvote" if upvoted else "downvote"
+
+
+def _vote_pairs(population, voter_ids, upvotes):
+    """Expand a vote mask into the (User, vote) pairs used by the reporting code."""
+    return [
+        (population[user_id], "upvote" if upvoted else "downvote")
+        for user_id, upvoted in zip(voter_ids.tolist(), upvotes.tolist())
+    ]
+
+
+def apply_team_elo(population, winner_ids, loser_ids, k=32):
+    """
+    Apply the `elo_update_team` deltas to both teams with one scatter-add.
+
+    Returns:
+        tuple: (change_per_winner, change_per_loser)
+    """
+    # Team averages are summed left to right (cumsum rather than the pairwise
+    # mean) so that compiled engines can reproduce them bit for bit
+    change_per_winner, change_per_loser = elo_update_team(
+        population._elo[winner_ids].cumsum()[-1] / len(winner_ids),
+        population._elo[loser_ids].cumsum()[-1] / len(loser_ids),
+        k=k,
+        winner_size=len(winner_ids),
+        loser_size=len(loser_ids),
+    )
+    population.add_elo(
+        np.concatenate([winner_ids, loser_ids]),
+        np.concatenate(
+            [
+                np.full(len(winner_ids), change_per_winner),
+                np.full(len(loser_ids), change_per_loser),
+            ]
+        ),
+    )
+    return change_per_winner, change_per_loser
+
+
+def stage_voting_kernel(
+    population,
+    voter_ids,
+    post,
+    forfeit_bonus=0,
+    k=32,
+    profiler=NULL_PROFILER,
+    rng=DEFAULT_RNG,
+    trace=NULL_TRACE,
+    stage="stage1",
+):
+    """
+    Batched voting stage over an index array of voters.
+
+    Same decision, team and forfeit rules as `stage_voting`, with the ELO
+    deltas applied through `apply_team_elo`. Every vote is recorded in
+    `trace` under `stage`.
+
+    Returns:
+        tuple: (upvotes mask, stage_decision)
+    """
+    voter_ids = np.asarray(voter_ids, dtype=np.intp)
+    traced = trace.traces(stage)
+    elo_before = population._elo[voter_ids] if traced else None
+    with profiler.phase("voting"):
+        upvotes = cast_votes(population, voter_ids, post, rng)
+    profiler.count("voters_evaluated", len(voter_ids))
+    upvote_count = int(np.count_nonzero(upvotes))
+    downvote_count = len(voter_ids) - upvote_count
+    if upvote_count > downvote_count:
+        winning_team = voter_ids[upvotes]
+        losing_team = voter_ids[~upvotes]
+        stage_decision = "upvote"
+    elif downvote_count > upvote_count:
+        winning_team = voter_ids[~upvotes]
+        losing_team = voter_ids[upvotes]
+        stage_decision = "downvote"
+    else:
+        if traced:
+            trace.record(post.id, voter_ids, stage, upvotes, elo_before)
+        return upvotes, "draw"
+    changes = 0
+    with profiler.phase("elo_update"):
+        if not len(losing_team):
+            if len(voter_ids) > 1 and forfeit_bonus:
+                # Forfeit case: Winning team gets a small fixed number of points
+                population.add_elo(winning_team, forfeit_bonus)
+                profiler.count("elo_updates", len(winning_team))
+                changes = forfeit_bonus
+        else:
+            change_per_winner, change_per_loser = apply_team_elo(
+                population, winning_team, losing_team, k=k
+            )
+            profiler.count("elo_updates", len(voter_ids))
+            if traced:
+                changes = np.where(
+                    upvotes == (stage_decision == "upvote"),
+                    change_per_winner,
+                    change_per_loser,
+                )
+    if traced:
+        trace.record(
+            post.id, voter_ids, stage, upvotes, elo_before, elo_before + changes
+        )
+    return upvotes, stage_decision
+
+
+def stage_voting(stage_users, post, forfeit_bonus=0, rng=DEFAULT_RNG):
+    if not stage_users:
+        return [], "draw"
+    population = stage_users[0].population
+    voter_ids = np.array([user.id for user in stage_users], dtype=np.intp)
+    upvotes, stage_decision = stage_voting_kernel(
+        population, voter_ids, post, forfeit_bonus=forfeit_bonus, rng=rng
+    )
+    return _vote_pairs(population, voter_ids, upvotes), stage_decision
+
+
+def elo_update_team(winner_avg_elo, loser_avg_elo, k=32, winner_size=1, loser_size=1):
+    expected_score_winner = 1 / (1 + 10 ** ((loser_avg_elo - winner_avg_elo) / 400))
+    expected_score_loser = 1 - expected_score_winner
+    total_winner_delta = k * (1 - expected_score_winner)
+    total_loser_delta = k * (0 - expected_score_loser)
+    change_per_winner = total_winner_delta / winner_size
+    change_per_loser = total_loser_delta / loser_size
+    return change_per_winner, change_per_loser
+
+
+@functools.lru_cache(maxsize=64)
+def z_score(confidence):
+    """Two-sided z score for a confidence level (e.g., 1.96 for 0.95)."""
+    return NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+
+@functools.lru_cache(maxsize=4096)
+def calculate_sample_size(confidence, margin_of_error, population_size):
+    """
+    Calculate sample size needed for given confidence level and margin of error.
+
+    Results are memoized (least recently used entries are evicted first), since
+    confidence and margin of error are fixed within a run and the population
+    size only changes once per growth tick.
+
+    Args:
+        confidence: Confidence level (e.g., 0.95 for 95%)
+        margin_of_error: Margin of error (e.g., 0.05 for 5%)
+        population_size: Size of the population to sample from
+
+    Returns:
+        Required sample size
+    """
+    # Z score for given confidence level
+    z = z_score(confidence)
+
+    # Use 0.5 for p (worst case scenario for sample size)
+    p = 0.5
+
+    # Sample size calculation
+    numerator = (z**2 * p * (1 - p)) / (margin_of_error**2)
+    denominator = 1 + (z**2 * p * (1 - p)) / (margin_of_error**2 * population_size)
+
+    sample_size = numerator / denominator
+    return math.ceil(sample_size)
+
+
+@functools.lru_cache(maxsize=8)
+def sample_size_curve(confidence, margin_of_error, max_population):
+    """
+    Precompute `calculate_sample_size` for every population size up to
+    `max_population`.
+
+    Returns:
+        np.ndarray: Read-only array where entry n is the sample size for a
+        population of n users (entry 0 is 0)
+    """
+    z = z_score(confidence)
+    p = 0.5
+    population_sizes = np.arange(1, max_population + 1, dtype=np.float64)
+    numerator = (z**2 * p * (1 - p)) / (margin_of_error**2)
+    denominator = 1 + (z**2 * p * (1 - p)) / (margin_of_error**2 * population_sizes)
+    curve = np.zeros(max_population + 1, dtype=np.int64)
+    curve[1:] = np.ceil(numerator / denominator)
+    curve.flags.writeable = False
+    return curve
+
+
+def _required_sample_size(confidence, margin_of_error, population_size, sample_sizes):
+    if sample_sizes is not None and population_size < len(sample_sizes):
+        return int(sample_sizes[population_size])
+    return calculate_sample_size(confidence, margin_of_error, population_size)
+
+
+@functools.lru_cache(maxsize=64)
+def sequential_boundary(confidence, looks):
+    """
+    Group-sequential z boundary for a majority vote checked `looks` times.
+
+    The error rate 1 - confidence is split evenly over the looks (Bonferroni),
+    so a sample that crosses the boundary at any look calls the wrong majority
+    with probability at most 1 - confidence.
+    """
+    return NormalDist().inv_cdf(1 - (1 - confidence) / (2 * looks))
+
+
+def _sequential_stop(upvotes, voted, sample_size, boundary):
+    """
+    Whether a sequential sample can stop after `voted` of `sample_size` votes.
+
+    It stops when the upvote share is `boundary` standard errors away from a
+    tie, when the remaining votes can no longer change the majority, or when
+    the full sample has voted. Works elementwise on arrays.
+    """
+    margin = np.abs(2 * upvotes - voted)
+    return (
+        (margin >= boundary * np.sqrt(voted))
+        | (margin > sample_size - voted)
+        | (voted >= sample_size)
+    )
+
+
+def population_sample_voting(
+    post,
+    current_population,
+    confidence=0.95,
+    margin_of_error=0.05,
+    sample_sizes=None,
+    rng=DEFAULT_RNG,
+    trace=NULL_TRACE,
+    batch_size=0,
+):
+    """
+    Voting stage where a statistically significant sample of the current population votes,
+    using a sample size calculated to achieve the desired confidence level and error margin.
+
+    This voting does not influence Elo adjustments.
+
+    Args:
+        post: The post to vote on
+        current_population: The `UserPopulation` to sample from
+        confidence: Confidence level (default: 0.95)
+        margin_of_error: Margin of error (default: 0.05)
+        sample_sizes: Optional curve from `sample_size_curve` for the same
+            confidence and margin of error
+        rng: `SimulationRNG` for the sample and the votes
+        trace: `VoteTrace` recording every vote
+        batch_size: Poll the sample sequentially, this many voters at a
+            time, and stop as soon as the majority is settled at the given
+            confidence (see `sequential_boundary`). 0 polls the whole sample.
+
+    Returns:
+        tuple: (votes, decision, sample_size), where votes is a
+        (voter ids, upvote mask) pair and sample_size counts the voters
+        actually polled
+    """
+    if not len(current_population):
+        return (np.empty(0, dtype=np.intp), np.empty(0, dtype=bool)), "downvote", 0
+
+    # Calculate required sample size
+    population_size = len(current_population)
+    required_sample_size = _required_sample_size(
+        confidence, margin_of_error, population_size, sample_sizes
+    )
+
+    # Ensure we don't try to sample more users than available
+    sample_size = min(required_sample_size, population_size)
+
+    sequential = batch_size and sample_size > batch_size
+
+    # Select random users from all users
+    sample_ids = (
+        np.arange(population_size)
+        if sample_size >= population_size
+        else np.array(rng.sample(population_size, sample_size))
+    )
+    if sequential:
+        # The sample is polled in order, so every prefix of it must be a
+        # uniform sample as well
+        sample_ids = sample_ids[np.argsort(rng.random_array(sample_size))]
+
+    # Get votes without affecting Elo
+    if sequential:
+        boundary = sequential_boundary(confidence, -(-sample_size // batch_size))
+        upvotes = np.empty(sample_size, dtype=bool)
+        upvote_count = 0
+        for start in range(0, sample_size, batch_size):
+            stop = min(start + batch_size, sample_size)
+            upvotes[start:stop] = cast_votes(
+                current_population, sample_ids[start:stop], post, rng
+            )
+            upvote_count += int(np.count_nonzero(upvotes[start:stop]))
+            if _sequential_stop(upvote_count, stop, sample_size, boundary):
+                break
+        sample_ids = sample_ids[:stop]
+        upvotes = upvotes[:stop]
+        sample_size = stop
+    else:
+        upvotes = cast_votes(current_population, sample_ids, post, rng)
+    if trace.traces("population_sample"):
+        trace.record(
+            post.id,
+            sample_ids,
+            "population_sample",
+            upvotes,
+            current_population.elo[sample_ids],
+        )
+
+    # Determine decision
+    upvote_count = int(np.count_nonzero(upvotes))
+    downvote_count = len(sample_ids) - upvote_count
+    if upvote_count > downvote_count:
+        decision = "upvote"
+    elif downvote_count > upvote_count:
+        decision = "downvote"
+    else:
+        decision = "draw"
+
+    votes = (sample_ids, upvotes)
+    return votes, decision, sample_size
+
+
+def _sample_rows(population_size, sample_size, rows, rng, shuffled=False):
+    """
+    Draw `rows` independent samples of `sample_size` distinct user ids.
+
+    Samples of up to half the population are drawn with replacement, and the
+    later of every two equal ids in a row is redrawn until the rows are
+    distinct, which leaves every ordered sample equally likely. Larger samples
+    keep the `sample_size` smallest of a row of random keys.
+
+    With `shuffled`, every prefix of a row is a uniform sample as well (the
+    whole population comes back in random order instead of as a range, and
+    the smallest keys in key order), for samples that are polled in order.
+    """
+    if sample_size >= population_size and not shuffled:
+        return np.broadcast_to(np.arange(population_size), (rows, population_size))
+    sample_size = min(sample_size, population_size)
+    if 2 * sample_size <= population_size:
+        # Sort (id, column) pairs packed into one integer, as narrow as fits:
+        # equal ids end up next to each other in column order
+        bits = max(1, (sample_size - 1).bit_length())
+        key_type = (
+            np.int32
+            if population_size << bits <= np.iinfo(np.int32).max
+            else np.int64
+        )
+        columns = np.arange(sample_size, dtype=key_type)
+        samples = rng.integers(0, population_size, size=(rows, sample_size))
+        pending = np.arange(rows)
+        while len(pending):
+            block = samples[pending]
+            keys = np.sort((block.astype(key_type) << bits) | columns, axis=1)
+            ids = keys >> bits
+            clash_rows, clash_columns = np.nonzero(ids[:, 1:] == ids[:, :-1])
+            later = keys[clash_rows, clash_columns + 1] & ((1 << bits) - 1)
+            block[clash_rows, later] = rng.integers(
+                0, population_size, size=len(clash_rows)
+            )
+            samples[pending] = block
+            pending = pending[np.unique(clash_rows)]
+        return samples
+    # Bound the key matrix to a few million entries at a time
+    chunk = max(1, 4_000_000 // population_size)
+    samples = np.empty((rows, sample_size), dtype=np.intp)
+    for start in range(0, rows, chunk):
+        keys = rng.random_array((min(chunk, rows - start), population_size))
+        if sample_size == population_size:
+            picked = np.argsort(keys, axis=1)
+        else:
+            picked = np.argpartition(keys, sample_size, axis=1)[:, :sample_size]
+            if shuffled:
+                # argpartition leaves the smallest keys in no particular order
+                picked_keys = np.take_along_axis(keys, picked, axis=1)
+                picked = np.take_along_axis(
+                    picked, np.argsort(picked_keys, axis=1), axis=1
+                )
+        samples[start : start + chunk] = picked
+    return samples
+
+
+def population_sample_voting_batch(
+    posts,
+    current_population,
+    confidence=0.95,
+    margin_of_error=0.05,
+    sample_sizes=None,
+    rng=DEFAULT_RNG,
+    trace=NULL_TRACE,
+    batch_size=0,
+):
+    """
+    Batched `population_sample_voting` over every post of a growth tick.
+
+    The baseline never touches ELO, so posts are independent of each other and
+    the whole tick is voted as one (posts x sample) matrix. With `batch_size`,
+    the matrix is voted a block of columns at a time, for the posts whose
+    sample has not stopped yet.
+
+    Args:
+        posts: The posts to vote on
+        current_population: The `UserPopulation` to sample from
+        confidence: Confidence level (default: 0.95)
+        margin_of_error: Margin of error (default: 0.05)
+        sample_sizes: Optional curve from `sample_size_curve` for the same
+            confidence and margin of error
+        rng: `SimulationRNG` for the samples and the votes
+        trace: `VoteTrace` recording every vote
+        batch_size: See `population_sample_voting`
+
+    Returns:
+        tuple: (decisions, sample_sizes) arrays with one entry per post, where
+        sample_sizes counts the voters actually polled
+    """
+    population_size = len(current_population)
+    if not population_size:
+        return np.full(len(posts), "downvote"), np.zeros(len(posts), dtype=np.int64)
+
+    sample_size = min(
+        _required_sample_size(
+            confidence, margin_of_error, population_size, sample_sizes
+        ),
+        population_size,
+    )
+    sequential = batch_size and sample_size > batch_size
+    sample_ids = _sample_rows(
+        population_size, sample_size, len(posts), rng, shuffled=sequential
+    )
+    qualities = np.array([post.quality for post in posts])
+    upvote_is_correct = (qualities >= 0.5)[:, None]
+    if sequential:
+        boundary = sequential_boundary(confidence, -(-sample_size // batch_size))
+        upvotes = np.zeros(sample_ids.shape, dtype=bool)
+        upvote_counts = np.zeros(len(posts), dtype=np.int64)
+        realized_sizes = np.full(len(posts), sample_size, dtype=np.int64)
+        active = np.arange(len(posts))
+        for start in range(0, sample_size, batch_size):
+            stop = min(start + batch_size, sample_size)
+            batch = _cast_vote_array(
+                current_population,
+                sample_ids[active, start:stop],
+                upvote_is_correct[active],
+                rng,
+            )
+            upvotes[active, start:stop] = batch
+            upvote_counts[active] += np.count_nonzero(batch, axis=1)
+            done = _sequential_stop(upvote_counts[active], stop, sample_size, boundary)
+            realized_sizes[active[done]] = stop
+            active = active[~done]
+            if not len(active):
+                break
+        polled = np.arange(sample_size) < realized_sizes[:, None]
+    else:
+        upvotes = _cast_vote_array(
+            current_population, sample_ids, upvote_is_correct, rng
+        )
+        upvote_counts = np.count_nonzero(upvotes, axis=1)
+        realized_sizes = np.full(len(posts), sample_size, dtype=np.int64)
+        polled = None
+    if trace.traces("population_sample"):
+        voter_ids = sample_ids if polled is None else sample_ids[polled]
+        trace.record(
+            np.repeat([post.id for post in posts], realized_sizes),
+            voter_ids,
+            "population_sample",
+            upvotes if polled is None else upvotes[polled],
+            current_population.elo[voter_ids],
+        )
+
+    downvote_counts = realized_sizes - upvote_counts
+    decisions = np.where(
+        upvote_counts > downvote_counts,
+        "upvote",
+        np.where(downvote_counts > upvote_counts, "downvote", "draw"),
+    )
+    return decisions, realized_sizes
+
+
+def multi_stage_voting(
+    post,
+    all_users,
+    config=DEFAULT_CONFIG,
+    profiler=NULL_PROFILER,
+    rng=DEFAULT_RNG,
+    trace=NULL_TRACE,
+):
+    """
+    Implements a two-stage voting mechanism for a given post using ELO tiers.
+    Only considers users with elo > 800.
+    If the number of filtered users is less than 20, a single stage voting is performed by selecting 5 users from the filtered users.
+    Otherwise:
+      - Stage 1: Bottom 70% of the filtered users (select users based on population size)
+      - Stage 2: Top 30% of the filtered users (select 5 users) - only if Stage 1 was inconclusive
+    A decision is considered conclusive if 70% or more of the voters agree.
+    After the final decision is determined, a special stage is executed for users with elo <= 800.
+    This special stage selects 5 users from the low-elo group and adjusts their elo based on whether their vote matches the final decision.
+    Their votes do not affect the overall decision or metrics.
+    The numbers above are the defaults; every threshold and size is read from `config`.
+    Every vote of every stage is recorded in `trace`.
+    """
+    total_users = len(all_users)
+    if not total_users:
+        return (
+            [],
+            "downvote",
+            0,
+            [],
+            [],
+            [],
+        )  # Added empty lists for stage1, stage2, low_elo participants
+
+    # Users with elo > 800 occupy the top ranks of the index
+    index = all_users.rank_index
+    with profiler.phase("tier_lookup"):
+        low_elo_count = index.count_at_most(config.elo_threshold)
+    if low_elo_count < total_users:
+        lo = low_elo_count
+    else:
+        lo = 0  # No high-ELO users: fall back to the whole population
+
+    N = total_users - lo
+
+    def select(start, stop, count):
+        with profiler.phase("sampling"):
+            ids = (
+                index.ids(start, stop)
+                if stop - start <= count
+                else index.sample(start, stop, count, rng)
+            )
+        profiler.count("users_scanned", len(ids))
+        return np.array(ids, dtype=np.intp)
+
+    # Get the number of stage 1 users based on the total population
+    stage1_user_count = config.stage1_user_count(total_users)
+
+    # Index arrays tracking which users participated in each stage
+    no_participants = np.empty(0, dtype=np.intp)
+    stage1_participants = no_participants
+    stage2_participants = no_participants
+    low_elo_participants = no_participants
+
+    # If there are less than 20 filtered users, perform single stage voting
+    if N < config.single_stage_threshold:
+        # Consider these as stage 1 participants
+        stage1_participants = select(lo, total_users, stage1_user_count)
+        upvotes, decision = stage_voting_kernel(
+            all_users,
+            stage1_participants,
+            post,
+            config.forfeit_bonus,
+            config.k_factor,
+            profiler,
+            rng,
+            trace,
+        )
+        voter_ids = stage1_participants
+    else:
+        split = lo + int(config.tier_split * N)
+        # Tiers are fixed before any ELO moves, so stage 2 candidates are
+        # drawn up front from the top 30% as it stands now
+        stage2_candidates = select(split, total_users, config.stage2_size)
+
+        # Stage 1: Bottom 70% of the filtered users
+        stage1_participants = select(lo, split, stage1_user_count)
+        upvotes1, decision1 = stage_voting_kernel(
+            all_users,
+            stage1_participants,
+            post,
+            config.forfeit_bonus,
+            config.k_factor,
+            profiler,
+            rng,
+            trace,
+        )
+        upvotes, decision, voter_ids = upvotes1, decision1, stage1_participants
+
+        # Check if stage 1 was conclusive (70% or more agreement)
+        total_votes = len(upvotes1)
+        if total_votes > 0:
+            upvote_count = int(np.count_nonzero(upvotes1))
+            upvote_ratio = upvote_count / total_votes
+            downvote_ratio = (total_votes - upvote_count) / total_votes
+
+            if upvote_ratio >= config.consensus_threshold:
+                decision = "upvote"
+            elif downvote_ratio >= config.consensus_threshold:
+                decision = "downvote"
+            else:
+                # Stage 2: Top 30% of the filtered users (only if stage 1 was inconclusive)
+                stage2_participants = stage2_candidates
+                upvotes, decision = stage_voting_kernel(
+                    all_users,
+                    stage2_participants,
+                    post,
+                    config.forfeit_bonus,
+                    config.k_factor,
+                    profiler,
+                    rng,
+                    trace,
+                    "stage2",
+                )
+                voter_ids = stage2_participants
+
+    sample_size = len(stage1_participants) + len(stage2_participants)
+    votes = _vote_pairs(all_users, voter_ids, upvotes)
+
+    # Special stage for users with elo <= 800 (only if final decision is 'upvote' or 'downvote')
+    if decision in ["upvote", "downvote"]:
+        with profiler.phase("tier_lookup"):
+            low_elo_count = index.count_at_most(config.elo_threshold)
+        if low_elo_count:
+            # Get the users' votes without affecting overall metrics
+            low_elo_participants = select(0, low_elo_count, config.special_stage_size)
+            traced = trace.traces("special")
+            elo_before = all_users._elo[low_elo_participants] if traced else None
+            with profiler.phase("voting"):
+                special_upvotes = cast_votes(
+                    all_users, low_elo_participants, post, rng
+                )
+            profiler.count("voters_evaluated", len(low_elo_participants))
+            agreed = special_upvotes == (decision == "upvote")
+            winners = low_elo_participants[agreed]
+            losers = low_elo_participants[~agreed]
+            changes = 0
+            if len(winners) and len(losers):
+                with profiler.phase("elo_update"):
+                    change_per_winner, change_per_loser = apply_team_elo(
+                        all_users, winners, losers, k=config.k_factor
+                    )
+                profiler.count("elo_updates", len(low_elo_participants))
+                if traced:
+                    changes = np.where(agreed, change_per_winner, change_per_loser)
+            if traced:
+                trace.record(
+                    post.id,
+                    low_elo_participants,
+                    "special",
+                    special_upvotes,
+                    elo_before,
+                    elo_before + changes,
+                )
+
+    return (
+        votes,
+        decision,
+        sample_size,
+        stage1_participants,
+        stage2_participants,
+        low_elo_participants,
+    )
+
+
+def vote_correct_probability(goodness, mood_factor):
+    """
+    Probability that voters vote correctly, in closed form.
+
+    `cast_votes` swings goodness g by a factor 1 +/- 0.25u (u uniform, the
+    result clipped to [0, 1]) with probability mood_factor. The voter is then
+    right with probability equal to the adjusted goodness a, and otherwise
+    flips a coin, so P(correct) = (1 + E[a]) / 2.
+    """
+    goodness = np.asarray(goodness, dtype=np.float64)
+    mood_factor = np.asarray(mood_factor, dtype=np.float64)
+    # Swing down: g (1 - 0.25u) never drops below 0
+    down = 0.875 * goodness
+    # Swing up: g (1 + 0.25u) is capped at 1 once u passes 4 (1/g - 1)
+    uncapped = np.where(goodness <= 0.8, 1.0, 4 * (1 / np.maximum(goodness, 0.8) - 1))
+    up = goodness * (uncapped + 0.125 * uncapped**2) + 1 - uncapped
+    adjusted = (1 - mood_factor) * goodness + mood_factor * (up + down) / 2
+    return (1 + adjusted) / 2
+
+
+def subset_vote_distribution(probabilities, k):
+    """
+    Distribution of the correct votes of `k` voters drawn uniformly without
+    replacement (all of them if there are no more than `k`).
+
+    This is a Poisson-binomial distribution averaged over every possible
+    draw, i.e. the coefficients of the degree-k part (in y) of
+    prod(1 + y (q + p x)) divided by the number of draws. Small candidate
+    pools build it up one voter at a time in O(n k^2). Larger ones evaluate
+    it at k + 1 roots of unity in x, in O(n k) vectorized operations, through
+    Newton's identities. Those only lose precision when n is close to k.
+
+    Args:
+        probabilities: Probability that each candidate votes correctly
+        k: Number of voters drawn
+
+    Returns:
+        np.ndarray: Entry c is the probability of c correct votes, for c up
+        to min(k, len(probabilities))
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    n = len(probabilities)
+    k = min(k, n)
+    if n < 8 * k:
+        # Row j: distribution for a uniform j-subset of the candidates so far
+        table = np.zeros((k + 1, k + 1))
+        table[0, 0] = 1.0
+        subset_sizes = np.arange(1, k + 1)[:, None]
+        for seen, p in enumerate(probabilities.tolist(), 1):
+            # Chance that a uniform j-subset of the first `seen` has the last
+            included = np.minimum(subset_sizes / seen, 1.0)
+            with_voter = table[:-1] * (1 - p)
+            with_voter[:, 1:] += table[:-1, :-1] * p
+            table[1:] = (1 - included) * table[1:] + included * with_voter
+        return table[k]
+
+    points = np.exp(2j * np.pi * np.arange(k + 1) / (k + 1))
+    # Every candidate's q + p x at the points, scaled by 1/n against overflow
+    values = (1 - probabilities[:, None] + probabilities[:, None] * points) / n
+    power_sums = np.empty((k + 1, k + 1), dtype=np.complex128)
+    power = np.ones_like(values)
+    for m in range(1, k + 1):
+        power *= values
+        power_sums[m] = power.sum(axis=0)
+    # Newton's identities: j e_j = sum over m of (-1)^(m-1) e_(j-m) p_m
+    elementary = np.zeros((k + 1, k + 1), dtype=np.complex128)
+    elementary[0] = 1.0
+    signs = (-1.0) ** np.arange(k)[:, None]
+    for j in range(1, k + 1):
+        elementary[j] = (
+            signs[:j] * elementary[j - 1 :: -1] * power_sums[1 : j + 1]
+        ).sum(axis=0) / j
+    # Back from the points to coefficients, divided by C(n, k) / n^k draws
+    coefficients = np.fft.fft(elementary[k]).real / (k + 1)
+    return np.maximum(coefficients / (math.comb(n, k) / n**k), 0.0)
+
+
+def _majority_probabilities(upvotes):
+    """DECISIONS probabilities of a majority vote with this upvote distribution."""
+    voters = len(upvotes) - 1
+    doubled = 2 * np.arange(voters + 1)
+    return np.array(
+        [
+            upvotes[doubled < voters].sum(),
+            upvotes[doubled > voters].sum(),
+            upvotes[doubled == voters].sum(),
+        ]
+    )
+
+
+def decision_probabilities(population, config=DEFAULT_CONFIG):
+    """
+    Exact probabilities of every `multi_stage_voting` decision on the current
+    tiers of `population`.
+
+    Stage voters are drawn from the tiers as `multi_stage_voting` draws them
+    and vote independently with `vote_correct_probability`, so the upvotes
+    of each stage follow `subset_vote_distribution`. The consensus rule, the
+    stage 2 majority and draws are then evaluated exactly. The special stage
+    never changes the decision and is left out.
+
+    Returns:
+        np.ndarray: (2, 3) array of probabilities in DECISIONS order, row 0
+        for a bad post (quality < 0.5) and row 1 for a good one
+    """
+    probabilities = np.zeros((2, len(DECISIONS)))
+    total_users = len(population)
+    if not total_users:
+        probabilities[:, DECISION_CODES["downvote"]] = 1.0
+        return probabilities
+
+    index = population.rank_index
+    low_elo_count = index.count_at_most(config.elo_threshold)
+    lo = low_elo_count if low_elo_count < total_users else 0
+    N = total_users - lo
+    correct = vote_correct_probability(population.goodness, population.mood_factor)
+    stage1_user_count = config.stage1_user_count(total_users)
+
+    def correct_votes(start, stop, count):
+        return subset_vote_distribution(
+            correct[np.array(index.ids(start, stop), dtype=np.intp)], count
+        )
+
+    if N < config.single_stage_threshold:
+        stage1 = correct_votes(lo, total_users, stage1_user_count)
+        stage2 = None
+    else:
+        split = lo + int(config.tier_split * N)
+        stage1 = correct_votes(lo, split, stage1_user_count)
+        stage2 = correct_votes(split, total_users, config.stage2_size)
+
+    # A good post's upvotes are its correct votes, a bad post's the others
+    for good in (False, True):
+        upvotes1 = stage1 if good else stage1[::-1]
+        total_votes = len(upvotes1) - 1
+        if stage2 is None or not total_votes:
+            probabilities[int(good)] = _majority_probabilities(upvotes1)
+            continue
+        upvote_count = np.arange(total_votes + 1)
+        upvoted = upvote_count / total_votes >= config.consensus_threshold
+        downvoted = ~upvoted & (
+            (total_votes - upvote_count) / total_votes >= config.consensus_threshold
+        )
+        inconclusive = upvotes1[~(upvoted | downvoted)].sum()
+        upvotes2 = stage2 if good else stage2[::-1]
+        probabilities[int(good)] = inconclusive * _majority_probabilities(upvotes2)
+        probabilities[int(good), DECISION_CODES["downvote"]] += upvotes1[
+            downvoted
+        ].sum()
+        probabilities[int(good), DECISION_CODES["upvote"]] += upvotes1[upvoted].sum()
+    return probabilities
+
+
+def expected_accuracy(population, qualities, config=DEFAULT_CONFIG):
+    """
+    Probability that `multi_stage_voting` decides each post correctly on the
+    current tiers of `population` (see `decision_probabilities`).
+    """
+    probabilities = decision_probabilities(population, config)
+    return np.where(
+        np.asarray(qualities) >= 0.5,
+        probabilities[1, DECISION_CODES["upvote"]],
+        probabilities[0, DECISION_CODES["downvote"]],
+    )
+
+
+USERS_FILE = "users.npz"  # Final user columns, next to the metric columns
+
+DECISIONS = ("downvote", "upvote", "draw")
+DECISION_CODES = {decision: code for code, decision in enumerate(DECISIONS)}
+
+# Columns recorded by `simulate`, with their storage types
+METRIC_COLUMNS = {
+    # One entry per post
+    "post_ids": np.int64,
+    "decisions": np.int8,  # Index into DECISIONS
+    "correct_votes_stats": np.int8,
+    "sample_sizes": np.int32,
+    "cumulative_votes_list": np.int64,
+    "pop_sample_correct_votes_stats": np.int8,
+    "pop_sample_sample_sizes": np.int32,
+    # Outcomes of the steady-state posts, which record nothing else per post
+    "steady_correct_votes_stats": np.int8,
+    "steady_pop_sample_correct_votes_stats": np.int8,
+    "expected_correct": np.float64,  # Only with analytic scoring
+    "stage1_participants_count": np.int32,
+    "stage2_participants_count": np.int32,
+    "low_elo_participants_count": np.int32,
+    "stage1_population_sizes": np.int64,
+    "stage2_population_sizes": np.int64,
+    "low_elo_population_sizes": np.int64,
+    # One entry per upvoted post
+    "upvoted_posts_quality": np.float64,
+    # One entry per growth tick
+    "population_sizes": np.int64,
+    # One entry per steady-state round
+    "steady_population_sizes": np.int64,
+    "steady_accuracy": np.float64,
+    "steady_pop_sample_accuracy": np.float64,
+    "steady_expected_accuracy": np.float64,  # Only with analytic scoring
+    "steady_mean_elo": np.float64,
+    "steady_high_elo_share": np.float64,
+    "steady_posts_per_second": np.float64,
+}
+
+
+class MetricsSink:
+    """
+    Columnar store for the metrics recorded during a run.
+
+    Each column buffers values in a fixed-size typed chunk. Full chunks are
+    appended to `<directory>/<column>.bin` when a directory is given, so
+    resident memory stays flat however long the run is; without a directory
+    the chunks are kept in memory. `MetricsReader` maps the files back lazily.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory=None, columns=METRIC_COLUMNS, chunk_size=65536):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._dtypes = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self._buffers = {
+            name: np.empty(chunk_size, dtype=dtype)
+            for name, dtype in self._dtypes.items()
+        }
+        self._fill = dict.fromkeys(columns, 0)
+        self._lengths = dict.fromkeys(columns, 0)
+        self._chunks = {name: [] for name in columns}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name in columns:
+                # Start every column from an empty file
+                open(self._column_path(name), "wb").close()
+
+    def _column_path(self, name):
+        return os.path.join(self.directory, name + ".bin")
+
+    def append(self, name, value):
+        fill = self._fill[name]
+        self._buffers[name][fill] = value
+        fill += 1
+        self._fill[name] = fill
+        if fill == self.chunk_size:
+            self._flush_column(name)
+
+    def extend(self, name, values):
+        values = np.asarray(values, dtype=self._dtypes[name])
+        while len(values):
+            fill = self._fill[name]
+            take = min(self.chunk_size - fill, len(values))
+            self._buffers[name][fill : fill + take] = values[:take]
+            self._fill[name] = fill + take
+            values = values[take:]
+            if fill + take == self.chunk_size:
+                self._flush_column(name)
+
+    def _flush_column(self, name):
+        fill = self._fill[name]
+        if not fill:
+            return
+        chunk = self._buffers[name][:fill]
+        if self.directory is None:
+            self._chunks[name].append(chunk.copy())
+        else:
+            with open(self._column_path(name), "ab") as f:
+                chunk.tofile(f)
+        self._lengths[name] += fill
+        self._fill[name] = 0
+
+    def flush(self):
+        """Write out every partially filled chunk and the manifest."""
+        for name in self._buffers:
+            self._flush_column(name)
+        if self.directory is not None:
+            manifest = {
+                name: {"dtype": self._dtypes[name].str, "length": length}
+                for name, length in self._lengths.items()
+            }
+            with open(os.path.join(self.directory, self.MANIFEST), "w") as f:
+                json.dump(manifest, f, indent=2)
+
+    def column_length(self, name):
+        return self._lengths[name] + self._fill[name]
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held in memory: the chunk buffers and, without a directory,
+        every chunk recorded so far.
+        """
+        buffers = sum(buffer.nbytes for buffer in self._buffers.values())
+        chunks = sum(
+            chunk.nbytes for chunks in self._chunks.values() for chunk in chunks
+        )
+        return buffers + chunks
+
+    def values(self, name, start=0):
+        """Copy of everything recorded in column `name` from index `start` on."""
+        dtype = self._dtypes[name]
+        parts = []
+        if start < self._lengths[name]:
+            if self.directory is None:
+                offset = 0
+                for chunk in self._chunks[name]:
+                    if offset + len(chunk) > start:
+                        parts.append(chunk[max(start - offset, 0) :])
+                    offset += len(chunk)
+            else:
+                parts.append(
+                    np.fromfile(
+                        self._column_path(name),
+                        dtype=dtype,
+                        offset=start * dtype.itemsize,
+                    )
+                )
+        buffered_from = max(start - self._lengths[name], 0)
+        parts.append(self._buffers[name][buffered_from : self._fill[name]])
+        return np.concatenate(parts)
+
+    def columns(self):
+        """
+        Flush and return every column.
+
+        Returns:
+            dict or MetricsReader: Concatenated arrays for an in-memory sink,
+            a lazy memory-mapped reader for an on-disk one
+        """
+        self.flush()
+        if self.directory is not None:
+            return MetricsReader(self.directory)
+        return {
+            name: (
+                np.concatenate(chunks)
+                if chunks
+                else np.empty(0, dtype=self._dtypes[name])
+            )
+            for name, chunks in self._chunks.items()
+        }
+
+
+class MetricsReader:
+    """Read-only mapping of column name to `np.memmap`, opened on first access."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MetricsSink.MANIFEST)) as f:
+            self._manifest = json.load(f)
+        self._columns = {}
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            entry = self._manifest[name]
+            if entry["length"]:
+                column = np.memmap(
+                    os.path.join(self.directory, name + ".bin"),
+                    dtype=np.dtype(entry["dtype"]),
+                    mode="r",
+                    shape=(entry["length"],),
+                )
+            else:
+                column = np.empty(0, dtype=np.dtype(entry["dtype"]))
+            self._columns[name] = column
+        return self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._manifest
+
+    def __iter__(self):
+        return iter(self._manifest)
+
+    def __len__(self):
+        return len(self._manifest)
+
+    def keys(self):
+        return self._manifest.keys()
+
+    def items(self):
+        return ((name, self[name]) for name in self._manifest)
+
+
+# Per-post columns filled in by an `Engine`
+ENGINE_COLUMNS = (
+    "decisions",
+    "sample_sizes",
+    "stage1_participants_count",
+    "stage2_participants_count",
+    "low_elo_participants_count",
+    "stage1_population_sizes",
+    "stage2_population_sizes",
+    "low_elo_population_sizes",
+)
+
+
+def post_block_size(config):
+    """
+    Uniforms drawn per post: one per sampled voter and five per vote, for the
+    largest possible stage 1, stage 2 and special stage.
+    """
+    max_voters = (
+        config.stage1_base_size
+        + max(config.stage1_max_extra_voters, 0)
+        + config.stage2_size
+        + config.special_stage_size
+    )
+    return 6 * max_voters
+
+
+class Engine:
+    """
+    Backend running the staged voting for every post of a growth tick.
+
+    Each post is given a block of `post_block_size` uniforms drawn up front
+    from the simulation RNG. Within a post, backends consume that block in
+    the order `multi_stage_voting` does with a `_UniformBlock`: the stage 2
+    candidates are sampled, then stage 1 (Floyd's algorithm, one uniform per
+    voter), then every stage votes with five uniforms per voter laid out row
+    by row. Backends that follow this layout make identical decisions.
+
+    Subclasses implement `vote_posts`, and may rebuild private state from the
+    population in `begin_tick`.
+    """
+
+    name = None
+    # Posts whose uniforms are drawn and voted at once
+    POST_CHUNK = 4096
+
+    def begin_tick(self, users):
+        pass
+
+    def close(self):
+        """Release worker processes and shared memory, if the backend has any."""
+
+    def vote_posts(
+        self, users, posts, qualities, uniforms, config, out, profiler, trace=NULL_TRACE
+    ):
+        """
+        Vote `posts` in order, filling row i of every `out` column for post i.
+
+        Args:
+            users: The `UserPopulation`, deferring ELO changes in epoch mode
+            posts: The posts to vote on
+            qualities: Their qualities as an array
+            uniforms: (posts x post_block_size) array of uniforms
+            config: `SimulationConfig` of the run
+            out: ENGINE_COLUMNS name -> array slice for these posts
+            profiler: `Profiler` for the phases of the reference backend
+            trace: `VoteTrace` recording every vote, in post order
+        """
+        raise NotImplementedError
+
+    def vote_tick(
+        self,
+        users,
+        posts,
+        config,
+        rng,
+        epoch_elo=False,
+        profiler=NULL_PROFILER,
+        trace=NULL_TRACE,
+    ):
+        """
+        Vote every post of a growth tick.
+
+        Returns:
+            dict: ENGINE_COLUMNS name -> array with one entry per post
+        """
+        results = {
+            name: np.empty(len(posts), dtype=METRIC_COLUMNS[name])
+            for name in ENGINE_COLUMNS
+        }
+        qualities = np.array([post.quality for post in posts], dtype=np.float64)
+        block_size = post_block_size(config)
+        if epoch_elo:
+            users.defer_elo()
+        self.begin_tick(users)
+        for start in range(0, len(posts), self.POST_CHUNK):
+            stop = min(start + self.POST_CHUNK, len(posts))
+            uniforms = rng.random_array((stop - start, block_size))
+            self.vote_posts(
+                users,
+                posts[start:stop],
+                qualities[start:stop],
+                uniforms,
+                config,
+                {name: column[start:stop] for name, column in results.items()},
+                profiler,
+                trace,
+            )
+        if epoch_elo:
+            with profiler.phase("elo_commit"):
+                users.commit_elo()
+        return results
+
+
+class PythonEngine(Engine):
+    """Reference backend: `multi_stage_voting` post by post."""
+
+    name = "python"
+
+    def vote_posts(
+        self, users, posts, qualities, uniforms, config, out, profiler, trace=NULL_TRACE
+    ):
+        for i, post in enumerate(posts):
+            # Record group populations at this point
+            with profiler.phase("tier_lookup"):
+                filtered_count = len(users) - users.rank_index.count_at_most(
+                    config.elo_threshold
+                )
+            if not filtered_count:
+                # If no high-ELO users, consider all users as low-ELO
+                out["stage1_population_sizes"][i] = 0
+                out["stage2_population_sizes"][i] = 0
+                out["low_elo_population_sizes"][i] = len(users)
+            else:
+                # Stage 1: Bottom 70%
+                stage1_group_size = int(config.tier_split * filtered_count)
+                out["stage1_population_sizes"][i] = stage1_group_size
+                # Stage 2: Top 30%
+                out["stage2_population_sizes"][i] = filtered_count - stage1_group_size
+                # Low ELO: Users with ELO <= 800
+                out["low_elo_population_sizes"][i] = len(users) - filtered_count
+
+            (
+                _,
+                decision,
+                sample_size,
+                stage1_participants,
+                stage2_participants,
+                low_elo_participants,
+            ) = multi_stage_voting(
+                post, users, config, profiler, _UniformBlock(uniforms[i]), trace
+            )
+            out["decisions"][i] = DECISION_CODES[decision]
+            out["sample_sizes"][i] = sample_size
+            out["stage1_participants_count"][i] = len(stage1_participants)
+            out["stage2_participants_count"][i] = len(stage2_participants)
+            out["low_elo_participants_count"][i] = len(low_elo_participants)
+
+
+class EngineMismatchError(AssertionError):
+    """Raised by `CrossCheckEngine` when two backends disagree."""
+
+
+class CrossCheckEngine(Engine):
+    """
+    Runs a candidate backend next to the reference one on a copy of the
+    population, and raises `EngineMismatchError` unless decisions, counts,
+    every user column and, when tracing, every vote come out identical.
+    """
+
+    name = "check"
+
+    def __init__(self, reference, candidate):
+        self.reference = reference
+        self.candidate = candidate
+
+    def begin_tick(self, users):
+        self.reference.begin_tick(users)
+
+    def vote_posts(
+        self, users, posts, qualities, uniforms, config, out, profiler, trace=NULL_TRACE
+    ):
+        clone = users.copy()
+        candidate_out = {name: np.empty_like(column) for name, column in out.items()}
+        if trace.active:
+            reference_trace, candidate_trace = VoteTrace(), VoteTrace()
+        else:
+            reference_trace = candidate_trace = NULL_TRACE
+        self.candidate.begin_tick(clone)
+        self.candidate.vote_posts(
+            clone,
+            posts,
+            qualities,
+            uniforms,
+            config,
+            candidate_out,
+            NULL_PROFILER,
+            candidate_trace,
+        )
+        self.reference.vote_posts(
+            users, posts, qualities, uniforms, config, out, profiler, reference_trace
+        )
+
+        for name, column in out.items():
+            mismatch = np.flatnonzero(column != candidate_out[name])
+            if len(mismatch):
+                post = posts[mismatch[0]]
+                raise EngineMismatchError(
+                    f"{self.candidate.name} engine disagrees with "
+                    f"{self.reference.name} on {name} for post {post.id}: "
+                    f"{candidate_out[name][mismatch[0]]} != {column[mismatch[0]]}"
+                )
+        for name in users.COLUMNS:
+            if not np.array_equal(getattr(users, name), getattr(clone, name)):
+                raise EngineMismatchError(
+                    f"{self.candidate.name} engine disagrees with "
+                    f"{self.reference.name} on the {name} column after posts "
+                    f"{posts[0].id}-{posts[-1].id}"
+                )
+        if users._pending_elo is not None and not np.array_equal(
+            users.pending_elo(), clone.pending_elo()
+        ):
+            raise EngineMismatchError(
+                f"{self.candidate.name} engine disagrees with "
+                f"{self.reference.name} on the deferred ELO changes after posts "
+                f"{posts[0].id}-{posts[-1].id}"
+            )
+        if trace.active:
+            records = reference_trace.take()
+            if not np.array_equal(records, candidate_trace.take()):
+                raise EngineMismatchError(
+                    f"{self.candidate.name} engine disagrees with "
+                    f"{self.reference.name} on the vote trace of posts "
+                    f"{posts[0].id}-{posts[-1].id}"
+                )
+            trace.extend(records)
+
+
+# Per-process state of a `ParallelEngine` worker: the attached shared memory
+# segments and the population view of the tick being voted
+_worker_state = {"segments": {}, "tick": None}
+
+
+def _attach_tick(backend, tick, spec):
+    """
+    Worker side: the population view and engine for growth tick `tick`.
+
+    The shared elo, goodness and mood_factor columns are attached once per
+    segment, and combined with private adjusted_goodness and vote_count
+    columns that collect this worker's writes until they are merged.
+    """
+    state = _worker_state
+    if state["tick"] == tick:
+        return state["users"], state["engine"]
+    state["users"] = None  # Drop the old views before closing their segments
+    segments = state["segments"]
+    columns = {}
+    for name, (segment_name, dtype, size) in spec.items():
+        if segment_name not in segments:
+            segments[segment_name] = shared_memory.SharedMemory(segment_name)
+        columns[name] = np.ndarray(size, dtype, buffer=segments[segment_name].buf)
+    for segment_name in set(segments) - {entry[0] for entry in spec.values()}:
+        segments.pop(segment_name).close()
+    size = len(columns["elo"])
+    columns["adjusted_goodness"] = np.empty(size, dtype=np.float64)
+    columns["vote_count"] = np.zeros(size, dtype=np.int64)
+    users = UserPopulation.view(columns)
+    users.defer_elo()
+    engine = state.get("engine")
+    if engine is None or engine.name != backend:
+        engine = get_engine(backend)
+    engine.begin_tick(users)
+    state.update(tick=tick, users=users, engine=engine)
+    return users, engine
+
+
+def _parallel_vote_chunk(
+    backend, tick, spec, posts, qualities, uniforms, config, traced
+):
+    """
+    Worker side of `ParallelEngine`: vote one chunk of posts.
+
+    Returns:
+        tuple: (ENGINE_COLUMNS name -> array, (2 x n) deferred ELO changes,
+        ids of the voters, their last adjusted goodness, their vote counts,
+        TRACE_DTYPE records of the votes or None when not `traced`)
+    """
+    users, engine = _attach_tick(backend, tick, spec)
+    out = {
+        name: np.empty(len(posts), dtype=METRIC_COLUMNS[name])
+        for name in ENGINE_COLUMNS
+    }
+    trace = VoteTrace() if traced else NULL_TRACE
+    engine.vote_posts(
+        users, posts, qualities, uniforms, config, out, NULL_PROFILER, trace
+    )
+    elo_changes = users.pending_elo()
+    users._pending_elo.clear()
+    voters = np.flatnonzero(users.vote_count)
+    vote_counts = users.vote_count[voters]
+    users.vote_count[voters] = 0
+    return (
+        out,
+        elo_changes,
+        voters,
+        users.adjusted_goodness[voters],
+        vote_counts,
+        trace.take() if traced else None,
+    )
+
+
+class ParallelEngine(Engine):
+    """
+    Runs another backend over disjoint chunks of each tick's posts in a pool
+    of worker processes.
+
+    Needs epoch mode: with the ratings frozen for the whole tick, posts only
+    depend on each other through what they write. The columns a vote reads
+    (elo, goodness, mood_factor) are copied into `shared_memory` once per
+    tick, and each worker votes its chunks against them with a deferred ELO
+    buffer and private adjusted_goodness and vote_count columns. Chunks are
+    merged strictly in post order: ELO deltas join the population's deferred
+    buffer, vote counts are added up, the last adjusted goodness of a voter
+    wins and traced votes are appended. Results are identical to the backend
+    running alone.
+    """
+
+    name = "parallel"
+    SHARED_COLUMNS = ("elo", "goodness", "mood_factor")
+    # Ticks with fewer posts are not worth shipping to the workers
+    MIN_PARALLEL_POSTS = 1024
+    # Chunks per worker and tick, to even out their load
+    CHUNKS_PER_WORKER = 4
+
+    def __init__(self, backend="python", workers=None):
+        self.backend = backend
+        self.workers = workers or os.cpu_count()
+        self.local = get_engine(backend)
+        self._pool = None
+        self._segments = {}
+        self._tick = 0
+
+    def _share(self, users):
+        """Copy the shared columns into shared memory; returns the worker spec."""
+        spec = {}
+        for name in self.SHARED_COLUMNS:
+            # Sized for the full capacity, so growing ticks reuse the segment
+            capacity = getattr(users, "_" + name).nbytes
+            segment = self._segments.get(name)
+            if segment is None or segment.size < capacity:
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+                segment = shared_memory.SharedMemory(create=True, size=capacity)
+                self._segments[name] = segment
+            column = getattr(users, name)
+            np.ndarray(len(column), column.dtype, buffer=segment.buf)[:] = column
+            spec[name] = (segment.name, column.dtype.str, len(column))
+        return spec
+
+    def _merge(self, users, results, trace, start, stop, future):
+        out, elo_changes, voters, adjusted_goodness, vote_counts, records = (
+            future.result()
+        )
+        for name, values in out.items():
+            results[name][start:stop] = values
+        users.add_elo(elo_changes[0].astype(np.intp), elo_changes[1])
+        users.adjusted_goodness[voters] = adjusted_goodness
+        users.vote_count[voters] += vote_counts
+        if records is not None:
+            trace.extend(records)
+
+    def vote_tick(
+        self,
+        users,
+        posts,
+        config,
+        rng,
+        epoch_elo=False,
+        profiler=NULL_PROFILER,
+        trace=NULL_TRACE,
+    ):
+        if not epoch_elo:
+            raise ValueError(
+                "the parallel engine needs epoch_elo: with per-post ELO updates "
+                "every post depends on the one before"
+            )
+        if len(posts) < self.MIN_PARALLEL_POSTS or self.workers < 2:
+            return self.local.vote_tick(
+                users, posts, config, rng, epoch_elo, profiler, trace
+            )
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+
+        results = {
+            name: np.empty(len(posts), dtype=METRIC_COLUMNS[name])
+            for name in ENGINE_COLUMNS
+        }
+        qualities = np.array([post.quality for post in posts], dtype=np.float64)
+        block_size = post_block_size(config)
+        chunk_size = min(
+            self.POST_CHUNK,
+            -(-len(posts) // (self.CHUNKS_PER_WORKER * self.workers)),
+        )
+        users.defer_elo()
+        with profiler.phase("shared_memory"):
+            spec = self._share(users)
+        self._tick += 1
+
+        # Uniforms are drawn chunk by chunk in post order, exactly as the
+        # in-process engines draw them; at most two chunks per worker wait
+        in_flight = deque()
+        with profiler.phase("parallel_voting"):
+            for start in range(0, len(posts), chunk_size):
+                stop = min(start + chunk_size, len(posts))
+                future = self._pool.submit(
+                    _parallel_vote_chunk,
+                    self.backend,
+                    self._tick,
+                    spec,
+                    posts[start:stop],
+                    qualities[start:stop],
+                    rng.random_array((stop - start, block_size)),
+                    config,
+                    trace.active,
+                )
+                in_flight.append((start, stop, future))
+                if len(in_flight) >= 2 * self.workers:
+                    self._merge(users, results, trace, *in_flight.popleft())
+            while in_flight:
+                self._merge(users, results, trace, *in_flight.popleft())
+        with profiler.phase("elo_commit"):
+            users.commit_elo()
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for segment in self._segments.values():
+            segment.close()
+            segment.unlink()
+        self._segments = {}
+
+
+ENGINES = ("python", "numba", "check")
+
+
+def get_engine(name, workers=1):
+    """
+    Engine backend by name.
+
+    Args:
+        name: "python" (reference), "numba" (compiled, needs the optional
+            numba package) or "check" (both, asserting identical results)
+        workers: Run that backend in this many worker processes (see
+            `ParallelEngine`, which needs epoch mode) when above 1
+    """
+    if name not in ENGINES:
+        raise ValueError(f"unknown engine: {name}")
+    if workers > 1:
+        return ParallelEngine(name, workers)
+    if name == "python":
+        return PythonEngine()
+    # Only import the compiled backend, and numba with it, when asked for
+    from numba_engine import NumbaEngine
+
+    if name == "numba":
+        return NumbaEngine()
+    return CrossCheckEngine(PythonEngine(), NumbaEngine())
+
+
+class Checkpoint:
+    """
+    Append-only checkpoint of a `simulate` run in a local directory.
 
-    return votes, decision, sample_size
+    Layout:
+        state.json       Counters, RNG state, config and the metric lengths
+                         that belong to the latest complete checkpoint
+        users-<n>/       One `.npy` file per user column (memory-mappable)
+        metrics/<c>.bin  Metric columns; each checkpoint appends only the
+                         values recorded since the previous one
 
+    `save` takes copies on the calling thread and leaves the file writes to a
+    background thread, so the simulation loop only pays for the copy. A
+    checkpoint becomes current when `state.json` is atomically replaced;
+    anything written after the last replace is ignored by `load`.
 
-def multi_stage_voting(post, all_users):
-    """
-    Implements a two-stage voting mechanism for a given post using ELO tiers.
-    Only considers users with elo > 800.
-    If the number of filtered users is less than 20, a single stage voting is performed by selecting 5 users from the filtered users.
-    Otherwise:
-      - Stage 1: Bottom 70% of the filtered users (select users based on population size)
-      - Stage 2: Top 30% of the filtered users (select 5 users) - only if Stage 1 was inconclusive
-    A decision is considered conclusive if 70% or more of the voters agree.
-    After the final decision is determined, a special stage is executed for users with elo <= 800.
-    This special stage selects 5 users from the low-elo group and adjusts their elo based on whether their vote matches the final decision.
-    Their votes do not affect the overall decision or metrics.
+    Args:
+        directory: Checkpoint directory, created if needed
+        resume: Continue the checkpoint already in `directory`. Otherwise a
+            previous run's checkpoint there is deleted, so that it cannot be
+            mixed with the new one.
     """
 
-    # Calculate the number of stage 1 users based on population size
-    def get_stage1_user_count(population_size):
-        if population_size < 1000:
-            return 5  # Default for small populations
-        else:
-            # For every 1000 users, add 1 to the count, up to a maximum of 10
-            additional_users = min((population_size - 1000) // 1000, 5)
-            return 5 + additional_users
+    STATE = "state.json"
 
-    # Filter users with elo > 800
-    filtered_users = [user for user in all_users if user.elo > 800]
-    if not filtered_users:
-        filtered_users = all_users
+    def __init__(self, directory, resume=False):
+        self.directory = directory
+        self._metrics_dir = os.path.join(directory, "metrics")
+        if not resume:
+            self._clear()
+        os.makedirs(self._metrics_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        self._lengths = {}
+        self._generation = 0
+        if resume and self.exists():
+            state = self.read_state()
+            self._lengths = state["metric_lengths"]
+            self._generation = state["generation"]
 
-    if not filtered_users:
-        return (
-            [],
-            "downvote",
-            0,
-            [],
-            [],
-            [],
-        )  # Added empty lists for stage1, stage2, low_elo participants
+    def _clear(self):
+        """Delete the files of an earlier checkpoint in the directory."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name in (self.STATE, self.STATE + ".tmp"):
+                os.remove(path)
+            elif name.startswith("users-") and os.path.isdir(path):
+                shutil.rmtree(path)
+        if os.path.isdir(self._metrics_dir):
+            shutil.rmtree(self._metrics_dir)
 
-    sorted_users = sorted(filtered_users, key=lambda u: u.elo)
-    N = len(sorted_users)
-    sample_size = 0
+    def exists(self):
+        return os.path.exists(os.path.join(self.directory, self.STATE))
 
-    # Get the number of stage 1 users based on the total population
-    stage1_user_count = get_stage1_user_count(len(all_users))
+    def read_state(self):
+        with open(os.path.join(self.directory, self.STATE)) as f:
+            return json.load(f)
 
-    # Lists to track which users participated in each stage
-    stage1_participants = []
-    stage2_participants = []
-    low_elo_participants = []
+    def save(self, users, metrics, state):
+        """
+        Snapshot `users`, the new values of every `metrics` column and `state`.
 
-    # If there are less than 20 filtered users, perform single stage voting
-    if N < 20:
-        stage_users = (
-            sorted_users
-            if N <= stage1_user_count
-            else random.sample(sorted_users, stage1_user_count)
-        )
-        votes, decision = stage_voting(stage_users, post, forfeit_bonus=0)
-        sample_size += len(votes)
-        stage1_participants = [
-            user for user, _ in votes
-        ]  # Consider these as stage 1 participants
-    else:
-        # Stage 1: Bottom 70% of the filtered users
-        stage1_group = sorted_users[: int(0.7 * N)]
-        stage1_users = (
-            stage1_group
-            if len(stage1_group) <= stage1_user_count
-            else random.sample(stage1_group, stage1_user_count)
+        Args:
+            users: `UserPopulation` to snapshot
+            metrics: `MetricsSink` of the run
+            state: JSON-serializable dict of the loop state
+        """
+        self.wait()
+        columns = {name: getattr(users, name).copy() for name in users.COLUMNS}
+        new_values = {
+            name: metrics.values(name, self._lengths.get(name, 0))
+            for name in METRIC_COLUMNS
+        }
+        self._generation += 1
+        self._lengths = {
+            name: self._lengths.get(name, 0) + len(values)
+            for name, values in new_values.items()
+        }
+        state = {
+            **state,
+            "generation": self._generation,
+            "metric_lengths": self._lengths,
+        }
+        self._pending = self._executor.submit(
+            self._write, self._generation, columns, new_values, state
         )
-        votes1, decision1 = stage_voting(stage1_users, post, forfeit_bonus=0)
-        sample_size += len(votes1)
-        stage1_participants = [user for user, _ in votes1]
 
-        # Check if stage 1 was conclusive (70% or more agreement)
-        upvotes = sum(1 for _, vote in votes1 if vote == "upvote")
-        downvotes = sum(1 for _, vote in votes1 if vote == "downvote")
-        total_votes = len(votes1)
+    def _write(self, generation, columns, new_values, state):
+        users_dir = os.path.join(self.directory, f"users-{generation}")
+        os.makedirs(users_dir, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(users_dir, name + ".npy"), column)
+        for name, values in new_values.items():
+            path = os.path.join(self._metrics_dir, name + ".bin")
+            # Drop whatever an interrupted checkpoint appended past the
+            # previous state before appending again
+            with open(path, "ab") as f:
+                committed = state["metric_lengths"][name] - len(values)
+                f.truncate(committed * values.itemsize)
+                values.tofile(f)
+        tmp_path = os.path.join(self.directory, self.STATE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.directory, self.STATE))
+        previous = os.path.join(self.directory, f"users-{generation - 1}")
+        if os.path.isdir(previous):
+            shutil.rmtree(previous)
 
-        if total_votes > 0:
-            upvote_ratio = upvotes / total_votes
-            downvote_ratio = downvotes / total_votes
+    def wait(self):
+        """Block until the checkpoint being written (if any) is on disk."""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
 
-            if upvote_ratio >= 0.7:
-                votes, decision = votes1, "upvote"
-            elif downvote_ratio >= 0.7:
-                votes, decision = votes1, "downvote"
-            else:
-                # Stage 2: Top 30% of the filtered users (only if stage 1 was inconclusive)
-                stage2_group = sorted_users[int(0.7 * N) :]
-                stage2_users = (
-                    stage2_group
-                    if len(stage2_group) <= 5
-                    else random.sample(stage2_group, 5)
-                )
-                votes2, decision2 = stage_voting(stage2_users, post, forfeit_bonus=0)
-                sample_size += len(votes2)
-                votes, decision = votes2, decision2
-                stage2_participants = [user for user, _ in votes2]
-        else:
-            votes, decision = votes1, decision1
+    def load(self, capacity=0):
+        """
+        Read the latest complete checkpoint.
 
-    # Special stage for users with elo <= 800 (only if final decision is 'upvote' or 'downvote')
-    if decision in ["upvote", "downvote"]:
-        low_elo_users = [user for user in all_users if user.elo <= 800]
-        if low_elo_users:
-            special_users = (
-                low_elo_users
-                if len(low_elo_users) <= 5
-                else random.sample(low_elo_users, 5)
-            )
-            special_votes = []
-            for user in special_users:
-                # Get the user's vote without affecting overall metrics
-                vote_decision = vote(user, post)
-                special_votes.append((user, vote_decision))
-            low_elo_participants = [user for user, _ in special_votes]
-            winners = [user for user, v in special_votes if v == decision]
-            losers = [user for user, v in special_votes if v != decision]
-            if winners and losers:
-                average_winner_elo = sum(u.elo for u in winners) / len(winners)
-                average_loser_elo = sum(u.elo for u in losers) / len(losers)
-                change_per_winner, change_per_loser = elo_update_team(
-                    average_winner_elo,
-                    average_loser_elo,
-                    k=32,
-                    winner_size=len(winners),
-                    loser_size=len(losers),
+        Args:
+            capacity: Minimum capacity of the restored `UserPopulation`
+
+        Returns:
+            tuple: (users, metric columns, state). The metric columns are
+            memory-mapped.
+        """
+        state = self.read_state()
+        users_dir = os.path.join(self.directory, f"users-{state['generation']}")
+        users = UserPopulation.from_columns(
+            {
+                name: np.load(os.path.join(users_dir, name + ".npy"), mmap_mode="r")
+                for name in UserPopulation.COLUMNS
+            },
+            capacity=capacity,
+        )
+        metrics = {}
+        for name, dtype in METRIC_COLUMNS.items():
+            length = state["metric_lengths"][name]
+            metrics[name] = (
+                np.memmap(
+                    os.path.join(self._metrics_dir, name + ".bin"),
+                    dtype=dtype,
+                    mode="r",
+                    shape=(length,),
                 )
-                for user in winners:
-                    user.elo += change_per_winner
-                for user in losers:
-                    user.elo += change_per_loser
+                if length
+                else np.empty(0, dtype=dtype)
+            )
+        return users, metrics, state
 
-    return (
-        votes,
-        decision,
-        sample_size,
-        stage1_participants,
-        stage2_participants,
-        low_elo_participants,
-    )
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def simulate(
+    config=None,
+    seed=None,
+    batch_population_sample=True,
+    progress=True,
+    metrics_dir=None,
+    profiler=NULL_PROFILER,
+    checkpoint_dir=None,
+    checkpoint_interval=600.0,
+    resume=False,
+    epoch_elo=False,
+    engine="python",
+    workers=1,
+    stats=None,
+    stats_interval=None,
+    trace_path=None,
+    trace_stages=TRACE_STAGES,
+    analytic=False,
+):
+    """
+    Grow the population to its maximum size, voting on every new post with both
+    the staged mechanism and the population sample baseline.
+
+    With config.steady_rounds, the run then continues at that size for as
+    many rounds: in each, leave_rate of the users retire (the last users move
+    into their slots, see `UserPopulation.retire`), join_rate new users are
+    spawned into the freed capacity and steady_posts_per_round posts are
+    voted. Rounds record one row of steady_* metrics each and, per post,
+    only the outcome of both mechanisms. They need metrics_dir, which
+    streams these to disk, so memory stays flat however many posts are
+    voted.
+    steady_posts_per_second is the throughput of every round, churn
+    included. A vote trace gets a TRACE_RETIRE record per departing user:
+    user ids in the trace are slots, reused by later users.
 
+    Args:
+        config: `SimulationConfig` for the run (default: SimulationConfig())
+        seed: Seed (an int or a `np.random.SeedSequence`) for the run's
+            `SimulationRNG`; None draws fresh entropy
+        batch_population_sample: Evaluate the population sample baseline for all
+            posts of a growth tick at once (default: True). When False, the
+            baseline runs post by post through `population_sample_voting`.
+        progress: Show a tqdm progress bar (default: True)
+        metrics_dir: Stream the metric columns to this directory instead of
+            keeping them in memory (see `MetricsSink`); the final user
+            columns are saved there too, for `plot_saved_run`
+        profiler: `Profiler` collecting phase timings per growth tick; its
+            largest phases are shown in the progress bar
+        checkpoint_dir: Write a `Checkpoint` here at the end of the first
+            growth tick that finishes `checkpoint_interval` seconds after the
+            previous one, and once more when the run completes. Without
+            resume, an earlier checkpoint in the directory is deleted.
+        checkpoint_interval: Seconds between checkpoints (default: 600)
+        resume: Continue from the checkpoint in checkpoint_dir, if there is
+            one, instead of starting over. The resumed run is bit-for-bit
+            identical to an uninterrupted one; `seed` is ignored and `config`
+            must be None or the checkpointed configuration.
+        epoch_elo: Vote every post of a growth tick against the ELO ratings
+            and tiers from the start of the tick, and apply the accumulated
+            deltas in one pass at its end (see `UserPopulation.defer_elo`).
+            `epoch_drift_report` measures how far this drifts from the
+            default per-post updates.
+        engine: `Engine` backend, or its name (see `get_engine`), that runs
+            the staged voting (default: "python")
+        workers: Vote the posts of each growth tick in this many worker
+            processes sharing the user columns (see `ParallelEngine`); needs
+            epoch_elo and an engine name (default: 1, in process)
+        stats: `OnlineStats` fed with the outcome of every post of both
+            mechanisms; their running and windowed accuracy are shown in the
+            progress bar
+        stats_interval: Also write a log line of `stats` (which must be set)
+            every this many seconds
+        trace_path: Record every vote of both mechanisms in a `VoteTrace`
+            file here (see `read_trace`); checkpoints keep it in step
+        trace_stages: Only trace the votes of these TRACE_STAGES
+        analytic: Also record in expected_correct the exact probability that
+            each staged decision is correct (see `decision_probabilities`),
+            given the tiers at the start of the post's growth tick. The
+            ratings still drift through simulated votes, but accuracy is
+            scored without voting noise. With epoch_elo every post is voted
+            on exactly those tiers; otherwise they drift a little within a
+            tick.
 
-def run_simulation():
-    posts_per_user = 2  # Approximate a more realistic tweet-like frequency
-    max_population = 5000
+    Returns:
+        tuple: (users, metrics), where metrics maps each column of
+        METRIC_COLUMNS to an array (a `MetricsReader` when metrics_dir is set)
+    """
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, resume=resume)
+    state = None
+    if resume and checkpoint is not None and checkpoint.exists():
+        state = checkpoint.read_state()
+        saved_config = SimulationConfig(**state["config"])
+        if config is not None and config != saved_config:
+            raise ValueError(
+                f"config does not match the checkpoint in {checkpoint_dir}: "
+                f"{saved_config}"
+            )
+        config = saved_config
+        if state.get("epoch_elo", False) != epoch_elo:
+            raise ValueError(
+                f"epoch_elo does not match the checkpoint in {checkpoint_dir}"
+            )
+        if state.get("analytic", False) != analytic:
+            raise ValueError(
+                f"analytic does not match the checkpoint in {checkpoint_dir}"
+            )
+        if (trace_path is not None) != ("trace_records" in state):
+            raise ValueError(
+                f"the checkpoint in {checkpoint_dir} was written "
+                + ("without" if trace_path is not None else "with")
+                + " a vote trace"
+            )
+    config = config or DEFAULT_CONFIG
+    if config.steady_rounds and config.steady_posts_per_round < 1:
+        raise ValueError("steady_posts_per_round must be at least 1")
+    if config.steady_rounds and metrics_dir is None:
+        # An in-memory sink would grow with every steady-state post
+        raise ValueError("steady_rounds needs a metrics_dir")
+    owns_engine = isinstance(engine, str)
+    if owns_engine:
+        engine = get_engine(engine, workers)
+    rng = SimulationRNG(seed)
+    trace = NULL_TRACE
+    if trace_path is not None:
+        trace = VoteTrace(
+            trace_path,
+            records=state["trace_records"] if state is not None else 0,
+            stages=trace_stages,
+        )
+    posts_per_user = config.posts_per_user
+    max_population = config.max_population
 
-    with tqdm(total=max_population, desc="Growing user population") as pbar:
-        posts = []
-        upvoted_posts_quality = []
+    with tqdm(
+        total=max_population, desc="Growing user population", disable=not progress
+    ) as pbar:
+        next_post_id = 0
         upvoted_posts_count = 0
         total_votes = 0
         correct_votes = 0
-        correct_votes_stats = []
-        votes_stats = []
-        population_sizes = []
-        sample_sizes = []
-        cumulative_votes_list = []
-        users = []
-
-        # Track participants count from each group
-        stage1_participants_count = []
-        stage2_participants_count = []
-        low_elo_participants_count = []
-
-        # Track population of each group over time
-        stage1_population_sizes = []
-        stage2_population_sizes = []
-        low_elo_population_sizes = []
+
+        # Every per-post and per-tick series goes to the columnar sink
+        metrics = MetricsSink(metrics_dir)
+        record = metrics.append
 
         # New metrics for population sample voting
         pop_sample_total_votes = 0
         pop_sample_correct_votes = 0
-        pop_sample_correct_votes_stats = []
-        pop_sample_sample_sizes = []
 
-        growth_rate = 0.10
         population_increment = 1.0  # Start by adding 1 user at a time
-        while len(users) < max_population:
-            new_count = min(
-                math.ceil(population_increment), max_population - len(users)
+        steady_round = 0
+        # Fractional users carried over to the next round
+        leave_carry = join_carry = 0.0
+
+        if state is None:
+            users = UserPopulation(capacity=max_population)
+        else:
+            users, saved_metrics, state = checkpoint.load(capacity=max_population)
+            for name, values in saved_metrics.items():
+                metrics.extend(name, values)
+            next_post_id = state["next_post_id"]
+            upvoted_posts_count = state["upvoted_posts_count"]
+            total_votes = state["total_votes"]
+            correct_votes = state["correct_votes"]
+            pop_sample_total_votes = state["pop_sample_total_votes"]
+            pop_sample_correct_votes = state["pop_sample_correct_votes"]
+            population_increment = state["population_increment"]
+            steady_round = state.get("steady_round", 0)
+            leave_carry = state.get("leave_carry", 0.0)
+            join_carry = state.get("join_carry", 0.0)
+            rng.setstate(state["rng_state"])
+            if stats is not None:
+                stats.extend("staged", saved_metrics["correct_votes_stats"])
+                stats.extend(
+                    "pop_sample", saved_metrics["pop_sample_correct_votes_stats"]
+                )
+                # Steady-state posts follow every growth post
+                stats.extend("staged", saved_metrics["steady_correct_votes_stats"])
+                stats.extend(
+                    "pop_sample",
+                    saved_metrics["steady_pop_sample_correct_votes_stats"],
+                )
+            pbar.update(len(users))
+
+        def save_checkpoint():
+            traced = {}
+            if trace.active:
+                trace.flush()
+                traced["trace_records"] = len(trace)
+            checkpoint.save(
+                users,
+                metrics,
+                {
+                    "config": asdict(config),
+                    "next_post_id": next_post_id,
+                    "upvoted_posts_count": upvoted_posts_count,
+                    "total_votes": total_votes,
+                    "correct_votes": correct_votes,
+                    "pop_sample_total_votes": pop_sample_total_votes,
+                    "pop_sample_correct_votes": pop_sample_correct_votes,
+                    "population_increment": population_increment,
+                    "steady_round": steady_round,
+                    "leave_carry": leave_carry,
+                    "join_carry": join_carry,
+                    "epoch_elo": epoch_elo,
+                    "analytic": analytic,
+                    "rng_state": rng.getstate(),
+                    **traced,
+                },
             )
-            new_users = [User(i) for i in range(len(users), len(users) + new_count)]
-            users.extend(new_users)
 
-            new_posts = [
-                Post(i)
-                for i in range(len(posts), len(posts) + (posts_per_user * new_count))
-            ]
-            posts.extend(new_posts)
-
-            for post in new_posts:
-                # Record group populations at this point
-                filtered_users = [u for u in users if u.elo > 800]
-                if not filtered_users:
-                    # If no high-ELO users, consider all users as low-ELO
-                    stage1_population_sizes.append(0)
-                    stage2_population_sizes.append(0)
-                    low_elo_population_sizes.append(len(users))
-                else:
-                    sorted_users = sorted(filtered_users, key=lambda u: u.elo)
-                    # Stage 1: Bottom 70%
-                    stage1_group_size = int(0.7 * len(sorted_users))
-                    # Stage 2: Top 30%
-                    stage2_group_size = len(sorted_users) - stage1_group_size
-                    # Low ELO: Users with ELO <= 800
-                    low_elo_group_size = len(users) - len(filtered_users)
-
-                    stage1_population_sizes.append(stage1_group_size)
-                    stage2_population_sizes.append(stage2_group_size)
-                    low_elo_population_sizes.append(low_elo_group_size)
-
-                # Regular staged voting
-                (
-                    votes,
-                    decision,
-                    post_sample_size,
-                    stage1_participants,
-                    stage2_participants,
-                    low_elo_participants,
-                ) = multi_stage_voting(post, users)
-                total_votes += 1  # Count one final decision per post
+        growth_rate = config.growth_rate
+        posts = post_stream(rng, next_post_id)
+        pop_sample_sizes = sample_size_curve(
+            config.confidence, config.margin_of_error, max_population
+        )
+        def vote_posts(new_posts, record_posts=True):
+            """
+            Vote `new_posts` with both mechanisms and update the run counters;
+            their per-post metrics are only recorded with record_posts.
+
+            Returns:
+                tuple: Staged and baseline outcomes (True when correct) and
+                the analytic probabilities (None without analytic)
+            """
+            nonlocal next_post_id, total_votes, correct_votes, upvoted_posts_count
+            nonlocal pop_sample_total_votes, pop_sample_correct_votes
+            qualities = np.array([post.quality for post in new_posts])
+            good = qualities >= 0.5
 
-                # Store participants count from each group
-                stage1_participants_count.append(len(stage1_participants))
-                stage2_participants_count.append(len(stage2_participants))
-                low_elo_participants_count.append(len(low_elo_participants))
+            expected = None
+            if analytic:
+                # Score the tick on the tiers its posts are voted on
+                with profiler.phase("analytic"):
+                    expected = expected_accuracy(users, qualities, config)
+                if record_posts:
+                    metrics.extend("expected_correct", expected)
 
-                is_correct = (decision == "upvote" and post.quality >= 0.5) or (
-                    decision == "downvote" and post.quality < 0.5
+            # Regular staged voting
+            tick = engine.vote_tick(
+                users, new_posts, config, rng, epoch_elo, profiler, trace
+            )
+            upvoted = tick["decisions"] == DECISION_CODES["upvote"]
+            downvoted = tick["decisions"] == DECISION_CODES["downvote"]
+            is_correct = (upvoted & good) | (downvoted & ~good)
+            if record_posts:
+                for name, values in tick.items():
+                    metrics.extend(name, values)
+                metrics.extend(
+                    "post_ids", np.arange(next_post_id, next_post_id + len(new_posts))
+                )
+                metrics.extend("correct_votes_stats", is_correct)
+                metrics.extend("upvoted_posts_quality", qualities[upvoted])
+                # Count one final decision per post
+                metrics.extend(
+                    "cumulative_votes_list",
+                    np.arange(total_votes + 1, total_votes + len(new_posts) + 1),
                 )
+            if stats is not None:
+                stats.extend("staged", is_correct)
+            next_post_id += len(new_posts)
+            total_votes += len(new_posts)
+            correct_votes += int(np.count_nonzero(is_correct))
+            upvoted_posts_count += int(np.count_nonzero(upvoted))
 
-                if is_correct:
-                    correct_votes += 1
-                    correct_votes_stats.append(1)
+            # All-users voting stage
+            with profiler.phase("population_sample"):
+                if batch_population_sample:
+                    # The baseline never touches ELO, so the whole tick votes at once
+                    tick_decisions, tick_sample_sizes = population_sample_voting_batch(
+                        new_posts,
+                        users,
+                        config.confidence,
+                        config.margin_of_error,
+                        sample_sizes=pop_sample_sizes,
+                        rng=rng,
+                        trace=trace,
+                        batch_size=config.sequential_batch_size,
+                    )
                 else:
-                    correct_votes_stats.append(0)
-
-                votes_stats.append((post.id, decision))
-                if decision == "upvote":
-                    upvoted_posts_count += 1
-                    upvoted_posts_quality.append(post.quality)
-
-                cumulative_votes_list.append(total_votes)
-                sample_sizes.append(post_sample_size)
+                    tick_decisions, tick_sample_sizes = [], []
+                    for post in new_posts:
+                        _, all_decision, all_post_sample_size = (
+                            population_sample_voting(
+                                post,
+                                users,
+                                config.confidence,
+                                config.margin_of_error,
+                                sample_sizes=pop_sample_sizes,
+                                rng=rng,
+                                trace=trace,
+                                batch_size=config.sequential_batch_size,
+                            )
+                        )
+                        tick_decisions.append(all_decision)
+                        tick_sample_sizes.append(all_post_sample_size)
+                    tick_decisions = np.array(tick_decisions)
+                    tick_sample_sizes = np.array(tick_sample_sizes)
+            profiler.count("voters_evaluated", int(np.sum(tick_sample_sizes)))
+            pop_sample_correct = ((tick_decisions == "upvote") & good) | (
+                (tick_decisions == "downvote") & ~good
+            )
+            if record_posts:
+                metrics.extend("pop_sample_correct_votes_stats", pop_sample_correct)
+                metrics.extend("pop_sample_sample_sizes", tick_sample_sizes)
+            if stats is not None:
+                stats.extend("pop_sample", pop_sample_correct)
+            pop_sample_total_votes += len(new_posts)
+            pop_sample_correct_votes += int(np.count_nonzero(pop_sample_correct))
+            return is_correct, pop_sample_correct, expected
 
-                # All-users voting stage
-                all_votes, all_decision, all_post_sample_size = (
-                    population_sample_voting(post, users)
+        def log_stats():
+            nonlocal next_stats_log
+            if stats_interval and time.monotonic() >= next_stats_log:
+                tqdm.write(
+                    f"{len(users)} users, {next_post_id} posts: {stats.log_line()}"
                 )
-                pop_sample_total_votes += 1
+                next_stats_log = time.monotonic() + stats_interval
 
-                if (all_decision == "upvote" and post.quality >= 0.5) or (
-                    all_decision == "downvote" and post.quality < 0.5
-                ):
-                    pop_sample_correct_votes += 1
-                    pop_sample_correct_votes_stats.append(1)
-                else:
-                    pop_sample_correct_votes_stats.append(0)
+        next_checkpoint = time.monotonic() + checkpoint_interval
+        next_stats_log = time.monotonic() + (stats_interval or 0)
+        # A run resumed in its steady state may be below max_population
+        while len(users) < max_population and not steady_round:
+            new_count = min(
+                math.ceil(population_increment), max_population - len(users)
+            )
+            reindex_count = users.reindex_count
+            with profiler.phase("spawn_users"):
+                users.spawn(new_count, rng=rng, config=config)
 
-                pop_sample_sample_sizes.append(all_post_sample_size)
+            new_posts = list(itertools.islice(posts, posts_per_user * new_count))
+            vote_posts(new_posts)
+            profiler.count("sorts_performed", users.reindex_count - reindex_count)
 
             # Append the population size once per iteration
-            population_sizes.append(len(users))
+            record("population_sizes", len(users))
+            profiler.observe(users, metrics)
+            profiler.end_tick(population=len(users), posts=len(new_posts))
             pbar.update(new_count)
-            pbar.set_postfix(current=len(users))
+            postfix = {"current": len(users)}
+            if stats is not None:
+                postfix.update(stats.postfix())
+            if profiler.show_postfix:
+                postfix.update(profiler.postfix())
+            pbar.set_postfix(**postfix)
+            log_stats()
             population_increment *= 1 + growth_rate
 
-    print(f"Number of posts upvoted through all voting: {upvoted_posts_count}")
+            if checkpoint is not None and time.monotonic() >= next_checkpoint:
+                save_checkpoint()
+                next_checkpoint = time.monotonic() + checkpoint_interval
+
+    steady_rounds = config.steady_rounds
+    with tqdm(
+        total=steady_rounds,
+        initial=steady_round,
+        desc="Steady state",
+        disable=not progress or not steady_rounds,
+    ) as pbar:
+        steady_posts = 0
+        steady_seconds = 0.0
+        while steady_round < steady_rounds:
+            round_start = time.perf_counter()
+            reindex_count = users.reindex_count
+            with profiler.phase("churn"):
+                # Leavers free slots at the end of the columns, joiners reuse them
+                leave_carry += config.leave_rate * len(users)
+                join_carry += config.join_rate * len(users)
+                leaving = min(int(leave_carry), len(users))
+                leave_carry -= leaving
+                retired = np.array(rng.sample(len(users), leaving), dtype=np.intp)
+                if trace.traces(TRACE_RETIRE):
+                    trace.record(
+                        next_post_id,
+                        retired,
+                        TRACE_RETIRE,
+                        np.zeros(leaving, dtype=bool),
+                        users.elo[retired],
+                    )
+                users.retire(retired)
+                joining = min(int(join_carry), max_population - len(users))
+                join_carry -= int(join_carry)
+                users.spawn(joining, rng=rng, config=config)
+
+            new_posts = list(
+                itertools.islice(posts, config.steady_posts_per_round)
+            )
+            is_correct, pop_sample_correct, expected = vote_posts(
+                new_posts, record_posts=False
+            )
+            profiler.count("sorts_performed", users.reindex_count - reindex_count)
+            elapsed = time.perf_counter() - round_start
+            metrics.extend("steady_correct_votes_stats", is_correct)
+            metrics.extend("steady_pop_sample_correct_votes_stats", pop_sample_correct)
+            record("steady_population_sizes", len(users))
+            record("steady_accuracy", np.mean(is_correct))
+            record("steady_pop_sample_accuracy", np.mean(pop_sample_correct))
+            if expected is not None:
+                record("steady_expected_accuracy", np.mean(expected))
+            record("steady_mean_elo", np.mean(users.elo))
+            record("steady_high_elo_share", np.mean(users.elo > config.elo_threshold))
+            record("steady_posts_per_second", len(new_posts) / elapsed)
+            steady_round += 1
+            steady_posts += len(new_posts)
+            steady_seconds += elapsed
+
+            profiler.observe(users, metrics)
+            profiler.end_tick(
+                round=steady_round, population=len(users), posts=len(new_posts)
+            )
+            pbar.update(1)
+            postfix = {
+                "users": len(users),
+                "posts/s": f"{steady_posts / steady_seconds:,.0f}",
+            }
+            if stats is not None:
+                postfix.update(stats.postfix())
+            if profiler.show_postfix:
+                postfix.update(profiler.postfix())
+            pbar.set_postfix(**postfix)
+            log_stats()
+
+            if checkpoint is not None and time.monotonic() >= next_checkpoint:
+                save_checkpoint()
+                next_checkpoint = time.monotonic() + checkpoint_interval
+
+    if checkpoint is not None:
+        save_checkpoint()
+        checkpoint.close()
+    if owns_engine:
+        engine.close()
+    if trace.active:
+        trace.close()
+    if metrics_dir is not None:
+        users.save(os.path.join(metrics_dir, USERS_FILE))
+    return users, metrics.columns()
+
+
+def print_summary(metrics):
+    correct_votes_stats = metrics["correct_votes_stats"]
+    pop_sample_correct_votes_stats = metrics["pop_sample_correct_votes_stats"]
+    correct_votes = int(np.sum(correct_votes_stats))
+    total_votes = len(correct_votes_stats)
+    pop_sample_correct_votes = int(np.sum(pop_sample_correct_votes_stats))
+    pop_sample_total_votes = len(pop_sample_correct_votes_stats)
+
+    print(
+        "Number of posts upvoted through all voting: "
+        f"{len(metrics['upvoted_posts_quality'])}"
+    )
     print(f"Number of correct votes: {correct_votes}")
     print(f"Total number of votes: {total_votes}")
     print(f"Correct votes: {(correct_votes / total_votes) * 100:.2f}%")
+    if "expected_correct" in metrics and len(metrics["expected_correct"]):
+        print(
+            "Expected correct votes (analytic): "
+            f"{np.mean(metrics['expected_correct']) * 100:.2f}%"
+        )
     print("\nPopulation sample voting statistics:")
     print(f"Number of correct votes: {pop_sample_correct_votes}")
     print(f"Total number of votes: {pop_sample_total_votes}")
     print(
         f"Correct votes: {(pop_sample_correct_votes / pop_sample_total_votes) * 100:.2f}%"
     )
+    if "steady_accuracy" in metrics and len(metrics["steady_accuracy"]):
+        # Every round votes the same number of posts
+        posts_per_second = metrics["steady_posts_per_second"]
+        print(f"\nSteady state ({len(posts_per_second)} rounds):")
+        print(f"Correct votes: {np.mean(metrics['steady_accuracy']) * 100:.2f}%")
+        print(
+            "Population sample correct votes: "
+            f"{np.mean(metrics['steady_pop_sample_accuracy']) * 100:.2f}%"
+        )
+        if len(metrics["steady_expected_accuracy"]):
+            print(
+                "Expected correct votes (analytic): "
+                f"{np.mean(metrics['steady_expected_accuracy']) * 100:.2f}%"
+            )
+        print(
+            f"Final mean ELO: {metrics['steady_mean_elo'][-1]:.1f}, high-ELO share: "
+            f"{metrics['steady_high_elo_share'][-1]:.1%}"
+        )
+        print(
+            "Sustained throughput: "
+            f"{len(posts_per_second) / np.sum(1 / posts_per_second):,.0f} posts/s"
+        )
 
-    plot_distributions(
-        users,
-        upvoted_posts_quality,
-        correct_votes_stats,
-        population_sizes,
-        sample_sizes,
-        cumulative_votes_list,
-        pop_sample_correct_votes_stats,
-        pop_sample_sample_sizes,
-        stage1_participants_count,
-        stage2_participants_count,
-        low_elo_participants_count,
-        stage1_population_sizes,
-        stage2_population_sizes,
-        low_elo_population_sizes,
+
+# Metrics passed on to plot_distributions, in its argument order
+PLOT_METRICS = (
+    "upvoted_posts_quality",
+    "correct_votes_stats",
+    "population_sizes",
+    "sample_sizes",
+    "cumulative_votes_list",
+    "pop_sample_correct_votes_stats",
+    "pop_sample_sample_sizes",
+    "stage1_participants_count",
+    "stage2_participants_count",
+    "low_elo_participants_count",
+    "stage1_population_sizes",
+    "stage2_population_sizes",
+    "low_elo_population_sizes",
+)
+
+
+def run_simulation(
+    config=None,
+    seed=None,
+    batch_population_sample=True,
+    metrics_dir=None,
+    plot=True,
+    plot_output=None,
+    progress=True,
+    profile=None,
+    profile_postfix=False,
+    profile_memory=False,
+    checkpoint_dir=None,
+    checkpoint_interval=600.0,
+    resume=False,
+    epoch_elo=False,
+    engine="python",
+    workers=1,
+    stats_interval=None,
+    trace_path=None,
+    trace_stages=TRACE_STAGES,
+    analytic=False,
+):
+    """
+    Run `simulate`, print the summary and plot the results.
+
+    Live accuracy statistics (`OnlineStats`) are shown in the progress bar,
+    and with `stats_interval` also logged every that many seconds.
+
+    Args:
+        plot: Draw the summary figure (default: True)
+        plot_output: Save the figure here (headless) instead of showing it
+        profile: Write a per-tick and total timing report (JSON) to this path
+        profile_postfix: Show the largest phases in the progress bar while
+            profiling
+        profile_memory: Also record memory use per growth tick in the
+            profile report (see `MemoryProfiler`)
+
+    See `simulate` for the remaining arguments.
+    """
+    profiler = NULL_PROFILER
+    if profile:
+        profiler = (MemoryProfiler if profile_memory else Profiler)(
+            show_postfix=profile_postfix
+        )
+    users, metrics = simulate(
+        config,
+        seed=seed,
+        batch_population_sample=batch_population_sample,
+        progress=progress,
+        metrics_dir=metrics_dir,
+        profiler=profiler,
+        checkpoint_dir=checkpoint_dir,
+        checkpoint_interval=checkpoint_interval,
+        resume=resume,
+        epoch_elo=epoch_elo,
+        engine=engine,
+        workers=workers,
+        stats=OnlineStats(),
+        stats_interval=stats_interval,
+        trace_path=trace_path,
+        trace_stages=trace_stages,
+        analytic=analytic,
     )
+    if profile_memory and profile:
+        profiler.close()
+    print_summary(metrics)
+    if plot:
+        with profiler.phase("plotting"):
+            plot_distributions(
+                users,
+                *(metrics[name] for name in PLOT_METRICS),
+                output=plot_output,
+                expected_correct=metrics["expected_correct"],
+            )
+    if profile:
+        profiler.write(profile)
     return users
 
 
+def _run_replica(config, seed, batch_population_sample):
+    _, metrics = simulate(
+        config,
+        seed=seed,
+        batch_population_sample=batch_population_sample,
+        progress=False,
+    )
+    return metrics
+
+
+def run_replicates(
+    replicas,
+    config=None,
+    seed=None,
+    max_workers=None,
+    ci_level=0.95,
+    batch_population_sample=True,
+):
+    """
+    Run independent simulations across a process pool and aggregate them.
+
+    Each replica gets its own seed stream spawned from `seed`, so results are
+    reproducible and independent of the number of workers.
+
+    Args:
+        replicas: Number of independent simulations
+        config: `SimulationConfig` shared by all replicas
+        seed: Root seed for the replica seed streams (None for fresh entropy)
+        max_workers: Process pool size (default: one per CPU, at most `replicas`)
+        ci_level: Confidence level of the aggregated intervals (default: 0.95)
+        batch_population_sample: Passed on to `simulate`
+
+    Returns:
+        dict: "replicas" maps each metric to a (replicas x length) array, or
+        to a list of per-replica values when lengths differ; "mean", "ci_low"
+        and "ci_high" hold the per-index aggregates of the stacked metrics;
+        "accuracy" and "pop_sample_accuracy" hold per-replica totals with
+        their own mean and interval.
+    """
+    config = config or DEFAULT_CONFIG
+    seeds = np.random.SeedSequence(seed).spawn(replicas)
+    max_workers = min(replicas, max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        runs = list(
+            executor.map(
+                _run_replica,
+                [config] * replicas,
+                seeds,
+                [batch_population_sample] * replicas,
+            )
+        )
+
+    results = {
+        "config": asdict(config),
+        "replicas": {},
+        "mean": {},
+        "ci_low": {},
+        "ci_high": {},
+    }
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        if all(
+            isinstance(value, np.ndarray) and value.shape == values[0].shape
+            for value in values
+        ):
+            stacked = np.stack(values)
+            results["replicas"][name] = stacked
+            mean, low, high = _mean_confidence_interval(stacked, ci_level)
+            results["mean"][name] = mean
+            results["ci_low"][name] = low
+            results["ci_high"][name] = high
+        else:
+            results["replicas"][name] = values
+
+    for name, series in (
+        ("accuracy", "correct_votes_stats"),
+        ("pop_sample_accuracy", "pop_sample_correct_votes_stats"),
+    ):
+        accuracy = np.array([np.mean(run[series]) for run in runs])
+        mean, low, high = _mean_confidence_interval(accuracy, ci_level)
+        results[name] = {"values": accuracy, "mean": mean, "ci": (low, high)}
+    return results
+
+
+def _mean_confidence_interval(samples, ci_level):
+    """Mean and Student-t interval along the first axis of `samples`."""
+    import scipy.stats as st
+
+    samples = np.asarray(samples, dtype=np.float64)
+    mean = samples.mean(axis=0)
+    if len(samples) < 2:
+        return mean, mean, mean
+    sem = samples.std(axis=0, ddof=1) / math.sqrt(len(samples))
+    half_width = st.t.ppf((1 + ci_level) / 2, len(samples) - 1) * sem
+    return mean, mean - half_width, mean + half_width
+
+
+DRIFT_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def _ks_statistic(a, b):
+    """Two-sample Kolmogorov-Smirnov statistic (largest gap between the ECDFs)."""
+    a = np.sort(a)
+    b = np.sort(b)
+    values = np.concatenate([a, b])
+    gap = np.searchsorted(a, values, side="right") / len(a) - np.searchsorted(
+        b, values, side="right"
+    ) / len(b)
+    return float(np.max(np.abs(gap)))
+
+
+def epoch_drift_report(
+    config=None, seed=None, batch_population_sample=True, engine="python"
+):
+    """
+    Run the same configuration and seed with per-post and with epoch ELO
+    updates, and report how far the epoch run drifts.
+
+    Both runs start from the same random stream but diverge after the first
+    ELO change, so the differences include run-to-run noise; compare them
+    with the spread from `run_replicates` before reading much into them.
+
+    Returns:
+        dict: Accuracy of both modes (overall and over the last tenth of the
+        posts) with their difference, and for the final ELO distributions the
+        Kolmogorov-Smirnov statistic, mean, standard deviation and
+        DRIFT_QUANTILES of both modes
+    """
+    runs = {}
+    for mode, epoch_elo in (("sequential", False), ("epoch", True)):
+        users, metrics = simulate(
+            config,
+            seed=seed,
+            batch_population_sample=batch_population_sample,
+            progress=False,
+            epoch_elo=epoch_elo,
+            engine=engine,
+        )
+        correct = np.asarray(metrics["correct_votes_stats"])
+        runs[mode] = {
+            "elo": users.elo.copy(),
+            "accuracy": float(np.mean(correct)),
+            "final_accuracy": float(np.mean(correct[-max(1, len(correct) // 10) :])),
+        }
+
+    sequential, epoch = runs["sequential"], runs["epoch"]
+    report = {"config": asdict(config or DEFAULT_CONFIG), "seed": seed}
+    for name in ("accuracy", "final_accuracy"):
+        report[name] = {
+            "sequential": sequential[name],
+            "epoch": epoch[name],
+            "difference": epoch[name] - sequential[name],
+        }
+    report["elo"] = {
+        "ks_statistic": _ks_statistic(sequential["elo"], epoch["elo"]),
+        **{
+            mode: {
+                "mean": float(runs[mode]["elo"].mean()),
+                "std": float(runs[mode]["elo"].std()),
+                "quantiles": dict(
+                    zip(
+                        map(str, DRIFT_QUANTILES),
+                        np.quantile(runs[mode]["elo"], DRIFT_QUANTILES).tolist(),
+                    )
+                ),
+            }
+            for mode in runs
+        },
+    }
+    return report
+
+
 def printStageResult(
     stage, post, votes, stage_result, users, users_stage_count, num_stage_users
 ):
+    from termcolor import colored
+
     print(f"Stage {stage} voting for Post {post.id} (Quality: {post.quality:.2f}):")
     print(
         f"Total users: {len(users)}; In stage: {users_stage_count}; Selected: {num_stage_users}"
@@ -535,6 +3880,83 @@ def aggregate_votes(votes, chunk_size):
     return aggregated_data
 
 
+MAX_PLOT_POINTS = 2000
+
+
+def _import_pyplot(headless):
+    import matplotlib
+
+    if headless:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def window_sums(values, window_size):
+    """Sums over every length-`window_size` window of `values` in O(n)."""
+    cumulative = np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+    return cumulative[window_size:] - cumulative[:-window_size]
+
+
+def moving_average(values, window_size):
+    """Same as np.convolve(values, ones(w) / w, mode="valid"), in O(n)."""
+    return window_sums(values, window_size) / window_size
+
+
+def decimate(x, y, max_points=MAX_PLOT_POINTS):
+    """
+    Downsample a series for plotting with the largest-triangle-three-buckets
+    algorithm, which keeps the visual shape (peaks and dips) of the series.
+
+    Returns:
+        tuple: (x, y) with at most `max_points` points
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return x, y
+
+    # Interior points are split into max_points - 2 buckets; the first and
+    # last points are always kept
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_stop = edges[bucket + 1], edges[bucket + 2]
+            next_x = x[next_start:next_stop].mean()
+            next_y = y[next_start:next_stop].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Pick the point forming the largest triangle with the previously
+        # selected point and the average of the next bucket
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return x[selected], y[selected]
+
+
+def _plot_series(plt, y, *args, x=None, **kwargs):
+    y = np.asarray(y)
+    if x is None:
+        x = np.arange(len(y))
+    plt.plot(*decimate(x, y), *args, **kwargs)
+
+
+def _smoothing_window(length):
+    if length < 50:
+        return min(10, length)
+    return max(10, int(length / 100))
+
+
 def plot_distributions(
     users,
     upvoted_posts_quality,
@@ -550,141 +3972,107 @@ def plot_distributions(
     stage1_population_sizes,
     stage2_population_sizes,
     low_elo_population_sizes,
+    output=None,
+    expected_correct=None,
 ):
+    """
+    Draw the summary figure of a run.
+
+    Window statistics are computed from cumulative sums in O(n), and long
+    series are decimated to MAX_PLOT_POINTS before they reach matplotlib.
+
+    Args:
+        output: Save the figure to this path with the headless Agg backend
+            instead of opening a window
+        expected_correct: Analytic probability that each staged decision is
+            correct, drawn next to the observed accuracy when not empty
+    """
+    import scipy.stats as st
+
+    plt = _import_pyplot(headless=output is not None)
     plt.figure(figsize=(15, 8))  # Adjusted figure size for 2x3 grid
 
     # Subplot 1: Distribution of Users by Goodness Factor
     plt.subplot(2, 3, 1)
-    plt.hist([user.goodness for user in users], bins=100, edgecolor="black")
+    plt.hist(users.goodness, bins=100, edgecolor="black")
     plt.xlabel("Goodness Factor")
     plt.ylabel("Number of Users")
     plt.title("Distribution of Users by Goodness Factor")
 
     # Subplot 2: Distribution of Users by Elo Rating
     plt.subplot(2, 3, 2)
-    plt.hist([user.elo for user in users], bins=100, edgecolor="black", log=True)
+    plt.hist(users.elo, bins=100, edgecolor="black", log=True)
     plt.xlabel("Elo Rating")
     plt.ylabel("Number of Users")
     plt.title("Distribution of Users by Elo Rating")
 
     # Subplot 3: Comparison of Correct Votes Ratio with Linear Regression
     plt.subplot(2, 3, 3)
-    if len(correct_votes_stats) > 10 and len(pop_sample_correct_votes_stats) > 10:
-        if len(correct_votes_stats) < 50:
-            window_size = min(10, len(correct_votes_stats))
-        else:
-            window_size = max(10, int(len(correct_votes_stats) / 100))
-
-        staged_smoothed = (
-            np.convolve(
-                correct_votes_stats, np.ones(window_size) / window_size, mode="valid"
+    smoothed = len(correct_votes_stats) > 10 and len(pop_sample_correct_votes_stats) > 10
+    if smoothed:
+        staged_series = (
+            moving_average(
+                correct_votes_stats, _smoothing_window(len(correct_votes_stats))
             )
             * 100
         )
-
-        if len(pop_sample_correct_votes_stats) < 50:
-            window_size = min(10, len(pop_sample_correct_votes_stats))
-        else:
-            window_size = max(10, int(len(pop_sample_correct_votes_stats) / 100))
-
-        all_users_smoothed = (
-            np.convolve(
+        pop_series = (
+            moving_average(
                 pop_sample_correct_votes_stats,
-                np.ones(window_size) / window_size,
-                mode="valid",
+                _smoothing_window(len(pop_sample_correct_votes_stats)),
             )
             * 100
         )
+    else:
+        staged_series = np.asarray(correct_votes_stats, dtype=np.float64) * 100
+        pop_series = np.asarray(pop_sample_correct_votes_stats, dtype=np.float64) * 100
 
-        min_len = min(len(staged_smoothed), len(all_users_smoothed))
-        x = np.arange(min_len)
-
-        # Linear regression for staged voting
-        (
-            staged_slope,
-            staged_intercept,
-            staged_r_value,
-            staged_p_value,
-            staged_std_err,
-        ) = st.linregress(x, staged_smoothed[:min_len])
-        staged_r_squared = staged_r_value**2
-
-        # Linear regression for population sample voting
-        pop_slope, pop_intercept, pop_r_value, pop_p_value, pop_std_err = st.linregress(
-            x, all_users_smoothed[:min_len]
-        )
-        pop_r_squared = pop_r_value**2
+    min_len = min(len(staged_series), len(pop_series))
+    x = np.arange(min_len)
 
-        # Plot original data
-        plt.plot(x, staged_smoothed[:min_len], "b-", label="Staged Voting", alpha=0.5)
-        plt.plot(
-            x,
-            all_users_smoothed[:min_len],
-            "r-",
-            label="Population Sample Voting",
-            alpha=0.5,
-        )
+    # Linear regression for staged and population sample voting
+    staged_fit = st.linregress(x, staged_series[:min_len])
+    staged_r_squared = staged_fit.rvalue**2
+    pop_fit = st.linregress(x, pop_series[:min_len])
+    pop_r_squared = pop_fit.rvalue**2
 
-        # Plot regression lines
-        plt.plot(
-            x,
-            staged_slope * x + staged_intercept,
-            "b--",
-        )
-        plt.plot(
-            x,
-            pop_slope * x + pop_intercept,
-            "r--",
+    # Plot original data
+    _plot_series(plt, staged_series[:min_len], "b-", label="Staged Voting", alpha=0.5)
+    _plot_series(
+        plt, pop_series[:min_len], "r-", label="Population Sample Voting", alpha=0.5
+    )
+    if expected_correct is not None and len(expected_correct):
+        expected_series = np.asarray(expected_correct, dtype=np.float64) * 100
+        if smoothed:
+            expected_series = moving_average(
+                expected_series, _smoothing_window(len(expected_series))
+            )
+        _plot_series(
+            plt, expected_series[:min_len], "c-", label="Staged Voting (analytic)"
         )
 
-    else:
-        min_len = min(len(correct_votes_stats), len(pop_sample_correct_votes_stats))
-        x = np.arange(min_len)
-
-        # Linear regression for raw data
-        (
-            staged_slope,
-            staged_intercept,
-            staged_r_value,
-            staged_p_value,
-            staged_std_err,
-        ) = st.linregress(x, np.array(correct_votes_stats[:min_len]) * 100)
-        staged_r_squared = staged_r_value**2
-
-        pop_slope, pop_intercept, pop_r_value, pop_p_value, pop_std_err = st.linregress(
-            x, np.array(pop_sample_correct_votes_stats[:min_len]) * 100
-        )
-        pop_r_squared = pop_r_value**2
-
-        # Plot original data
-        plt.plot(
-            x,
-            np.array(correct_votes_stats[:min_len]) * 100,
-            "b-",
-            label="Staged Voting",
-            alpha=0.5,
-        )
-        plt.plot(
-            x,
-            np.array(pop_sample_correct_votes_stats[:min_len]) * 100,
-            "r-",
-            label="Population Sample Voting",
-            alpha=0.5,
-        )
-
-        # Plot regression lines
-        plt.plot(
-            x,
-            staged_slope * x + staged_intercept,
-            "b--",
-            label=f"Staged Regression (R²={staged_r_squared:.3f})",
-        )
-        plt.plot(
-            x,
-            pop_slope * x + pop_intercept,
-            "r--",
-            label=f"Pop Sample Regression (R²={pop_r_squared:.3f})",
-        )
+    # Plot regression lines (straight, so the end points are enough)
+    ends = np.array([0, max(min_len - 1, 0)])
+    regression_labels = (
+        {}
+        if smoothed
+        else {
+            "staged": f"Staged Regression (R²={staged_r_squared:.3f})",
+            "pop": f"Pop Sample Regression (R²={pop_r_squared:.3f})",
+        }
+    )
+    plt.plot(
+        ends,
+        staged_fit.slope * ends + staged_fit.intercept,
+        "b--",
+        label=regression_labels.get("staged"),
+    )
+    plt.plot(
+        ends,
+        pop_fit.slope * ends + pop_fit.intercept,
+        "r--",
+        label=regression_labels.get("pop"),
+    )
 
     plt.title("Comparison of Correct Votes Ratio")
     plt.xlabel("Stage Index")
@@ -695,19 +4083,16 @@ def plot_distributions(
 
     # Subplot 4: Population Over Time
     plt.subplot(2, 3, 4)
-    plt.plot(range(len(population_sizes)), population_sizes, label="Population Size")
+    _plot_series(plt, population_sizes, label="Population Size")
     plt.xlabel("Stage Index")
     plt.ylabel("Population Size")
     plt.title("Population Over Time")
 
     # Subplot 5: Sample Size Used Over Time
     plt.subplot(2, 3, 5)
-    plt.plot(range(len(sample_sizes)), sample_sizes, color="g", label="Staged Voting")
-    plt.plot(
-        range(len(pop_sample_sample_sizes)),
-        pop_sample_sample_sizes,
-        color="r",
-        label="Population Sample Voting",
+    _plot_series(plt, sample_sizes, color="g", label="Staged Voting")
+    _plot_series(
+        plt, pop_sample_sample_sizes, color="r", label="Population Sample Voting"
     )
     plt.xlabel("Stage Index")
     plt.ylabel("Number of Voters")
@@ -720,56 +4105,39 @@ def plot_distributions(
     # Use a moving window to smooth the data
     window_size = min(50, len(cumulative_votes_list))
     if window_size > 0:
-        # Process with a moving average
-        stage1_ratio = []
-        stage2_ratio = []
-        low_elo_ratio = []
-
-        for i in range(len(cumulative_votes_list) - window_size + 1):
-            # Average group sizes over the window
-            window_stage1_pop = (
-                sum(stage1_population_sizes[i : i + window_size]) / window_size
-            )
-            window_stage2_pop = (
-                sum(stage2_population_sizes[i : i + window_size]) / window_size
-            )
-            window_low_elo_pop = (
-                sum(low_elo_population_sizes[i : i + window_size]) / window_size
-            )
-
-            # Sum of participants in this window
-            window_stage1_votes = sum(stage1_participants_count[i : i + window_size])
-            window_stage2_votes = sum(stage2_participants_count[i : i + window_size])
-            window_low_elo_votes = sum(low_elo_participants_count[i : i + window_size])
+        groups = (
+            (
+                stage1_participants_count,
+                stage1_population_sizes,
+                "b-",
+                "Stage 1 Users (Bottom 70%)",
+            ),
+            (
+                stage2_participants_count,
+                stage2_population_sizes,
+                "r-",
+                "Stage 2 Users (Top 30%)",
+            ),
+            (
+                low_elo_participants_count,
+                low_elo_population_sizes,
+                "g-",
+                "Low-ELO Users (≤800)",
+            ),
+        )
+        for participants_count, population_sizes_, style, label in groups:
+            # Average group size and number of participants in each window
+            window_pop = window_sums(population_sizes_, window_size) / window_size
+            window_votes = window_sums(participants_count, window_size)
 
             # Calculate the vote frequency: votes per user in each group
             # This accounts for population growth by normalizing by the population size
-            if window_stage1_pop > 0:
-                stage1_ratio.append(
-                    (window_stage1_votes / window_stage1_pop) * 100 / window_size
-                )
-            else:
-                stage1_ratio.append(0)
-
-            if window_stage2_pop > 0:
-                stage2_ratio.append(
-                    (window_stage2_votes / window_stage2_pop) * 100 / window_size
-                )
-            else:
-                stage2_ratio.append(0)
-
-            if window_low_elo_pop > 0:
-                low_elo_ratio.append(
-                    (window_low_elo_votes / window_low_elo_pop) * 100 / window_size
-                )
-            else:
-                low_elo_ratio.append(0)
-
-        # Plot the ratios
-        x_range = range(len(stage1_ratio))
-        plt.plot(x_range, stage1_ratio, "b-", label="Stage 1 Users (Bottom 70%)")
-        plt.plot(x_range, stage2_ratio, "r-", label="Stage 2 Users (Top 30%)")
-        plt.plot(x_range, low_elo_ratio, "g-", label="Low-ELO Users (≤800)")
+            ratio = np.zeros(len(window_pop))
+            populated = window_pop > 0
+            ratio[populated] = (
+                (window_votes[populated] / window_pop[populated]) * 100 / window_size
+            )
+            _plot_series(plt, ratio, style, label=label)
 
     plt.xlabel("Stage Index")
     plt.ylabel("Vote Frequency (% of users voting per round)")
@@ -777,7 +4145,212 @@ def plot_distributions(
     plt.legend()
 
     plt.tight_layout()
-    plt.show()
+    if output is None:
+        plt.show()
+    else:
+        plt.savefig(output)
+        plt.close()
+
+
+def plot_saved_run(metrics_dir, output=None):
+    """
+    Render the summary figure from the files `simulate` wrote to `metrics_dir`,
+    reading the metric columns lazily through `MetricsReader`.
+    """
+    metrics = MetricsReader(metrics_dir)
+    users = UserPopulation.load(os.path.join(metrics_dir, USERS_FILE))
+    plot_distributions(
+        users,
+        *(metrics[name] for name in PLOT_METRICS),
+        output=output,
+        expected_correct=(
+            metrics["expected_correct"] if "expected_correct" in metrics else None
+        ),
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Simulate Veridonia's multi-stage voting and ELO reputation system."
+    )
+    config_group = parser.add_argument_group("simulation parameters")
+    # Parameters that only take one of a set of names
+    choices = {"goodness_distribution": sorted(GOODNESS_DISTRIBUTIONS)}
+    for field in fields(SimulationConfig):
+        config_group.add_argument(
+            "--" + field.name.replace("_", "-"),
+            type=field.type,
+            default=field.default,
+            choices=choices.get(field.name),
+            metavar=None if field.name in choices else field.type.__name__.upper(),
+            help=f"(default: {field.default})",
+        )
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible run")
+    parser.add_argument(
+        "--metrics-dir", help="Stream metric columns to this directory"
+    )
+    parser.add_argument(
+        "--plot-output", help="Save the figure to this file instead of showing it"
+    )
+    parser.add_argument(
+        "--no-plot", action="store_true", help="Skip plotting entirely"
+    )
+    parser.add_argument(
+        "--from-metrics",
+        metavar="METRICS_DIR",
+        help="Only render the figure of a run saved with --metrics-dir",
+    )
+    parser.add_argument(
+        "--no-progress", action="store_true", help="Hide the progress bar"
+    )
+    parser.add_argument(
+        "--per-post-baseline",
+        action="store_true",
+        help="Run the population sample baseline post by post instead of per tick",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Write a per-phase timing report (JSON) to this file",
+    )
+    parser.add_argument(
+        "--profile-postfix",
+        action="store_true",
+        help="Show the largest phases in the progress bar while profiling",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also record RSS, tracemalloc totals and the top allocation sites "
+        "per growth tick in the --profile report (slower)",
+    )
+    parser.add_argument(
+        "--checkpoint-dir", help="Periodically checkpoint the run to this directory"
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=600.0,
+        metavar="SECONDS",
+        help="Seconds between checkpoints (default: 600)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the checkpoint in --checkpoint-dir if there is one, "
+        "with the parameters it was started with",
+    )
+    parser.add_argument(
+        "--epoch-elo",
+        action="store_true",
+        help="Apply ELO changes once per growth tick instead of after every post",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="python",
+        help="Backend for the staged voting: the Python reference, the compiled "
+        "numba kernel, or both cross-checked (default: python)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Vote each growth tick's posts in this many worker processes "
+        "sharing the user columns; needs --epoch-elo (default: 1)",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        metavar="SECONDS",
+        help="Log the live accuracy statistics every this many seconds",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Record every vote in a binary trace file (see read_trace)",
+    )
+    parser.add_argument(
+        "--trace-stages",
+        nargs="+",
+        choices=TRACE_STAGES,
+        default=TRACE_STAGES,
+        help="Only trace these stages; stage1 stage2 special is enough for "
+        "replay.py (default: all)",
+    )
+    parser.add_argument(
+        "--analytic",
+        action="store_true",
+        help="Also score every staged decision with its exact probability of "
+        "being correct, free of voting noise",
+    )
+    parser.add_argument(
+        "--epoch-drift",
+        action="store_true",
+        help="Run with per-post and with per-tick ELO updates and print how far "
+        "the two drift apart (JSON)",
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not args.epoch_elo:
+        parser.error("--workers needs --epoch-elo")
+    if args.profile_memory and not args.profile:
+        parser.error("--profile-memory needs --profile")
+    if args.from_metrics:
+        plot_saved_run(args.from_metrics, output=args.plot_output)
+        return None
+    config = SimulationConfig(
+        **{field.name: getattr(args, field.name) for field in fields(SimulationConfig)}
+    )
+    if args.goodness_distribution == "beta" and not 0 < args.goodness_scale < 1:
+        parser.error("--goodness-distribution beta needs 0 < --goodness-scale < 1")
+    if args.goodness_distribution == "exponential" and args.goodness_scale <= 0:
+        parser.error("--goodness-distribution exponential needs --goodness-scale > 0")
+    if args.steady_rounds and not args.metrics_dir:
+        parser.error("--steady-rounds needs --metrics-dir")
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume needs --checkpoint-dir")
+    if args.resume and os.path.exists(
+        os.path.join(args.checkpoint_dir, Checkpoint.STATE)
+    ):
+        # The checkpoint carries its own simulation parameters
+        config = None
+    if args.epoch_drift:
+        report = epoch_drift_report(
+            config,
+            seed=args.seed,
+            batch_population_sample=not args.per_post_baseline,
+            engine=args.engine,
+        )
+        print(json.dumps(report, indent=2))
+        return report
+    return run_simulation(
+        config,
+        seed=args.seed,
+        batch_population_sample=not args.per_post_baseline,
+        metrics_dir=args.metrics_dir,
+        plot=not args.no_plot,
+        plot_output=args.plot_output,
+        progress=not args.no_progress,
+        profile=args.profile,
+        profile_postfix=args.profile_postfix,
+        profile_memory=args.profile_memory,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_interval=args.checkpoint_interval,
+        resume=args.resume,
+        epoch_elo=args.epoch_elo,
+        engine=args.engine,
+        workers=args.workers,
+        stats_interval=args.stats_interval,
+        trace_path=args.trace,
+        trace_stages=args.trace_stages,
+        analytic=args.analytic,
+    )
 
 
-users = run_simulation()
+if __name__ == "__main__":
+    main()
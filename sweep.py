@@ -0,0 +1,262 @@
+"""
+Parameter sweeps over `SimulationConfig` with an on-disk result cache.
+
+A sweep is a list of configurations (from `grid_design` or `random_design`)
+crossed with a list of seeds. Every (config, seed) cell is simulated once in a
+process pool and stored in a local cache keyed by a hash of both and of the
+simulation source (`CODE_VERSION`), so re-running a sweep only computes the
+cells that are still missing, and editing simulation.py invalidates them all.
+
+Example:
+    python sweep.py --grid k_factor=16,32,64 tier_split=0.6,0.7,0.8 --seeds 8
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, fields, replace
+
+import numpy as np
+from tqdm import tqdm
+
+import simulation
+from simulation import DEFAULT_CONFIG, SimulationConfig, simulate
+
+
+def _source_hash(module):
+    with open(module.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Cached cells are only served to the simulation code that produced them
+CODE_VERSION = _source_hash(simulation)
+
+
+def grid_design(base=None, **axes):
+    """
+    Full factorial design over the given parameter axes.
+
+    Args:
+        base: `SimulationConfig` supplying every parameter not swept
+        **axes: Parameter name -> list of values
+
+    Returns:
+        list: One `SimulationConfig` per grid point
+    """
+    base = base or DEFAULT_CONFIG
+    names = list(axes)
+    return [
+        replace(base, **dict(zip(names, values)))
+        for values in itertools.product(*(axes[name] for name in names))
+    ]
+
+
+def random_design(samples, base=None, seed=None, **ranges):
+    """
+    Random design over the given parameter ranges.
+
+    Args:
+        samples: Number of configurations to draw
+        base: `SimulationConfig` supplying every parameter not swept
+        seed: Seed for the design itself
+        **ranges: Parameter name -> (low, high) tuple or list of choices.
+            Integer parameters are drawn uniformly from [low, high], floats
+            uniformly from [low, high).
+
+    Returns:
+        list: `samples` configurations
+    """
+    base = base or DEFAULT_CONFIG
+    types = {field.name: field.type for field in fields(SimulationConfig)}
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(samples):
+        values = {}
+        for name, spec in ranges.items():
+            if isinstance(spec, list):
+                values[name] = rng.choice(spec)
+            elif types[name] is int:
+                values[name] = rng.randint(*spec)
+            else:
+                values[name] = rng.uniform(*spec)
+        configs.append(replace(base, **values))
+    return configs
+
+
+def _cell_json(config, seed):
+    # Cast every value to its declared type so that e.g. k_factor=32 and
+    # k_factor=32.0 hash to the same cell
+    normalized = {
+        field.name: field.type(getattr(config, field.name))
+        for field in fields(config)
+    }
+    return json.dumps(
+        {"config": normalized, "seed": int(seed), "code": CODE_VERSION},
+        sort_keys=True,
+    )
+
+
+class ResultCache:
+    """
+    Directory of `.npz` metric files keyed by a hash of (config, seed) and
+    the `CODE_VERSION` that computed them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(config, seed):
+        payload = _cell_json(config, seed)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, config, seed):
+        return os.path.join(self.directory, self.key(config, seed) + ".npz")
+
+    def __contains__(self, cell):
+        return os.path.exists(self.path(*cell))
+
+    def load(self, config, seed):
+        with np.load(self.path(config, seed)) as data:
+            return {name: data[name] for name in data.files if name != "__meta__"}
+
+    def store(self, config, seed, metrics):
+        meta = _cell_json(config, seed)
+        arrays = {name: np.asarray(value) for name, value in metrics.items()}
+        # Write to a temporary file first so an interrupted sweep never leaves
+        # a truncated cell behind
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, __meta__=np.array(meta), **arrays)
+        os.replace(tmp_path, self.path(config, seed))
+
+
+def _run_cell(config, seed):
+    _, metrics = simulate(config, seed=seed, progress=False)
+    return metrics
+
+
+def run_sweep(
+    configs, seeds=(0,), cache_dir=".sweep_cache", max_workers=None, progress=True
+):
+    """
+    Simulate every (config, seed) cell that is not cached yet.
+
+    Cells are written to the cache as soon as they finish, so an interrupted
+    sweep resumes where it stopped.
+
+    Args:
+        configs: `SimulationConfig` list, e.g. from `grid_design`
+        seeds: Seeds to run for every configuration
+        cache_dir: Directory of the result cache
+        max_workers: Process pool size (default: one per CPU)
+        progress: Show a tqdm progress bar over the missing cells
+
+    Returns:
+        list: (config, seed, metrics) for every cell, in design order
+    """
+    cache = ResultCache(cache_dir)
+    cells = [(config, seed) for config in configs for seed in seeds]
+    missing = list(dict.fromkeys(cell for cell in cells if cell not in cache))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(_run_cell, config, seed): (config, seed)
+                for config, seed in missing
+            }
+            for future in tqdm(
+                as_completed(futures),
+                total=len(futures),
+                desc="Sweeping",
+                disable=not progress,
+            ):
+                config, seed = futures[future]
+                cache.store(config, seed, future.result())
+
+    return [(config, seed, cache.load(config, seed)) for config, seed in cells]
+
+
+def summarize(results):
+    """One row per cell with the swept parameters and headline metrics."""
+    rows = []
+    for config, seed, metrics in results:
+        row = asdict(config)
+        row["seed"] = seed
+        row["accuracy"] = float(np.mean(metrics["correct_votes_stats"]))
+        row["pop_sample_accuracy"] = float(
+            np.mean(metrics["pop_sample_correct_votes_stats"])
+        )
+        row["mean_sample_size"] = float(np.mean(metrics["sample_sizes"]))
+        rows.append(row)
+    return rows
+
+
+def _parse_axis(text):
+    name, _, values = text.partition("=")
+    types = {field.name: field.type for field in fields(SimulationConfig)}
+    if name not in types:
+        raise argparse.ArgumentTypeError(f"unknown parameter: {name}")
+    return name, [types[name](value) for value in values.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--grid",
+        nargs="+",
+        type=_parse_axis,
+        default=[],
+        metavar="NAME=V1,V2",
+        help="Parameter axes of a full grid",
+    )
+    parser.add_argument(
+        "--random",
+        type=int,
+        metavar="N",
+        help="Draw N configurations uniformly between the min and max of each axis",
+    )
+    parser.add_argument("--seeds", type=int, default=1, help="Seeds per configuration")
+    parser.add_argument("--cache-dir", default=".sweep_cache")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Write the summary rows as JSON here")
+    args = parser.parse_args(argv)
+
+    axes = dict(args.grid)
+    if args.random:
+        configs = random_design(
+            args.random,
+            seed=0,
+            **{name: (min(values), max(values)) for name, values in axes.items()},
+        )
+    else:
+        configs = grid_design(**axes)
+
+    rows = summarize(
+        run_sweep(
+            configs,
+            seeds=range(args.seeds),
+            cache_dir=args.cache_dir,
+            max_workers=args.workers,
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+    for row in rows:
+        swept = ", ".join(f"{name}={row[name]}" for name in axes)
+        print(
+            f"{swept or 'default'} seed={row['seed']}: "
+            f"staged {row['accuracy'] * 100:.2f}%, "
+            f"population sample {row['pop_sample_accuracy'] * 100:.2f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from simulation import (
+    Post,
+    SimulationRNG,
+    UserPopulation,
+    cast_votes,
+    subset_vote_distribution,
+    vote_correct_probability,
+)
+
+
+def brute_force_distribution(probabilities, k):
+    """Poisson-binomial distribution averaged over every k-subset."""
+    k = min(k, len(probabilities))
+    total = np.zeros(k + 1)
+    subsets = list(itertools.combinations(probabilities, k))
+    for subset in subsets:
+        distribution = np.array([1.0])
+        for p in subset:
+            distribution = np.convolve(distribution, [1 - p, p])
+        total += distribution
+    return total / len(subsets)
+
+
+@pytest.mark.parametrize(
+    "n, k",
+    [
+        (1, 3),  # Fewer candidates than voters
+        (6, 6),
+        (10, 4),  # Dynamic programme (n < 8k)
+        (20, 2),  # Roots of unity (n >= 8k)
+        (25, 3),
+    ],
+)
+def test_subset_vote_distribution_matches_brute_force(n, k):
+    probabilities = np.random.default_rng(n * 31 + k).random(n)
+    expected = brute_force_distribution(probabilities, k)
+    distribution = subset_vote_distribution(probabilities, k)
+    np.testing.assert_allclose(distribution, expected, rtol=0, atol=1e-12)
+
+
+def test_vote_correct_probability_matches_cast_votes():
+    goodness = np.array([0.0, 0.1, 0.5, 0.79, 0.85, 0.95, 1.0])
+    mood_factor = np.array([0.0, 1.0, 1.0, 0.5, 1.0, 1.0, 1.0])
+    users = UserPopulation()
+    users.spawn(len(goodness))
+    users.goodness[:] = goodness
+    users.mood_factor[:] = mood_factor
+    draws = 200_000
+    voter_ids = np.repeat(np.arange(len(goodness)), draws)
+    post = Post(0)
+    post.quality = 0.8  # An upvote is the correct vote
+    upvotes = cast_votes(users, voter_ids, post, SimulationRNG(3))
+    observed = upvotes.reshape(len(goodness), draws).mean(axis=1)
+    expected = vote_correct_probability(goodness, mood_factor)
+    sigma = np.sqrt(expected * (1 - expected) / draws)
+    assert np.all(np.abs(observed - expected) <= 5 * sigma + 1e-12)
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from simulation import METRIC_COLUMNS, Profiler, SimulationConfig, simulate
+
+CONFIG = SimulationConfig(max_population=600)
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptAt(Profiler):
+    """Stops the run at the end of tick `tick`, before it is checkpointed."""
+
+    def __init__(self, tick):
+        super().__init__()
+        self.tick = tick
+
+    def end_tick(self, **info):
+        super().end_tick(**info)
+        if len(self._ticks) == self.tick:
+            raise Interrupt
+
+
+def assert_same_run(run, reference):
+    users, metrics = run
+    reference_users, reference_metrics = reference
+    for name in users.COLUMNS:
+        np.testing.assert_array_equal(
+            getattr(users, name), getattr(reference_users, name), err_msg=name
+        )
+    for name in METRIC_COLUMNS:
+        np.testing.assert_array_equal(
+            metrics[name], reference_metrics[name], err_msg=name
+        )
+
+
+@pytest.mark.parametrize("epoch_elo", [False, True])
+def test_resume_matches_uninterrupted_run(tmp_path, epoch_elo):
+    reference = simulate(CONFIG, seed=7, progress=False, epoch_elo=epoch_elo)
+    with pytest.raises(Interrupt):
+        simulate(
+            CONFIG,
+            seed=7,
+            progress=False,
+            epoch_elo=epoch_elo,
+            checkpoint_dir=tmp_path,
+            checkpoint_interval=0,
+            profiler=InterruptAt(40),
+        )
+    resumed = simulate(
+        progress=False, epoch_elo=epoch_elo, checkpoint_dir=tmp_path, resume=True
+    )
+    assert_same_run(resumed, reference)
+
+
+def test_resume_of_finished_run_returns_it(tmp_path):
+    finished = simulate(CONFIG, seed=3, progress=False, checkpoint_dir=tmp_path)
+    assert_same_run(
+        simulate(progress=False, checkpoint_dir=tmp_path, resume=True), finished
+    )
+
+
+def test_fresh_run_replaces_old_checkpoint(tmp_path):
+    simulate(
+        SimulationConfig(max_population=300),
+        seed=1,
+        progress=False,
+        checkpoint_dir=tmp_path,
+    )
+    second = simulate(CONFIG, seed=2, progress=False, checkpoint_dir=tmp_path)
+    with open(os.path.join(tmp_path, "state.json")) as f:
+        state = json.load(f)
+    assert state["generation"] == 1
+    assert state["metric_lengths"]["post_ids"] == len(second[1]["post_ids"])
+    assert_same_run(
+        simulate(progress=False, checkpoint_dir=tmp_path, resume=True), second
+    )
+
+
+def test_resume_rejects_other_config(tmp_path):
+    simulate(CONFIG, seed=1, progress=False, checkpoint_dir=tmp_path)
+    with pytest.raises(ValueError):
+        simulate(
+            SimulationConfig(max_population=700),
+            progress=False,
+            checkpoint_dir=tmp_path,
+            resume=True,
+        )
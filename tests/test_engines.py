@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from simulation import (
+    METRIC_COLUMNS,
+    ParallelEngine,
+    SimulationConfig,
+    read_trace,
+    simulate,
+)
+
+CONFIG = SimulationConfig(max_population=1500)
+
+
+def run(tmp_path, engine, epoch_elo=False, workers=1):
+    trace_path = str(tmp_path / f"{engine}-{epoch_elo}-{workers}.bin")
+    users, metrics = simulate(
+        CONFIG,
+        seed=5,
+        progress=False,
+        engine=engine,
+        epoch_elo=epoch_elo,
+        workers=workers,
+        trace_path=trace_path,
+    )
+    return users, metrics, read_trace(trace_path)
+
+
+def assert_same_run(run, reference):
+    users, metrics, trace = run
+    reference_users, reference_metrics, reference_trace = reference
+    for name in users.COLUMNS:
+        np.testing.assert_array_equal(
+            getattr(users, name), getattr(reference_users, name), err_msg=name
+        )
+    for name in METRIC_COLUMNS:
+        np.testing.assert_array_equal(
+            metrics[name], reference_metrics[name], err_msg=name
+        )
+    np.testing.assert_array_equal(trace, reference_trace)
+
+
+@pytest.mark.parametrize("epoch_elo", [False, True])
+def test_numba_engine_matches_python(tmp_path, epoch_elo):
+    pytest.importorskip("numba")
+    assert_same_run(
+        run(tmp_path, "numba", epoch_elo), run(tmp_path, "python", epoch_elo)
+    )
+
+
+def test_check_engine_runs_both_backends(tmp_path):
+    pytest.importorskip("numba")
+    assert_same_run(run(tmp_path, "check"), run(tmp_path, "python"))
+
+
+@pytest.mark.parametrize("engine", ["python", "numba"])
+def test_parallel_engine_matches_single_process(tmp_path, monkeypatch, engine):
+    if engine == "numba":
+        pytest.importorskip("numba")
+    # Ship every tick to the workers, not only the large ones
+    monkeypatch.setattr(ParallelEngine, "MIN_PARALLEL_POSTS", 0)
+    assert_same_run(
+        run(tmp_path, engine, epoch_elo=True, workers=2),
+        run(tmp_path, engine, epoch_elo=True),
+    )
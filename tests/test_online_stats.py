@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from simulation import AccuracyStream, OnlineStats
+
+
+def outcomes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    # A drifting accuracy, so that the trend is not zero
+    return (rng.random(count) < np.linspace(0.6, 0.9, count)).astype(np.int8)
+
+
+def assert_same_stream(stream, reference):
+    assert stream.count == reference.count
+    for name in ("mean", "ewma", "windowed", "variance", "trend"):
+        assert getattr(stream, name) == pytest.approx(
+            getattr(reference, name), rel=1e-9, abs=1e-12
+        ), name
+
+
+def test_statistics_match_batch_formulas():
+    values = outcomes(5000)
+    stream = AccuracyStream(window=1000, alpha=0.01)
+    stream.extend(values)
+    assert stream.mean == pytest.approx(values.mean())
+    assert stream.variance == pytest.approx(values.var(ddof=1))
+    assert stream.standard_error == pytest.approx(
+        values.std(ddof=1) / np.sqrt(len(values))
+    )
+    assert stream.windowed == pytest.approx(values[-1000:].mean())
+    assert stream.trend == pytest.approx(
+        np.polyfit(np.arange(len(values)), values, 1)[0]
+    )
+    ewma = float(values[0])
+    for value in values[1:]:
+        ewma += 0.01 * (value - ewma)
+    assert stream.ewma == pytest.approx(ewma)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_merged_batches_match_post_by_post_updates(seed):
+    values = outcomes(4000, seed)
+    reference = AccuracyStream(window=700)
+    for value in values:
+        reference.update(value)
+    # Uneven batches, including empty ones and ones longer than the window
+    cuts = np.sort(np.random.default_rng(seed).integers(0, len(values), 12))
+    stream = AccuracyStream(window=700)
+    for batch in np.split(values, cuts):
+        stream.extend(batch)
+    assert_same_stream(stream, reference)
+
+
+def test_online_stats_keep_one_stream_per_mechanism():
+    stats = OnlineStats(window=100)
+    stats.extend("staged", outcomes(300, 1))
+    stats.extend("pop_sample", outcomes(200, 2))
+    summary = stats.summary()
+    assert summary["staged"]["posts"] == 300
+    assert summary["pop_sample"]["posts"] == 200
+    assert set(stats.postfix()) == set(OnlineStats.STREAMS)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from replay import VoteLog, replay, tick_first_posts
+from simulation import SimulationConfig, read_trace, simulate
+
+REPLAY_STAGES = ("stage1", "stage2", "special")
+
+
+def traced_run(tmp_path, config, epoch_elo=False, stages=REPLAY_STAGES):
+    path = str(tmp_path / "votes.bin")
+    users, metrics = simulate(
+        config,
+        seed=11,
+        progress=False,
+        epoch_elo=epoch_elo,
+        trace_path=path,
+        trace_stages=stages,
+    )
+    return users, metrics, VoteLog.from_file(path)
+
+
+@pytest.mark.parametrize("forfeit_bonus", [0, 5])
+def test_replay_reproduces_final_ratings(tmp_path, forfeit_bonus):
+    config = SimulationConfig(max_population=800, forfeit_bonus=forfeit_bonus)
+    users, _, log = traced_run(tmp_path, config)
+    elo = replay(
+        log,
+        k=config.k_factor,
+        forfeit_bonus=forfeit_bonus,
+        initial_elo=config.initial_elo,
+        population_size=len(users),
+    )
+    np.testing.assert_array_equal(elo, users.elo)
+
+
+def test_epoch_replay_reproduces_final_ratings(tmp_path):
+    config = SimulationConfig(max_population=800)
+    users, metrics, log = traced_run(tmp_path, config, epoch_elo=True)
+    tick_starts = tick_first_posts(
+        metrics["population_sizes"], len(metrics["post_ids"])
+    )
+    elo = replay(
+        log,
+        k=config.k_factor,
+        population_size=len(users),
+        tick_starts=tick_starts,
+    )
+    np.testing.assert_array_equal(elo, users.elo)
+
+
+def test_replay_ignores_population_sample_records(tmp_path):
+    config = SimulationConfig(max_population=500)
+    users, _, log = traced_run(tmp_path, config)
+    full_path = str(tmp_path / "full.bin")
+    simulate(config, seed=11, progress=False, trace_path=full_path)
+    full = VoteLog(read_trace(full_path))
+    np.testing.assert_array_equal(full.users, log.users)
+    np.testing.assert_array_equal(full.kinds, log.kinds)
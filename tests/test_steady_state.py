@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from replay import VoteLog
+from simulation import (
+    METRIC_COLUMNS,
+    EloRankIndex,
+    OnlineStats,
+    Profiler,
+    SimulationConfig,
+    SimulationRNG,
+    UserPopulation,
+    read_trace,
+    simulate,
+)
+
+CONFIG = SimulationConfig(
+    max_population=600,
+    steady_rounds=12,
+    steady_posts_per_round=200,
+    leave_rate=0.05,
+    join_rate=0.03,
+)
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptAtRound(Profiler):
+    def __init__(self, round):
+        super().__init__()
+        self.round = round
+
+    def end_tick(self, **info):
+        super().end_tick(**info)
+        if info.get("round") == self.round:
+            raise Interrupt
+
+
+def test_retire_keeps_ids_dense_and_index_in_sync():
+    rng = SimulationRNG(1)
+    users = UserPopulation()
+    users.spawn(3000, rng=rng)
+    users.reindex()
+    users.add_elo(np.arange(3000), 100 * rng.random_array(3000))
+    capacity = users._capacity
+    # Small departures re-key the index, large ones rebuild it
+    for leaving in (10, 200, 1500):
+        retired = rng.sample(len(users), leaving)
+        kept = np.setdiff1d(np.arange(len(users)), retired)
+        before = sorted(zip(users.elo[kept], users.goodness[kept]))
+        users.retire(retired)
+        assert sorted(zip(users.elo, users.goodness)) == before
+        reference = EloRankIndex(range(len(users)), users.elo)
+        assert users.rank_index.ids(0, len(users)) == reference.ids(0, len(users))
+        users.spawn(leaving // 2, rng=rng)
+    assert users._capacity == capacity
+
+
+def test_steady_state_needs_metrics_dir():
+    with pytest.raises(ValueError):
+        simulate(CONFIG, seed=1, progress=False)
+
+
+def test_steady_state_resume_matches_uninterrupted_run(tmp_path):
+    stats = OnlineStats()
+    users, metrics = simulate(
+        CONFIG, seed=4, progress=False, metrics_dir=tmp_path / "ref", stats=stats
+    )
+    assert len(metrics["steady_accuracy"]) == CONFIG.steady_rounds
+    with pytest.raises(Interrupt):
+        simulate(
+            CONFIG,
+            seed=4,
+            progress=False,
+            metrics_dir=tmp_path / "run",
+            checkpoint_dir=tmp_path / "ckpt",
+            checkpoint_interval=0,
+            profiler=InterruptAtRound(5),
+            stats=OnlineStats(),
+        )
+    resumed_stats = OnlineStats()
+    resumed_users, resumed_metrics = simulate(
+        progress=False,
+        metrics_dir=tmp_path / "run",
+        checkpoint_dir=tmp_path / "ckpt",
+        resume=True,
+        stats=resumed_stats,
+    )
+    np.testing.assert_array_equal(resumed_users.elo, users.elo)
+    for name in METRIC_COLUMNS:
+        if name != "steady_posts_per_second":  # Wall-clock dependent
+            np.testing.assert_array_equal(
+                resumed_metrics[name], metrics[name], err_msg=name
+            )
+    for name, stream in stats.streams.items():
+        resumed = resumed_stats.streams[name]
+        assert resumed.count == stream.count
+        assert resumed.mean == pytest.approx(stream.mean, rel=1e-12)
+
+
+def test_replay_refuses_churned_traces(tmp_path):
+    trace_path = str(tmp_path / "votes.bin")
+    simulate(
+        CONFIG,
+        seed=2,
+        progress=False,
+        metrics_dir=tmp_path / "run",
+        trace_path=trace_path,
+        trace_stages=("stage1", "stage2", "special"),
+    )
+    with pytest.raises(ValueError, match="churn"):
+        VoteLog(read_trace(trace_path))